@@ -0,0 +1,42 @@
+"""add reconciliation snapshots table
+
+Revision ID: 9c2e7d41b5a3
+Revises: 06f65bcce3ec
+Create Date: 2026-10-17 10:12:40.318562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2e7d41b5a3'
+down_revision: Union[str, Sequence[str], None] = '06f65bcce3ec'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reconciliation_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('archive_date', sa.String(length=50), nullable=False),
+    sa.Column('username', sa.String(length=100), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=False),
+    sa.Column('created_at', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('reconciliation_snapshots', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_reconciliation_snapshots_archive_date'), ['archive_date'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('reconciliation_snapshots', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_reconciliation_snapshots_archive_date'))
+
+    op.drop_table('reconciliation_snapshots')
@@ -29,6 +29,28 @@ RESERVATION_JSON_PATH = os.path.join(JSON_FOLDER, 'reservation_cache.json')
 # --- Carpeta Instance para datos de aplicación ---
 INSTANCE_FOLDER = os.path.join(PROJECT_ROOT, 'instance')
 
+# --- Caché compartido entre workers (Arrow IPC mapeado en memoria) ---
+CACHE_FOLDER = os.path.join(INSTANCE_FOLDER, 'cache')
+CACHE_MANIFEST_PATH = os.path.join(CACHE_FOLDER, 'cache_manifest.json')
+CACHE_LOCK_PATH = os.path.join(CACHE_FOLDER, 'cache.lock')
+# Señales de cambio de ocupación (el mtime avisa a los demás workers)
+OCCUPANCY_LOGS_SIGNAL_PATH = os.path.join(CACHE_FOLDER, 'occupancy_logs.signal')
+OCCUPANCY_MASTER_SIGNAL_PATH = os.path.join(CACHE_FOLDER, 'occupancy_master.signal')
+# Estado de la última sincronización maestro -> SQL (Item_Code + hash por fila) para el diff
+MASTER_SYNC_STATE_PATH = os.path.join(CACHE_FOLDER, 'master_sync_state.parquet')
+# Diario de I.R. con logs modificados (conciliación incremental entre workers)
+RECONCILIATION_DIRTY_JOURNAL_PATH = os.path.join(CACHE_FOLDER, 'reconciliation_dirty.jsonl')
+# Mapa normalizado GRN -> (I.R., Waybill) que usan la conciliación y el caché de la 280
+GRN_IR_MAP_PATH = os.path.join(CACHE_FOLDER, 'grn_ir_map.arrow')
+# Estado de trabajos en segundo plano (un JSON por trabajo, visible desde cualquier worker)
+JOBS_FOLDER = os.path.join(CACHE_FOLDER, 'jobs')
+# Archivos generados por los trabajos de exportación (reutilizables mientras no cambien los datos)
+EXPORTS_FOLDER = os.path.join(CACHE_FOLDER, 'exports')
+# Señal de cambios en usuarios/permisos (invalida el caché de permisos en todos los workers)
+USERS_SIGNAL_PATH = os.path.join(CACHE_FOLDER, 'users.signal')
+# Índices (dataset, clave, hash) por generación para la sincronización delta de los handhelds
+MASTER_SYNC_FOLDER = os.path.join(CACHE_FOLDER, 'master_sync')
+
 
 # --- Configuración de la Base de Datos ---
 # Detectar entorno: 'development' usa SQLite, 'production' usa MySQL
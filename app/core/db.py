@@ -1,3 +1,4 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from app.core.config import ASYNC_DB_URL
@@ -30,6 +31,17 @@ engine = create_async_engine(
     **engine_kwargs
 )
 
+if ASYNC_DB_URL.startswith("sqlite"):
+    # El driver sqlite3 no emite BEGIN hasta el primer INSERT/UPDATE: un SAVEPOINT previo (begin_nested)
+    # quedaría como transacción externa y su RELEASE confirmaría todo. SQLAlchemy controla el BEGIN.
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_disable_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _sqlite_explicit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
 # Fábrica de sesiones
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
@@ -0,0 +1,58 @@
+"""
+Middleware ASGI puro que reúne el trabajo común a cada request HTTP:
+esquema real detrás del proxy (X-Forwarded-Proto), cabecera HSTS en HTTPS y el
+chequeo periódico de la generación del caché compartido de CSV.
+Reemplaza a SchemeMiddleware, HSTSMiddleware y CSVCacheReloadMiddleware (BaseHTTPMiddleware),
+que por request agregaban una tarea y envolvían el stream de la respuesta tres veces.
+"""
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services import csv_handler
+
+HSTS_VALUE = 'max-age=63072000; includeSubDomains; preload'  # 2 años
+
+
+class RequestPipelineMiddleware:
+    """
+    - Scheme: si existe la cabecera 'x-forwarded-proto' esa es la verdad y se escribe en el scope.
+    - HSTS: se agrega a la respuesta cuando el esquema (ya corregido) es https.
+    - Caché CSV: cada `check_interval` segundos cambia a la última generación publicada
+      si este worker quedó atrás (solo compara el contador del manifiesto).
+    """
+
+    def __init__(self, app: ASGIApp, check_interval: int = 5):
+        self.app = app
+        self.check_interval = check_interval
+        self.last_check = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # 1. Scheme real (detrás de Nginx)
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-proto":
+                scope["scheme"] = value.decode("latin-1")
+                break
+
+        # 2. Generación del caché compartido
+        current_time = time.time()
+        if current_time - self.last_check > self.check_interval:
+            self.last_check = current_time
+            await csv_handler.refresh_generation()
+
+        # 3. HSTS solo para HTTPS: sin envolver send en el resto de los requests
+        if scope.get("scheme", "http") != "https":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_hsts(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["Strict-Transport-Security"] = HSTS_VALUE
+            await send(message)
+
+        await self.app(scope, receive, send_with_hsts)
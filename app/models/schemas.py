@@ -89,3 +89,14 @@ class GRNBulkDeleteRequest(BaseModel):
     """Modelo para la eliminación masiva de GRNs."""
     grn_numbers: List[str]
     password: str
+
+class SyncPushRecord(BaseModel):
+    """Registro pendiente de un handheld (cola pending_sync de offlineDb)."""
+    client_id: str
+    collection: str  # 'inbound' o 'planner'
+    payload: dict
+    edit_id: Optional[int] = None  # ID real del log si es una edición
+
+class SyncPushRequest(BaseModel):
+    """Lote de registros pendientes para /api/sync/push."""
+    records: List[SyncPushRecord] = Field(..., max_length=500)
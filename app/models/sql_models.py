@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, Numeric
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, Numeric, LargeBinary
+from sqlalchemy.dialects.mysql import LONGBLOB
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from app.core.db import Base
 from typing import Optional
@@ -267,6 +268,16 @@ class ReconciliationHistory(Base) :
     username: Mapped[str] = mapped_column(String(100))
     timestamp: Mapped[str] = mapped_column(String(50), default=lambda: datetime.datetime.now(datetime.timezone.utc).isoformat())
 
+class ReconciliationSnapshot(Base):
+    """Snapshot de conciliación comprimido: las filas de un lote en un blob Parquet (zstd)."""
+    __tablename__ = 'reconciliation_snapshots'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    archive_date: Mapped[str] = mapped_column(String(50), index=True) # ID del lote (mismo formato que reconciliation_history)
+    username: Mapped[str] = mapped_column(String(100))
+    row_count: Mapped[int] = mapped_column(Integer)
+    payload: Mapped[bytes] = mapped_column(LargeBinary().with_variant(LONGBLOB(), "mysql"))
+    created_at: Mapped[str] = mapped_column(String(50), default=lambda: datetime.datetime.now(datetime.timezone.utc).isoformat())
+
 # --- Modelos de IA y Aprendizaje ---
 
 class AIItemPattern(Base):
@@ -2,7 +2,7 @@
 Router para endpoints administrativos simplificado y unificado.
 """
 from fastapi import APIRouter, Request, Form, Depends, HTTPException, Body, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse
 from pydantic import BaseModel
 from typing import List
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -11,19 +11,19 @@ from app.core.db import get_db
 from app.utils.auth import (
     get_all_users, approve_user_by_id, delete_user_by_id, 
     reset_user_password, get_user_by_id, admin_login_required,
-    permission_required
+    permission_required, invalidate_user_permissions
 )
 from app.models.sql_models import User, BinLocation, SlottingRule
 from sqlalchemy import update
 from app.core.config import ADMIN_PASSWORD, PROJECT_ROOT, SLOTTING_PARAMS_PATH
 from app.core.templates import templates
 from app.services.csv_handler import load_csv_data
+from app.services.slotting_service import slotting_service
 from app.core.limiter import limiter
 import orjson
 import os
 
 import datetime
-from io import BytesIO
 
 # Usaremos un solo router para evitar confusiones en main.py
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -135,12 +135,8 @@ async def get_slotting_config(admin: str = Depends(permission_required("inventor
 
 @router.post("/slotting-config")
 async def update_slotting_config(data: dict = Body(...), admin: str = Depends(permission_required("inventory")), db: AsyncSession = Depends(get_db)):
-    """Guarda en JSON y sincroniza con la DB SQL."""
-    # 1. Guardar JSON
-    with open(SLOTTING_PARAMS_PATH, 'wb') as f: 
-        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
-    
-    # 2. Sincronizar con SQL (Ubicaciones)
+    """Sincroniza con la DB SQL y, confirmado el commit, guarda el JSON."""
+    # 1. Sincronizar con SQL (Ubicaciones)
     storage = data.get("storage", {})
     if storage:
         for code, info in storage.items():
@@ -165,7 +161,7 @@ async def update_slotting_config(data: dict = Body(...), admin: str = Depends(pe
                     score=info.get("score", 0)
                 ))
 
-    # 3. Sincronizar con SQL (Reglas de Rotación)
+    # 2. Sincronizar con SQL (Reglas de Rotación)
     turnover = data.get("turnover", {})
     if turnover:
         for sic, info in turnover.items():
@@ -185,6 +181,12 @@ async def update_slotting_config(data: dict = Body(...), admin: str = Depends(pe
                 ))
 
     await db.commit()
+
+    # 3. Guardar JSON recién después del commit: su mtime es la señal con la que los demás workers
+    # rehacen el layout desde bin_locations, y antes del commit lo leerían con las filas viejas
+    with open(SLOTTING_PARAMS_PATH, 'wb') as f: 
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    slotting_service.invalidate_layout_cache()
     return {"message": "Configuración guardada y sincronizada con base de datos"}
 
 @router.get("/slotting-template")
@@ -206,18 +208,10 @@ async def get_slotting_template(admin: str = Depends(permission_required("invent
     except: pass
     
     import polars as pl
-    import openpyxl
+    from app.services import excel_export
     df = pl.DataFrame(data_list if data_list else [{"BIN":"EJM-01-01", "ZONA":"ALMACEN", "PASILLO":"01", "NIVEL":1, "SPOT":"Hot", "SCORE": 10}])
     df = df.sort("BIN")
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.append(df.columns)
-    for row in df.iter_rows():
-        ws.append(list(row))
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return Response(content=output.getvalue(), media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers={"Content-Disposition": "attachment; filename=layout_almacen.xlsx"})
+    return await excel_export.xlsx_response(df, "layout_almacen.xlsx")
 
 @router.post("/slotting-upload")
 async def upload_slotting_config(file: UploadFile = File(...), admin: str = Depends(permission_required("inventory")), db: AsyncSession = Depends(get_db)):
@@ -281,10 +275,11 @@ async def upload_slotting_config(file: UploadFile = File(...), admin: str = Depe
                     config["turnover"] = old_config.get("turnover", {})
                 except: pass
             
+        await db.commit()
+        # El JSON se escribe después del commit: su mtime dispara la recarga del layout en los demás workers
         with open(SLOTTING_PARAMS_PATH, 'wb') as f: 
             f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
-            
-        await db.commit()
+        slotting_service.invalidate_layout_cache()
         return {"message": f"Cargadas {len(new_storage)} ubicaciones correctamente"}
     except Exception as e:
         await db.rollback()
@@ -343,6 +338,7 @@ async def update_user_permissions_api(user_id: int, data: dict = Body(...), db:
     stmt = update(User).where(User.id == user_id).values(permissions=perms_str)
     result = await db.execute(stmt)
     await db.commit()
+    invalidate_user_permissions()
     
     if result.rowcount > 0:
         return ORJSONResponse(content={"success": True, "message": "Permisos actualizados"})
@@ -6,11 +6,14 @@ from app.core.db import get_db
 from app.utils.auth import get_current_user, login_required
 from app.services import db_logs, csv_handler, db_counts, reconciliation_service
 from app.services.slotting_service import slotting_service
+from app.services.reconciliation_engine import reconciliation_engine
+from app.services.job_registry import job_registry
 from app.core.config import ASYNC_DB_URL
 from app.models.sql_models import PickingAudit, PickingAuditItem, PickingPackageItem, CountSession, CycleCountRecording, ReconciliationHistory, GRNMaster
 
 from typing import List, Optional, Any, Dict
 from pydantic import BaseModel
+import polars as pl
 
 router = APIRouter(prefix="/api/views", tags=["api_views"])
 
@@ -87,33 +90,31 @@ async def get_reconciliation_data(
     request: Request,
     archive_date: Optional[str] = None, 
     snapshot_date: Optional[str] = None,
+    verify: bool = False,
     username: str = Depends(login_required),
     db: AsyncSession = Depends(get_db)
 ):
     try:
         # 0. Obtener lista de versiones disponibles
         archive_versions = await db_logs.get_archived_versions_db_async(db)
-        snapshot_versions_res = await db.execute(select(distinct(ReconciliationHistory.archive_date)).order_by(desc(ReconciliationHistory.archive_date)))
-        snapshot_versions = [v for v in snapshot_versions_res.scalars().all()]
+        snapshot_versions = await reconciliation_service.get_snapshot_versions(db)
 
         # 1. Si se solicita un Snapshot (Congelado)
         if snapshot_date:
-            stmt = select(ReconciliationHistory).where(ReconciliationHistory.archive_date == snapshot_date)
-            res = await db.execute(stmt)
-            rows = res.scalars().all()
+            snapshot_df = await reconciliation_service.load_snapshot(db, snapshot_date)
             
-            result_data = [{
-                "Import_Reference": r.import_reference,
-                "Waybill": r.waybill,
-                "GRN": r.grn,
-                "Codigo_Item": r.item_code,
-                "Descripcion": r.description,
-                "Ubicacion": "",
-                "Reubicado": "",
-                "Cant_Esperada": r.qty_expected,
-                "Cant_Recibida": r.qty_received,
-                "Diferencia": r.difference
-            } for r in rows]
+            result_data = snapshot_df.select([
+                pl.col("import_reference").alias("Import_Reference"),
+                pl.col("waybill").alias("Waybill"),
+                pl.col("grn").alias("GRN"),
+                pl.col("item_code").alias("Codigo_Item"),
+                pl.col("description").alias("Descripcion"),
+                pl.lit("").alias("Ubicacion"),
+                pl.lit("").alias("Reubicado"),
+                pl.col("qty_expected").alias("Cant_Esperada"),
+                pl.col("qty_received").alias("Cant_Recibida"),
+                pl.col("difference").alias("Diferencia")
+            ]).to_dicts()
 
             return {
                 "data": result_data,
@@ -123,6 +124,9 @@ async def get_reconciliation_data(
             }
 
         # 2. Lógica de cálculo (Tiempo real o logs archivados) usando el servicio
+        if verify and not archive_date:
+            # Modo verificación: compara el resultado incremental con un recálculo completo
+            await reconciliation_engine.verify_consistency(db)
         result_data = await reconciliation_service.get_reconciliation_calculations(db, archive_date)
         
         return {
@@ -163,6 +167,14 @@ async def archive_reconciliation_snapshot(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/reconciliation/snapshot_jobs/{job_id}")
+async def get_snapshot_job_status(job_id: str, username: str = Depends(login_required)):
+    """Estado de un snapshot en segundo plano (pending, running, success o error)."""
+    job = job_registry.get(job_id)
+    if job is None or job.get("kind") != "reconciliation_snapshot":
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
 @router.get('/view_picking_audits', response_model=List[PickingAuditSummary])
 async def view_picking_audits_api(request: Request, username: str = Depends(login_required), db: AsyncSession = Depends(get_db)):
     # Usar selectinload para cargar items y package_items en una sola consulta eficiente
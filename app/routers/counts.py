@@ -3,10 +3,7 @@ import datetime
 import polars as pl
 import os
 import orjson
-from io import BytesIO
-import openpyxl
-from openpyxl.utils import get_column_letter
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import ORJSONResponse
 from typing import List, Optional, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -14,7 +11,7 @@ from sqlalchemy import select, delete, update
 
 from app.core.db import get_db
 from app.models.sql_models import CountSession, CycleCountRecording, MasterItem, StockCount
-from app.services import db_counts, csv_handler
+from app.services import db_counts, csv_handler, excel_export
 from app.utils.auth import permission_required
 
 router = APIRouter(prefix="/api", tags=["counts"])
@@ -294,27 +291,9 @@ async def export_all_counts(tz: Optional[str] = 'UTC', username: str = Depends(p
         available_cols = [c for c in col_rename.keys() if c in df.columns]
         df_export = df.select(available_cols).rename({c: col_rename[c] for c in available_cols})
         
-        # 3. Generar Excel en memoria con openpyxl directo (sin pandas)
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Auditoria_W2W'
-        ws.append(df_export.columns)
-        for row in df_export.iter_rows():
-            ws.append(list(row))
-        for i, col_name in enumerate(df_export.columns, start=1):
-            col_data = df_export[col_name].cast(pl.Utf8, strict=False)
-            max_len = max(col_data.str.len_chars().max() or 0, len(col_name)) + 2
-            ws.column_dimensions[get_column_letter(i)].width = float(max_len)
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        # 3. Generar Excel en streaming (sin armar el libro en memoria)
         filename = f"auditoria_inventario_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-        
-        return Response(
-            content=output.getvalue(),
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return await excel_export.xlsx_response(df_export, filename, 'Auditoria_W2W')
     except Exception as e:
         print(f"Error exportando conteos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -327,21 +306,4 @@ async def export_recordings(username: str = Depends(permission_required("invento
         return ORJSONResponse(content={"error": "No hay datos para exportar"}, status_code=400)
     
     df = pl.DataFrame(data)
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'RegistroConteos'
-    ws.append(df.columns)
-    for row in df.iter_rows():
-        ws.append(list(row))
-    for i, col_name in enumerate(df.columns, start=1):
-        col_data = df[col_name].cast(pl.Utf8, strict=False)
-        max_len = max(col_data.str.len_chars().max() or 0, len(col_name)) + 2
-        ws.column_dimensions[get_column_letter(i)].width = float(max_len)
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return Response(
-        content=output.getvalue(),
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={"Content-Disposition": "attachment; filename=registro_conteos.xlsx"}
-    )
+    return await excel_export.xlsx_response(df, "registro_conteos.xlsx", 'RegistroConteos')
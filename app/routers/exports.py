@@ -0,0 +1,66 @@
+"""
+Router para exportaciones pesadas en segundo plano: encolar, consultar estado y descargar.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Form, HTTPException, Request
+from fastapi.responses import FileResponse, ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import ADMIN_PASSWORD
+from app.core.db import get_db
+from app.services import export_jobs
+from app.services.excel_export import XLSX_MEDIA_TYPE
+from app.services.job_registry import job_registry
+from app.utils.auth import permission_required
+
+router = APIRouter(prefix="/api/exports", tags=["exports"])
+
+
+async def _authorized_job(request: Request, job_id: str, db: AsyncSession) -> dict:
+    """Trabajo de exportación si la sesión tiene el permiso que guardó el pedido (404 / 401 / 403 si no)."""
+    job = job_registry.get(job_id)
+    if job is None or job.get("kind") != "export":
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    permission = job.get("permission", "admin")
+    if permission == "admin":
+        if not request.session.get("admin_logged_in"):
+            raise HTTPException(status_code=403, detail="Acceso denegado: Se requiere sesión de administrador")
+    else:
+        await permission_required(permission)(request, db)
+    return job
+
+
+@router.post("/reconciliation")
+async def submit_reconciliation_export(background_tasks: BackgroundTasks, timezone_offset: int = 0, archive_date: Optional[str] = None, snapshot_date: Optional[str] = None, username: str = Depends(permission_required("inbound"))):
+    """Encola el Excel de conciliación (mismos parámetros que /api/export_reconciliation)."""
+    params = {"timezone_offset": timezone_offset, "archive_date": archive_date, "snapshot_date": snapshot_date}
+    return export_jobs.submit("reconciliation", params, username, background_tasks)
+
+
+@router.post("/all_log")
+async def submit_all_log_export(request: Request, background_tasks: BackgroundTasks, password: str = Form(...)):
+    """
+    Encola el respaldo completo de logs (mismo control que /api/export_all_log).
+    La contraseña equivale al login de administrador: la sesión queda habilitada para consultar y descargar.
+    """
+    if password != ADMIN_PASSWORD:
+        return ORJSONResponse(status_code=401, content={"error": "Contraseña incorrecta"})
+    request.session['admin_logged_in'] = True
+    return export_jobs.submit("all_log", {}, "admin", background_tasks)
+
+
+@router.get("/{job_id}")
+async def get_export_status(request: Request, job_id: str, db: AsyncSession = Depends(get_db)):
+    """Estado de una exportación (pending, running, success o error)."""
+    return await _authorized_job(request, job_id, db)
+
+
+@router.get("/{job_id}/download")
+async def download_export(request: Request, job_id: str, db: AsyncSession = Depends(get_db)):
+    """Descarga el archivo de una exportación terminada."""
+    artifact = export_jobs.get_artifact(await _authorized_job(request, job_id, db))
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Archivo no disponible (trabajo en curso, fallido o expirado)")
+    path, filename = artifact
+    return FileResponse(path, media_type=XLSX_MEDIA_TYPE, filename=filename)
@@ -6,6 +6,8 @@ from app.models.sql_models import GRNMaster
 from app.models.schemas import GRNMasterCreate, GRNMasterUpdate, GRNMasterResponse, GRNBulkDeleteRequest
 from app.utils.auth import permission_required
 from app.services.grn_service import seed_grn_from_excel, export_grn_to_json
+from app.services.occupancy_service import occupancy_service
+from app.services.reconciliation_engine import reconciliation_engine
 from app.core.config import ADMIN_PASSWORD, PO_LOOKUP_JSON_PATH, GRN_JSON_DATA_PATH, GRN_CSV_FILE_PATH
 from typing import List, Optional
 import orjson
@@ -178,7 +180,8 @@ async def delete_grn_bulk(
     username: str = Depends(permission_required("inbound"))
 ):
     """Elimina registros del maestro y limpia asociaciones en JSON y CSV 280 basándose en GRN_Numbers."""
-    from app.models.sql_models import Log, ReconciliationHistory # Importar modelos necesarios
+    from app.models.sql_models import Log # Importar modelos necesarios
+    from app.services import reconciliation_service
     
     if payload.password != ADMIN_PASSWORD:
         raise HTTPException(status_code=401, detail="Contraseña de administrador incorrecta")
@@ -205,11 +208,12 @@ async def delete_grn_bulk(
         # Borrar en logs (importReference)
         stmt_logs = delete(Log).where(Log.importReference == grn)
         await db.execute(stmt_logs)
-        # Borrar en historial de conciliación
-        stmt_recon = delete(ReconciliationHistory).where(ReconciliationHistory.grn == grn)
-        await db.execute(stmt_recon)
+    # Borrar en historial de conciliación (snapshots comprimidos y por filas)
+    await reconciliation_service.purge_snapshot_grns(db, grns_to_delete)
     
     await db.commit()
+    occupancy_service.invalidate_logs()
+    reconciliation_engine.mark_dirty(*grns_to_delete)
 
     # --- 3. LIMPIEZA EN PO_LOOKUP.JSON (Robot) ---
     if os.path.exists(PO_LOOKUP_JSON_PATH):
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.db import get_db
 from app.utils.auth import permission_required
@@ -9,9 +10,28 @@ import os
 
 import gc
 from app.core.config import PO_LOOKUP_JSON_PATH, PO_EXTRACTOR_EXCEL_PATH
+from app.services import inbound_lookup
 
 router = APIRouter(prefix="/api/inbound", tags=["inbound"])
 
+@router.get("/suggestions/{import_reference}")
+async def import_reference_suggestions(
+    import_reference: str,
+    user: str = Depends(permission_required("inbound")),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Sugerencias de slotting para todos los ítems de una I.R. (prefetch para handhelds).
+    Se calculan en una sola pasada con reserva de capacidad entre ítems del mismo lote.
+    """
+    payload = await inbound_lookup.import_reference_suggestions(db, import_reference)
+    if not payload["items"] and not payload["notFound"]:
+        raise HTTPException(status_code=404, detail=f"No hay ítems registrados para la I.R. {import_reference}.")
+    return ORJSONResponse(
+        content=payload,
+        headers={"Cache-Control": f"private, max-age={inbound_lookup.BATCH_CACHE_TTL}"}
+    )
+
 @router.get("/lookup_reference")
 async def lookup_reference(
     waybill: Optional[str] = None,
@@ -1,6 +1,7 @@
 import os
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Header
 from app.core.config import DATABASE_FOLDER, INTEGRATION_API_KEY
+from app.services import csv_ingest
 
 # Router dedicado a integraciones con sistemas externos como Power Automate
 router = APIRouter(
@@ -34,16 +35,19 @@ async def upload_ssrs_csv(
     file_path = os.path.join(DATABASE_FOLDER, safe_name)
     
     try:
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-            
-        print(f"📥 Archivo recibido desde Power Automate: {safe_name} ({len(contents)} bytes)")
+        # Recepción en streaming; los reportes conocidos se validan y generan su snapshot Parquet
+        report_key = safe_name[:-4].upper()
+        result = await csv_ingest.ingest_upload(file, report_key, file_path)
+
+        print(f"📥 Archivo recibido desde Power Automate: {safe_name} ({result['size_bytes']} bytes)")
         return {
             "status": "success",
             "message": "Archivo actualizado correctamente", 
             "file": safe_name, 
-            "size_bytes": len(contents)
+            "size_bytes": result["size_bytes"],
+            "rows": result["rows"]
         }
+    except csv_ingest.CSVSchemaError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al guardar archivo: {str(e)}")
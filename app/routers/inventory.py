@@ -3,21 +3,19 @@ Router para endpoints de gestión de inventario y conteos administrativos.
 """
 import datetime
 
-from io import BytesIO
 from urllib.parse import urlencode
 from typing import Optional, Dict, Any, Union
 import numpy as np
-from openpyxl.utils import get_column_letter
 
 from fastapi import APIRouter, Request, Depends, HTTPException, status
-from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy import select, func, delete, insert, update, text
 
 from app.core.config import ASYNC_DB_URL
 from app.core.db import get_db
 from app.core.templates import templates
-from app.services import db_counts, csv_handler
+from app.services import db_counts, csv_handler, excel_export
 from app.utils.auth import login_required, admin_login_required, permission_required
 from app.models.sql_models import AppState, StockCount, CountSession, RecountList, SessionLocation, MasterItem
 from app.services.csv_to_db import sync_master_csv_to_db
@@ -265,10 +263,8 @@ async def finalize_inventory(request: Request, user: str = Depends(permission_re
 
 @router.get('/admin/inventory/report', name='generate_inventory_report')
 async def generate_inventory_report(request: Request, user: str = Depends(permission_required("inventory"))):
-    """Genera un reporte Excel del inventario (100% Polars + openpyxl)."""
+    """Genera un reporte Excel del inventario (100% Polars, escrito en streaming)."""
     import polars as pl
-    import openpyxl
-    from openpyxl.utils import get_column_letter
 
     try:
         result = await db.execute(text("""
@@ -327,27 +323,9 @@ async def generate_inventory_report(request: Request, user: str = Depends(permis
             "item_code": "Item Code", "item_description": "Description"
         })
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'InformeFinalInventario'
-        ws.append(report_df.columns)
-        for row in report_df.iter_rows():
-            ws.append(list(row))
-        for i, col_name in enumerate(report_df.columns, start=1):
-            col_data = report_df[col_name].cast(pl.Utf8, strict=False)
-            max_len = max(col_data.str.len_chars().max() or 0, len(col_name)) + 2
-            ws.column_dimensions[get_column_letter(i)].width = float(max_len)
-
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
         timestamp_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"informe_final_inventario_{timestamp_str}.xlsx"
-        return Response(
-            content=output.getvalue(),
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return await excel_export.xlsx_response(report_df, filename, 'InformeFinalInventario')
 
     except Exception as e:
         print(f"Error generando el informe de inventario: {e}")
@@ -370,8 +348,6 @@ async def export_recount_list(request: Request, stage_number: int, user: str = D
     from app.services.csv_handler import get_item_details_from_master_csv
     
     import polars as pl
-    import openpyxl
-    from openpyxl.utils import get_column_letter
 
     enriched_data = []
     for row in items_to_recount:
@@ -391,26 +367,9 @@ async def export_recount_list(request: Request, stage_number: int, user: str = D
             })
 
     df = pl.DataFrame(enriched_data)
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f'Reconteo_Etapa_{stage_number}'
-    ws.append(df.columns)
-    for row in df.iter_rows():
-        ws.append(list(row))
-    for i, col_name in enumerate(df.columns, start=1):
-        col_data = df[col_name].cast(pl.Utf8, strict=False)
-        max_len = max(col_data.str.len_chars().max() or 0, len(col_name)) + 2
-        ws.column_dimensions[get_column_letter(i)].width = float(max_len)
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
     timestamp_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"lista_reconteo_etapa_{stage_number}_{timestamp_str}.xlsx"
-    return Response(
-        content=output.getvalue(),
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await excel_export.xlsx_response(df, filename, f'Reconteo_Etapa_{stage_number}')
 
 
 # ===== APIs PARA REACT ADMIN INVENTORY =====
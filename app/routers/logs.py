@@ -5,16 +5,13 @@ import datetime
 
 import os
 import orjson
-from io import BytesIO
-import openpyxl
-from openpyxl.utils import get_column_letter
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import ORJSONResponse, Response
+from fastapi.responses import ORJSONResponse
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.db import get_db
 from app.models.schemas import LogEntry
-from app.services import db_logs, csv_handler
+from app.services import db_logs, csv_handler, inbound_lookup, excel_export
 from app.services.slotting_service import slotting_service
 from app.utils.auth import login_required, permission_required
 from app.core.config import ASYNC_DB_URL, PO_LOOKUP_JSON_PATH, GRN_JSON_DATA_PATH
@@ -31,9 +28,6 @@ async_engine = create_async_engine(
 
 router = APIRouter(prefix="/api", tags=["logs"])
 
-
-from app.services.ai_slotting import ai_slotting
-
 @router.get('/find_item/{item_code}/{import_reference}')
 async def find_item(
     item_code: str, 
@@ -42,79 +36,12 @@ async def find_item(
     db: AsyncSession = Depends(get_db)
 ):
     """Busca un item en el maestro y calcula cantidades con sugerencia IA."""
-    # Uso de db=db para búsqueda rápida en SQL
-    item_details = await csv_handler.get_item_details_from_master_csv(item_code, db=db)
-    if item_details is None:
+    response_data, timer = await inbound_lookup.lookup_item(db, item_code, import_reference)
+    if response_data is None:
         raise HTTPException(status_code=404, detail=f"Artículo {item_code} no encontrado en el maestro.")
-    
-    expected_quantity = await csv_handler.get_total_expected_quantity_for_item(item_code)
-    original_bin = item_details.get('Bin_1', 'N/A')
-    
-    # Obtenemos la última reubicación para que aparezca como ubicación base si ya se movió
-    latest_relocated_bin = await db_logs.get_latest_relocated_bin_async(db, item_code)
-    
-    # La ubicación base será la reubicada si existe, sino la del maestro
-    effective_bin_location = latest_relocated_bin if latest_relocated_bin else original_bin
-    
-    
-    # 1. Sugerencia de Slotting Dinámico (Algoritmo Tradicional)
-    traditional_suggested_bin = await slotting_service.get_suggested_bin(db, item_details)
-
-    # 2. Sugerencia de IA (Aprendizaje Histórico)
-    ai_predicted_bin = await ai_slotting.predict_best_bin(
-        db=db,
-        item_code=item_code,
-        sic_code=item_details.get('SIC_Code_stockroom'),
-        fallback_bin=traditional_suggested_bin
-    )
-
-    # 3. VALIDACIÓN DE CAPACIDAD PARA LA IA
-    final_suggested_bin = ai_predicted_bin
-    is_ai_prediction = ai_predicted_bin != traditional_suggested_bin
-
-    if is_ai_prediction:
-        occupancy = await slotting_service._get_bins_occupancy(db)
-        current_skus = occupancy.get(ai_predicted_bin.upper(), 0)
-        if current_skus >= 4:
-            final_suggested_bin = traditional_suggested_bin
-            is_ai_prediction = False
-
-    # 4. Información de Cross-Docking (Xdock)
-    xdock_data = await csv_handler.get_xdock_info(item_code)
-    total_reserved = xdock_data.get("total", 0)
-    xdock_customers = xdock_data.get("customers", [])
-
-    already_received = await db_logs.get_total_received_for_item_async(db, item_code)
-    xdock_pending = max(0, total_reserved - already_received)
-
-    # 5. ELIMINADO: Ya no sobreescribimos final_suggested_bin con "XDOCK" aquí.
-    # El frontend manejará el indicador visual de XDOCK basado en xdock_pending.
 
-    # 6. LIMPIEZA: No sugerir si el ítem ya está en la ubicación sugerida (comparando con el maestro)
-    if final_suggested_bin == effective_bin_location:
-        final_suggested_bin = None
-        is_ai_prediction = False
-
-    response_data = {
-        "itemCode": item_details.get('Item_Code', item_code),
-        "description": item_details.get('Item_Description', 'N/A'),
-        "binLocation": effective_bin_location,
-        "suggestedBin": final_suggested_bin,
-        "is_ai_prediction": is_ai_prediction,
-        "xdockTotal": total_reserved,
-        "xdockPending": xdock_pending,
-        "xdockCustomers": xdock_customers,
-        "aditionalBins": item_details.get('Aditional_Bin_Location', 'N/A'),
-        "physicalQty": str(item_details.get('Physical_Qty', '0')).replace(',', ''),
-        "weight": item_details.get('Weight_per_Unit', 'N/A'),
-        "defaultQtyGrn": expected_quantity,
-        "itemType": item_details.get('ABC_Code_stockroom', 'N/A'),
-        "sicCode": item_details.get('SIC_Code_stockroom', 'N/A'),
-        "dateLastReceived": item_details.get('Date_Last_Received', 'N/A'),
-        "supersededBy": item_details.get('SupersededBy', 'N/A'),
-        "latestRelocatedBin": latest_relocated_bin
-    }
-    return ORJSONResponse(content=response_data)
+    # Desglose por etapa visible en DevTools (Network -> Timing)
+    return ORJSONResponse(content=response_data, headers={"Server-Timing": timer.server_timing()})
 
 @router.post('/add_log')
 async def add_log(data: LogEntry, username: str = Depends(permission_required("inbound")), db: AsyncSession = Depends(get_db)):
@@ -143,15 +70,9 @@ async def add_log(data: LogEntry, username: str = Depends(permission_required("i
     entry_data['itemDescription'] = item_details.get('Item_Description', '')
     entry_data['binLocation'] = effective_bin_location
 
-    if data.relocatedBin:
-        await ai_slotting.learn_from_decision(
-            db=db,
-            item_code=item_code_form,
-            final_bin=data.relocatedBin,
-            sic_code=item_details.get('SIC_Code_stockroom')
-        )
-
-    log_id = await db_logs.save_log_entry_db_async(db, entry_data)
+    # El aprendizaje de la IA de slotting se guarda en la misma transacción que el log
+    decision = (item_code_form, data.relocatedBin, item_details.get('SIC_Code_stockroom')) if data.relocatedBin else None
+    log_id = await db_logs.save_log_entry_db_async(db, entry_data, decision=decision)
     
     if log_id is not None and log_id > 0:
         return ORJSONResponse(content={"message": "Registro guardado correctamente", "id": log_id})
@@ -209,14 +130,6 @@ async def get_log_versions(username: str = Depends(login_required), db: AsyncSes
 @router.get('/export_log')
 async def export_log(timezone_offset: int = 0, version_date: Optional[str] = None, username: str = Depends(permission_required("inbound")), db: AsyncSession = Depends(get_db)):
     """Exporta los registros de log a Excel con lógica de diferencia idéntica al frontend."""
-    if version_date:
-        logs = await db_logs.load_archived_log_data_db_async(db, version_date)
-    else:
-        logs = await db_logs.load_log_data_db_async(db)
-    
-    if not logs:
-        raise HTTPException(status_code=404, detail="No hay registros para exportar")
-
     import polars as pl
     
     # Mapeo de columnas a español (coincidiendo con el frontend)
@@ -238,39 +151,31 @@ async def export_log(timezone_offset: int = 0, version_date: Optional[str] = Non
     cols_out = ['ID', 'Fecha', 'Usuario', 'I.R.', 'Waybill', 'Código Item', 'Descripción',
                 'Ubicación', 'Reubicación', 'Cant. Recibida', 'Cant. Esperada', 'Diferencia']
 
-    # ── LÓGICA DE ALINEACIÓN DE SALDOS (RECONCILIACIÓN DE EXCEL) ─────────────
-    # 1. Obtener cantidad esperada del GRN CSV por itemCode
-    unique_items = list({log['itemCode'] for log in logs if log.get('itemCode')})
-    expected_map = {}
-    for item in unique_items:
-        expected_map[item] = await csv_handler.get_total_expected_quantity_for_item(item)
-
-    # 2. Calcular total recibido por itemCode y encontrar el log más reciente
-    #    Ordenamos por ID descendente para marcar la "última" fila del item.
-    logs_sorted = sorted(logs, key=lambda x: (x.get('id') or 0), reverse=True)
-    
-    totals_map = {}
-    latest_id_map = {}
+    # Lectura columnar directa a Polars (ordenada por ID descendente)
+    if version_date:
+        logs_pl = await db_logs.load_archived_log_frame_async(db, version_date, columns=list(col_map))
+    else:
+        logs_pl = await db_logs.load_log_frame_async(db, columns=list(col_map))
     
-    for log in logs_sorted:
-        code = log.get('itemCode')
-        if not code: continue
-        totals_map[code] = totals_map.get(code, 0) + int(log.get('qtyReceived') or 0)
-        if code not in latest_id_map:
-            latest_id_map[code] = log.get('id')
-
-    # 3. Enriquecer logs CON ALINEACIÓN Y FORMATO DE FECHA
-    enriched = []
-    for log in logs_sorted:
-        code = log.get('itemCode')
-        is_latest = latest_id_map.get(code) == log.get('id')
-        
-        expected = expected_map.get(code, 0)
-        total_rec = totals_map.get(code, 0)
+    if logs_pl.height == 0:
+        raise HTTPException(status_code=404, detail="No hay registros para exportar")
 
-        # Formatear fecha aplicando el desfase del cliente
-        ts_raw = log.get('timestamp', '')
-        formatted_date = ts_raw
+    # ── LÓGICA DE ALINEACIÓN DE SALDOS (RECONCILIACIÓN DE EXCEL) ─────────────
+    # 1. Obtener cantidad esperada del GRN CSV por itemCode
+    unique_items = [item for item in logs_pl.get_column('itemCode').unique().to_list() if item]
+    expected_df = pl.DataFrame({
+        'itemCode': unique_items,
+        '_expected': [await csv_handler.get_total_expected_quantity_for_item(item) for item in unique_items]
+    }, schema={'itemCode': pl.Utf8, '_expected': pl.Float64})
+
+    # 2. Total recibido por itemCode y log más reciente (mayor ID) de cada ítem
+    has_code = pl.col('itemCode').is_not_null() & (pl.col('itemCode') != '')
+    is_latest = has_code & (pl.col('id') == pl.col('id').max().over('itemCode'))
+    total_rec = pl.col('qtyReceived').fill_null(0).sum().over('itemCode')
+    expected = pl.col('_expected').fill_null(0)
+
+    # Formatear fecha aplicando el desfase del cliente
+    def _format_ts(ts_raw):
         try:
             # Limpiar posibles variaciones de formato ISO
             clean_ts = str(ts_raw).replace(' ', 'T').replace('Z', '')
@@ -282,21 +187,25 @@ async def export_log(timezone_offset: int = 0, version_date: Optional[str] = Non
             
             # Aplicar el desfase (timezone_offset viene en minutos)
             local_dt = dt_obj - datetime.timedelta(minutes=timezone_offset)
-            formatted_date = local_dt.strftime('%d/%m/%Y %H:%M')
+            return local_dt.strftime('%d/%m/%Y %H:%M')
         except Exception as e:
             print(f"Error formateando fecha en export: {e}")
-            pass
-        
-        enriched.append({
-            **log,
-            'timestamp': formatted_date,
-            # Solo mostramos el total esperado y la diferencia en la última fila del ítem
-            # para que el reporte sea sumable sin duplicidades.
-            'qtyGrn': expected if is_latest else 0,
-            'difference': (total_rec - expected) if is_latest else 0
-        })
+            return ts_raw
+
+    # 3. Enriquecer logs CON ALINEACIÓN Y FORMATO DE FECHA
+    #    Solo mostramos el total esperado y la diferencia en la última fila del ítem
+    #    para que el reporte sea sumable sin duplicidades.
+    df_pl = (
+        logs_pl
+        .join(expected_df, on='itemCode', how='left', maintain_order='left')
+        .with_columns([
+            pl.col('timestamp').map_elements(_format_ts, return_dtype=pl.Utf8),
+            pl.when(is_latest).then(expected).otherwise(0).alias('qtyGrn'),
+            pl.when(is_latest).then(total_rec - expected).otherwise(0).alias('difference'),
+        ])
+        .drop('_expected')
+    )
     # ─────────────────────────────────────────────────────────────────────────
-    df_pl = pl.DataFrame(enriched, infer_schema_length=None)
 
     # Renombrar y seleccionar columnas
     available_cols = {k: v for k, v in col_map.items() if k in df_pl.columns}
@@ -306,149 +215,23 @@ async def export_log(timezone_offset: int = 0, version_date: Optional[str] = Non
     final_cols = [c for c in cols_out if c in df_export.columns]
     df_export = df_export.select(final_cols)
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'InboundLogs'
-    
-    # Cabeceras
-    ws.append(df_export.columns)
-    
-    # Filas
-    for row in df_export.iter_rows():
-        ws.append(list(row))
-        
-    # Auto-ajustar ancho de columnas
-    for i, col_name in enumerate(df_export.columns, start=1):
-        col_letter = get_column_letter(i)
-        col_data = df_export[col_name].cast(pl.Utf8, strict=False)
-        max_data = col_data.str.len_chars().max() or 0
-        ws.column_dimensions[col_letter].width = float(max(int(max_data), len(col_name)) + 2)
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
     suffix = f"_{version_date}" if version_date else ""
     filename = f"inbound_logs{suffix}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return Response(
-        content=output.getvalue(), 
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await excel_export.xlsx_response(df_export, filename, 'InboundLogs')
 
 @router.get('/export_reconciliation')
 async def export_reconciliation(timezone_offset: int = 0, archive_date: Optional[str] = None, snapshot_date: Optional[str] = None, username: str = Depends(permission_required("inbound")), db: AsyncSession = Depends(get_db)):
     """Genera y exporta el reporte de conciliación (100% Polars, sin Pandas)."""
-    import polars as pl
-    from app.models.sql_models import GRNMaster, ReconciliationHistory
-
-    def _write_excel_polars(df: pl.DataFrame, sheet_name: str) -> bytes:
-        """Convierte un DataFrame Polars a Excel con openpyxl, auto-ajustando anchos."""
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = sheet_name
-
-        # Cabeceras
-        ws.append(df.columns)
-        # Filas
-        for row in df.iter_rows():
-            ws.append(list(row))
-
-        # Auto-ajustar ancho de columnas
-        for i, col_name in enumerate(df.columns, start=1):
-            col_letter = get_column_letter(i)
-            col_data = df[col_name].cast(pl.Utf8, strict=False)
-            max_data = col_data.str.len_chars().max() or 0
-            ws.column_dimensions[col_letter].width = float(max(int(max_data), len(col_name)) + 2)
-
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        return output.getvalue()
+    from app.services import reconciliation_service
 
     try:
-        # ── RAMA SNAPSHOT ──────────────────────────────────────────────────────
-        if snapshot_date:
-            stmt = select(ReconciliationHistory).where(ReconciliationHistory.archive_date == snapshot_date)
-            res = await db.execute(stmt)
-            rows = res.scalars().all()
-
-            if not rows:
-                raise HTTPException(status_code=404, detail="No se encontraron datos para este snapshot")
-
-            df_for_export = pl.DataFrame([{
-                "I.R.":               r.import_reference,
-                "Waybill":            r.waybill,
-                "GRN":                r.grn,
-                "Código Item":        r.item_code,
-                "Descripción":        r.description,
-                "Ubicación":          getattr(r, 'bin_location', '') or '',
-                "Reubicado":          getattr(r, 'relocated_bin', '') or '',
-                "Cant. Esperada":     int(r.qty_expected or 0),
-                "Cant. Recibida":     int(r.qty_received or 0),
-                "Diferencia":         int(r.difference or 0),
-                "Fecha":              (datetime.datetime.fromisoformat(str(r.timestamp).replace('Z', '')) - datetime.timedelta(minutes=timezone_offset)).strftime('%d/%m/%Y %H:%M') if r.timestamp else ''
-            } for r in rows], infer_schema_length=None)
-
-            filename = f"snapshot_reconciliacion_{snapshot_date.replace(':', '-')}.xlsx"
-            return Response(
-                content=_write_excel_polars(df_for_export, 'SnapshotConciliacion'),
-                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-
-        # ── RAMA PRINCIPAL ─────────────────────────────────────────────────────
-        else:
-            # Usar la lógica centralizada del servicio
-            from app.services import reconciliation_service
-            result_data = await reconciliation_service.get_reconciliation_calculations(db, archive_date)
-
-            if not result_data:
-                raise HTTPException(status_code=404, detail="No hay datos de conciliación para exportar")
-
-            final_df = pl.DataFrame(result_data, infer_schema_length=None)
-
-            # Seleccionar y renombrar para el reporte Excel (manteniendo nombres de columnas del reporte)
-            df_for_export = final_df.select([
-                pl.col("Import_Reference").alias("I.R."),
-                pl.col("Waybill").alias("Waybill"),
-                pl.col("GRN").alias("GRN"),
-                pl.col("Codigo_Item").alias("Código Item"),
-                pl.col("Descripcion").alias("Descripción"),
-                pl.col("Ubicacion").alias("Ubicación"),
-                pl.col("Reubicado").alias("Reubicado"),
-                pl.col("Cant_Esperada").alias("Cant. Esperada"),
-                pl.col("Cant_Recibida").alias("Cant. Recibida"),
-                pl.col("Diferencia").alias("Diferencia"),
-                pl.col("Timestamp").alias("Fecha_ISO")
-            ])
-
-            # Ajustar la zona horaria en la columna Fecha usando Polars o mapeo manual
-            def _adjust_tz(val):
-                if not val: return ""
-                try:
-                    clean_ts = str(val).replace(' ', 'T').replace('Z', '')
-                    dt = datetime.datetime.fromisoformat(clean_ts)
-                    local_dt = dt - datetime.timedelta(minutes=timezone_offset)
-                    return local_dt.strftime('%d/%m/%Y %H:%M')
-                except:
-                    return str(val)
-
-            df_for_export = df_for_export.with_columns(
-                pl.col("Fecha_ISO").map_elements(_adjust_tz, return_dtype=pl.Utf8).alias("Fecha")
-            ).drop("Fecha_ISO")
-
-            utc_now = datetime.datetime.now(datetime.timezone.utc)
-            client_time = utc_now - datetime.timedelta(minutes=timezone_offset)
-            timestamp_str = client_time.strftime("%Y%m%d_%H%M%S")
-            filename = f"reporte_conciliacion_{timestamp_str}.xlsx"
+        df_for_export = await reconciliation_service.build_export_frame(db, timezone_offset, archive_date, snapshot_date)
+        if df_for_export.height == 0:
+            detail = "No se encontraron datos para este snapshot" if snapshot_date else "No hay datos de conciliación para exportar"
+            raise HTTPException(status_code=404, detail=detail)
 
-            return Response(
-                content=_write_excel_polars(df_for_export, 'ReporteDeConciliacion'),
-                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+        sheet_name, filename = reconciliation_service.export_file_info(timezone_offset, snapshot_date)
+        return await excel_export.xlsx_response(df_for_export, filename, sheet_name)
 
     except HTTPException:
         raise
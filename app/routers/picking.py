@@ -1,9 +1,7 @@
 """
 Router para endpoints de picking.
 """
-import os
 import datetime
-import polars as pl
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -12,6 +10,7 @@ from app.models.schemas import PickingAudit
 from app.models.sql_models import PickingAudit as PickingAuditModel, PickingAuditItem, PickingPackageItem
 from app.utils.auth import login_required, api_login_required, permission_required
 from app.core.db import get_db
+from app.services.picking_store import picking_store, PickingFileMissing
 
 router = APIRouter(prefix="/api", tags=["picking"])
 
@@ -19,69 +18,16 @@ router = APIRouter(prefix="/api", tags=["picking"])
 async def get_picking_order(order_number: str, despatch_number: str, username: str = Depends(permission_required("picking"))):
     """Obtiene los detalles de un pedido de picking desde el CSV."""
     try:
-        from app.core.config import PICKING_CSV_PATH
-        if not os.path.exists(PICKING_CSV_PATH):
-            raise HTTPException(status_code=404, detail="El archivo de picking no se encuentra.")
-
-        df = pl.read_csv(PICKING_CSV_PATH, infer_schema_length=0)
-        
-        # Limpiar BOM si existe en los nombres de las columnas
-        df.columns = [c.lstrip('\ufeff') for c in df.columns]
-        
-        # Identificar la columna de código de cliente disponible
-        customer_col = "CUSTOMER" if "CUSTOMER" in df.columns else ("CUSTOMER_CODE" if "CUSTOMER_CODE" in df.columns else None)
-        
-        required_columns = ["ORDER_", "DESPATCH_", "ITEM", "DESCRIPTION", "QTY", "CUSTOMER_NAME", "ORDER_LINE"]
-        if not all(col in df.columns for col in required_columns) or not customer_col:
-            raise HTTPException(status_code=500, detail="El archivo CSV no tiene las columnas esperadas (Falta CUSTOMER o CUSTOMER_CODE).")
-
-        # Limpiar espacios en blanco en columnas clave y comas de miles en QTY
-        df = df.with_columns([
-            pl.col("ORDER_").cast(pl.Utf8).str.strip_chars(),
-            pl.col("DESPATCH_").cast(pl.Utf8).str.strip_chars()
-        ])
-        if "QTY" in df.columns:
-            df = df.with_columns(pl.col("QTY").cast(pl.Utf8).str.replace_all(',', ''))
-
-        # Limpiar inputs
-        order_number_clean = str(order_number).strip()
-        despatch_number_clean = str(despatch_number).strip()
-
-        order_data = df.filter(
-            (pl.col("ORDER_") == order_number_clean) & 
-            (pl.col("DESPATCH_") == despatch_number_clean)
-        )
-
-        if order_data.height == 0:
+        order_data = picking_store.get_order(order_number, despatch_number)
+        if order_data is None:
             raise HTTPException(status_code=404, detail="Pedido no encontrado.")
 
-        # customer_col ya fue identificado arriba
-        
-        # Renombrar columnas para consistencia interna
-        rename_map = {
-            "ORDER_": "Order Number",
-            "DESPATCH_": "Despatch Number",
-            "ITEM": "Item Code",
-            "DESCRIPTION": "Item Description",
-            "QTY": "Qty",
-            "CUSTOMER_NAME": "Customer Name",
-            "ORDER_LINE": "Order Line"
-        }
-        if customer_col:
-            rename_map[customer_col] = "Customer Code"
-            
-        order_data = order_data.rename(rename_map)
-
-        # Limpiar espacios en blanco en los resultados
-        order_data = order_data.with_columns([
-            pl.col("Customer Code").cast(pl.Utf8).str.strip_chars() if "Customer Code" in order_data.columns else pl.lit(""),
-            pl.col("Customer Name").cast(pl.Utf8).str.strip_chars()
-        ])
-
-        order_data = order_data.fill_null("")
-        
         return ORJSONResponse(content=order_data.to_dicts())
 
+    except PickingFileMissing as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -90,112 +36,21 @@ async def get_picking_order(order_number: str, despatch_number: str, username: s
 async def get_picking_tracking(username: str = Depends(permission_required("picking")), db: AsyncSession = Depends(get_db)):
     """Obtiene un resumen de todos los pedidos de picking desde el CSV para seguimiento."""
     try:
-        from app.core.config import PICKING_CSV_PATH
-        if not os.path.exists(PICKING_CSV_PATH):
-            raise HTTPException(status_code=404, detail="El archivo de picking no se encuentra.")
-
-        # Leer CSV
-        df = pl.read_csv(PICKING_CSV_PATH, infer_schema_length=0)
-        
-        # Limpiar BOM si existe en los nombres de las columnas
-        df.columns = [c.lstrip('\ufeff') for c in df.columns]
-
-        # [CORRECCIÓN] Filtrar líneas vacías o nulas de ORDER_ antes de procesar
-        df = df.filter(
-            (pl.col("ORDER_").is_not_null()) & 
-            (pl.col("ORDER_").cast(pl.Utf8).str.strip_chars() != "")
-        )
-
-        required_columns = ["ORDER_", "DESPATCH_", "CUSTOMER_NAME", "PICK_LIST_PRINTED_TIME", "Time_Zone_Hours"]
-        if not all(col in df.columns for col in required_columns):
-            # Verificar si existe al menos CUSTOMER o CUSTOMER_CODE
-            if "CUSTOMER" not in df.columns and "CUSTOMER_CODE" not in df.columns:
-                raise HTTPException(status_code=500, detail="El archivo CSV no tiene las columnas esperadas.")
-
-        # Identificar columna de cliente
-        customer_col = "CUSTOMER" if "CUSTOMER" in df.columns else "CUSTOMER_CODE"
-
-        # Limpiar datos clave antes de agrupar
-        df = df.with_columns([
-            pl.col("ORDER_").cast(pl.Utf8).str.strip_chars(),
-            pl.col("DESPATCH_").cast(pl.Utf8).str.strip_chars(),
-            pl.col(customer_col).cast(pl.Utf8).fill_null(""),
-            pl.col("CUSTOMER_NAME").cast(pl.Utf8).fill_null(""),
-            pl.col("PICK_LIST_PRINTED_TIME").cast(pl.Utf8).str.strip_chars().fill_null(""),
-            pl.col("Time_Zone_Hours").cast(pl.Utf8).str.strip_chars().fill_null("")
-        ])
-
-        # Agrupar por ORDER_ y DESPATCH_ para contar líneas y conservar hora local de impresión
-        grouped = df.group_by(["ORDER_", "DESPATCH_", customer_col, "CUSTOMER_NAME"]).agg([
-            pl.col("ORDER_").len().alias("total_lines"),
-            pl.col("PICK_LIST_PRINTED_TIME").filter(pl.col("PICK_LIST_PRINTED_TIME") != "").first().alias("print_time"),
-            pl.col("Time_Zone_Hours").filter(pl.col("Time_Zone_Hours") != "").first().alias("time_zone")
-        ])
-
-        def format_local_print_time(raw_time: str, tz_value: str) -> str:
-            """Devuelve la hora local del CSV formateada; si no existe, devuelve vacío."""
-            if raw_time is None or str(raw_time).strip() == "" or str(raw_time).lower() == "none":
-                return "" # No mostrar fecha si no hay dato en el CSV
-
-            raw_time_str = str(raw_time).strip()
-            # ... resto de la lógica ...
-
-            parsed_time = None
-            for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
-                try:
-                    parsed_time = datetime.datetime.strptime(raw_time_str, fmt)
-                    break
-                except ValueError:
-                    continue
-
-            if not parsed_time:
-                return raw_time_str # Devolver valor crudo para diagnóstico si falla parseo
+        # Resumen precalculado por versión del CSV; solo el estado de auditoría se consulta en cada request
+        tracking = picking_store.get_tracking()
 
-            tzinfo = None
-            tz_str = "" if tz_value is None else str(tz_value).strip()
-            if tz_str:
-                # Time_Zone_Hours viene en formato +/-HH:MM (ej: -6:00)
-                sign = -1 if tz_str.startswith("-") else 1
-                clean_tz = tz_str[1:] if tz_str.startswith(("-", "+")) else tz_str
-                parts = clean_tz.split(":", 1)
-                hours_str = parts[0]
-                minutes_str = parts[1] if len(parts) > 1 else "0"
-                try:
-                    tz_delta = datetime.timedelta(hours=int(hours_str), minutes=int(minutes_str))
-                    tzinfo = datetime.timezone(sign * tz_delta)
-                except ValueError:
-                    tzinfo = None
-
-            if tzinfo:
-                parsed_time = parsed_time.replace(tzinfo=tzinfo)
-
-            return parsed_time.strftime("%Y-%m-%d %H:%M")
-        
         # Consultar pedidos auditados en la DB
         result = await db.execute(select(PickingAuditModel.order_number, PickingAuditModel.despatch_number))
         audited_pairs = {(row.order_number, row.despatch_number) for row in result.all()}
 
-        # Construir respuesta
-        tracking_data = []
-        for row in grouped.iter_rows(named=True):
-            order_num = str(row["ORDER_"] or "").strip()
-            despatch_num = str(row["DESPATCH_"] or "").strip()
-            
-            if not order_num: # Doble validación preventiva
-                continue
-
-            tracking_data.append({
-                "order_number": order_num,
-                "despatch_number": despatch_num,
-                "customer_code": str(row[customer_col] or "").strip(),
-                "customer_name": str(row["CUSTOMER_NAME"] or "").strip(),
-                "total_lines": int(row["total_lines"]),
-                "print_date": format_local_print_time(row["print_time"], row["time_zone"]),
-                "is_audited": (order_num, despatch_num) in audited_pairs
-            })
-        
+        tracking_data = [
+            {**row, "is_audited": (row["order_number"], row["despatch_number"]) in audited_pairs}
+            for row in tracking
+        ]
         return ORJSONResponse(content=tracking_data)
 
+    except PickingFileMissing as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -508,22 +363,12 @@ async def save_picking_audit(audit_data: PickingAudit, username: str = Depends(p
         # Fallback para customer_code y name si vienen vacíos
         if not audit_data.customer_code or not audit_data.customer_name or audit_data.customer_name == "N/A":
              try:
-                 from app.core.config import PICKING_CSV_PATH
-                 if os.path.exists(PICKING_CSV_PATH):
-                     df_lookup = pl.read_csv(PICKING_CSV_PATH, infer_schema_length=0)
-                     df_lookup.columns = [c.lstrip('\ufeff') for c in df_lookup.columns]
-                     # Identificar columna
-                     c_col = "CUSTOMER" if "CUSTOMER" in df_lookup.columns else ("CUSTOMER_CODE" if "CUSTOMER_CODE" in df_lookup.columns else None)
-                     
-                     match = df_lookup.filter(
-                         (pl.col("ORDER_").cast(pl.Utf8).str.strip_chars() == audit_data.order_number.strip()) &
-                         (pl.col("DESPATCH_").cast(pl.Utf8).str.strip_chars() == audit_data.despatch_number.strip())
-                     )
-                     if match.height > 0:
-                         if not audit_data.customer_code:
-                             audit_data.customer_code = str(match[0, c_col] or "").strip()
-                         if not audit_data.customer_name or audit_data.customer_name == "N/A":
-                             audit_data.customer_name = str(match[0, "CUSTOMER_NAME"] or "").strip()
+                 customer = picking_store.get_customer(audit_data.order_number, audit_data.despatch_number)
+                 if customer:
+                     if not audit_data.customer_code:
+                         audit_data.customer_code = customer[0]
+                     if not audit_data.customer_name or audit_data.customer_name == "N/A":
+                         audit_data.customer_name = customer[1]
              except Exception as lookup_err:
                  print(f"Fallback lookup failed: {lookup_err}")
 
@@ -4,17 +4,15 @@ Genera un archivo Excel con los conteos sugeridos basado en la clasificación AB
 """
 import datetime
 import random
-from io import BytesIO
 import polars as pl
 import numpy as np
 from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from app.core.db import get_db
 from app.models.schemas import CountExecutionRequest
 from app.models.sql_models import CycleCount, CycleCountRecording, MasterItem
-from app.services import csv_handler
+from app.services import csv_handler, db_counts, excel_export
 from app.utils.auth import login_required, permission_required
 
 import orjson
@@ -186,27 +184,9 @@ async def preview_count_plan(start_date: str = Query(...), end_date: str = Query
 
 @router.get("/generate_plan")
 async def generate_count_plan(start_date: str = Query(...), end_date: str = Query(...), username: str = Depends(permission_required("planner")), db: AsyncSession = Depends(get_db)):
-    import openpyxl
-    from openpyxl.utils import get_column_letter
-
     df_output = await calculate_count_plan_data(start_date, end_date, db)
     df_output = df_output.with_columns(pl.col("Planned Date").cast(pl.Utf8))
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'Planificacion'
-    ws.append(df_output.columns)
-    for row in df_output.iter_rows():
-        ws.append(list(row))
-    for i, col_name in enumerate(df_output.columns, start=1):
-        col_data = df_output[col_name].cast(pl.Utf8, strict=False)
-        max_len = max(col_data.str.len_chars().max() or 0, len(col_name)) + 2
-        ws.column_dimensions[get_column_letter(i)].width = float(max_len)
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return Response(content=output.getvalue(), media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers={"Content-Disposition": f"attachment; filename=plan_conteos_{start_date}.xlsx"})
+    return await excel_export.xlsx_response(df_output, f"plan_conteos_{start_date}.xlsx", 'Planificacion')
 
 @router.get("/config")
 async def get_planner_config(username: str = Depends(permission_required("planner"))):
@@ -369,46 +349,7 @@ async def get_items_with_differences(date: str = Query(...), username: str = Dep
 async def save_daily_execution(execution_data: CountExecutionRequest, username: str = Depends(permission_required("planner")), db: AsyncSession = Depends(get_db)):
     """Guarda conteos con validación estricta de system_qty desde el servidor."""
     try:
-        today_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        item_codes = [it.item_code for it in execution_data.items]
-        res_master = await db.execute(select(MasterItem).where(MasterItem.item_code.in_(item_codes)))
-        master_map = {m.item_code: m for m in res_master.scalars().all()}
-
-        saved, updated = 0, 0
-        for item in execution_data.items:
-            m_item = master_map.get(item.item_code)
-            if not m_item: continue
-
-            physical = item.physical_qty
-            system = m_item.physical_qty or 0
-            
-            res_exist = await db.execute(select(CycleCountRecording).where(CycleCountRecording.item_code == item.item_code, CycleCountRecording.planned_date == execution_data.date))
-            existing = res_exist.scalar_one_or_none()
-            
-            if existing:
-                existing.physical_qty, existing.system_qty = physical, system
-                existing.difference, existing.username, existing.executed_date = physical - system, username, today_iso
-                updated += 1
-            else:
-                bin_loc = m_item.bin_1
-                if m_item.additional_bin:
-                    bin_loc = f"{bin_loc} | {m_item.additional_bin}"
-                
-                db.add(CycleCountRecording(
-                    planned_date=execution_data.date, 
-                    executed_date=today_iso, 
-                    item_code=item.item_code, 
-                    item_description=m_item.description, 
-                    bin_location=bin_loc, 
-                    system_qty=system, 
-                    physical_qty=physical, 
-                    difference=physical-system, 
-                    username=username, 
-                    abc_code=m_item.abc_code
-                ))
-                saved += 1
-
-
+        saved, updated = await db_counts.apply_count_execution_async(db, execution_data, username)
         await db.commit()
         return {"message": f"Guardados: {saved} nuevos, {updated} actualizados."}
     except Exception as e:
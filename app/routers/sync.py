@@ -1,9 +1,11 @@
+import gzip
 import os
 import time
-import orjson
-from fastapi import APIRouter, Depends, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import ORJSONResponse
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import (
     ITEM_MASTER_CSV_PATH, 
@@ -11,11 +13,53 @@ from app.core.config import (
     RESERVATION_CSV_PATH,
     PO_LOOKUP_JSON_PATH
 )
-from app.services import csv_handler
-from app.utils.auth import login_required
+from app.core.db import get_db
+from app.models.schemas import SyncPushRequest
+from app.services import csv_handler, sync_push
+from app.services.master_sync import master_sync, FullPayload, FULL_FORMATS
+from app.utils.auth import login_required, permission_required, get_user_permissions
 
 router = APIRouter(prefix="/api/sync", tags=["sync"])
 
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Codificaciones aceptadas por el cliente (se descartan las marcadas con q=0)."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    return accepted
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110): se ignora el prefijo W/."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _full_response(request: Request, full: FullPayload) -> Response:
+    """Sirve la carga completa precomprimida; 304 si el cliente ya tiene esta versión."""
+    headers = {
+        "ETag": full.etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "private, no-cache",  # Se revalida siempre con If-None-Match
+    }
+    if _etag_matches(request.headers.get("if-none-match", ""), full.etag):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    for encoding in ("br", "gzip"):
+        if encoding in full.bodies and encoding in accepted:
+            headers["Content-Encoding"] = encoding
+            return Response(full.bodies[encoding], media_type="application/json", headers=headers)
+    # Cliente sin compresión (raro): se descomprime por request
+    return Response(gzip.decompress(full.bodies["gzip"]), media_type="application/json", headers=headers)
+
+
 @router.get("/status")
 async def get_sync_status(user: str = Depends(login_required)):
     """Retorna las fechas de última modificación de los archivos maestros."""
@@ -37,51 +81,35 @@ async def get_sync_status(user: str = Depends(login_required)):
     return status
 
 @router.get("/master_data")
-async def get_master_sync_data(user: str = Depends(login_required)):
-    """Retorna todos los datos maestros necesarios para operación offline."""
+async def get_master_sync_data(request: Request, since: Optional[int] = None, format: str = "json", user: str = Depends(login_required)):
+    """
+    Retorna los datos maestros necesarios para operación offline.
+    Sin `since` (o si esa versión ya no está disponible) envía todo; con `since=<version>`
+    solo los ítems y entradas de mapas agregados, modificados o eliminados desde esa versión.
+    La carga completa sale precomprimida de la generación vigente, con ETag e If-None-Match;
+    `format=columnar` la envía por columnas (más liviana y rápida de parsear en el handheld).
+    """
+    if format not in FULL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {format}")
     await csv_handler.reload_cache_if_needed()
-    
-    # 1. Master Items (Solo columnas esenciales para ahorrar espacio)
-    # Usamos el cache de Polars cargado en csv_handler
-    master_items = []
-    if csv_handler.df_master_cache is not None:
-        # Seleccionamos solo lo crítico para Inbound
-        cols = [
-            'Item_Code', 'Item_Description', 'Bin_1', 'Weight_per_Unit', 
-            'ABC_Code_stockroom', 'SIC_Code_stockroom'
-        ]
-        # Filtrar columnas existentes por si acaso
-        available_cols = [c for c in cols if c in csv_handler.df_master_cache.columns]
-        master_items = csv_handler.df_master_cache.select(available_cols).to_dicts()
-
-    # 2. GRN Pending Quantities (Agrupado por Item_Code)
-    grn_data = {}
-    if csv_handler.df_grn_cache is not None:
-        import polars as pl
-        summary = (
-            csv_handler.df_grn_cache
-            .filter(pl.col("Item_Code").is_not_null())
-            .group_by(pl.col("Item_Code").str.strip_chars().str.to_uppercase().alias("Item_Code"))
-            .agg(pl.col("Quantity").sum().alias("total_expected"))
-        )
-        grn_data = {str(row["Item_Code"]): int(row["total_expected"]) for row in summary.to_dicts() if row["Item_Code"]}
-
-    # 3. Xdock (Reservations) - Ya está en memoria en csv_handler.reservation_qty_map
-    xdock_data = csv_handler.reservation_qty_map
-
-    # 4. PO Lookup (Waybill <-> Import Ref)
-    po_lookup = {}
-    if os.path.exists(PO_LOOKUP_JSON_PATH):
-        try:
-            with open(PO_LOOKUP_JSON_PATH, "rb") as f:
-                po_lookup = orjson.loads(f.read())
-        except: pass
+
+    # El índice se arma y se cruza fuera del event loop
+    payload = await run_in_threadpool(master_sync.delta_payload, since) if since is not None else None
+    if payload is None:
+        full = master_sync.current_full(format) or await run_in_threadpool(master_sync.build_full, format)
+        return _full_response(request, full)
 
     # Retornamos ORJSONResponse para mejor integración con middlewares y performance
-    return ORJSONResponse({
-        "timestamp": time.time(),
-        "master_items": master_items,
-        "grn_pending": grn_data,
-        "xdock_reservations": xdock_data,
-        "po_lookup": po_lookup
-    })
+    return ORJSONResponse({"timestamp": time.time(), **payload})
+
+
+@router.post("/push")
+async def push_pending_records(data: SyncPushRequest, username: str = Depends(permission_required(["inbound", "planner"])), db: AsyncSession = Depends(get_db)):
+    """
+    Sube en un solo request los registros pendientes de un handheld (Inbound y planificador).
+    Reemplaza el envío uno a uno a /api/add_log, /api/update_log/{id} y /api/planner/execution/save;
+    retorna un resultado por registro en el mismo orden.
+    """
+    permissions = await get_user_permissions(db, username) or []
+    results = await sync_push.push_records(db, data.records, username, permissions)
+    return ORJSONResponse({"results": results})
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Request, Form, Depends, HTTPException, status, File, UploadFile, Response, BackgroundTasks
+from fastapi import APIRouter, Request, Form, Depends, HTTPException, status, File, UploadFile, BackgroundTasks
 from fastapi.responses import ORJSONResponse, RedirectResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
 import polars as pl
 import os
 import shutil
@@ -7,7 +8,6 @@ import orjson
 import datetime
 import numpy as np
 from urllib.parse import urlencode
-from io import BytesIO
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import delete
 from app.core.db import get_db
@@ -26,6 +26,9 @@ from app.core.config import (
 )
 from app.services.csv_handler import load_csv_data
 from app.services.csv_to_db import sync_master_csv_to_db
+from app.services.occupancy_service import occupancy_service
+from app.services.reconciliation_engine import reconciliation_engine
+from app.services import csv_ingest
 from app.utils.auth import login_required
 from app.core.templates import templates
 
@@ -169,6 +172,15 @@ async def process_po_extractor_logic(file_path: str):
         
         with open(PO_LOOKUP_JSON_PATH, "wb") as f:
             f.write(orjson.dumps(lookup_data, option=orjson.OPT_INDENT_2))
+
+        # Los GRN encontrados por el robot alimentan el mapa GRN -> I.R. de la conciliación
+        from app.core.db import AsyncSessionLocal
+        from app.services.grn_ir_map import grn_ir_map
+        try:
+            async with AsyncSessionLocal() as session:
+                await grn_ir_map.rebuild(session)
+        except Exception as e:
+            print(f"⚠️ [GRN MAP] No se pudo reconstruir el mapa GRN -> I.R.: {e}")
         
         return True, "Caché de búsqueda generado correctamente."
     except Exception as e:
@@ -241,6 +253,36 @@ async def get_po_robot_status(username: str = Depends(login_required)):
     print(f"📡 [STATUS] Robot Status Check: {po_robot_status['status']} - {datetime.datetime.now().strftime('%H:%M:%S')}")
     return ORJSONResponse(content=po_robot_status)
 
+def _write_grn_280(tmp_path: str, selected_list: list, combine: bool) -> bool:
+    """
+    Escribe la 280 desde el temporal subido, combinando por GRN o reemplazando, y su snapshot Parquet.
+    Bloqueante (lectura, combinado y escritura): se ejecuta en el threadpool. Retorna True si combinó.
+    """
+    try:
+        new_data = pl.scan_csv(tmp_path, infer_schema_length=0)
+        if selected_list:
+            new_data = new_data.filter(pl.col(GRN_COLUMN_NAME_IN_CSV).is_in(selected_list))
+        new_data_df = new_data.collect()
+    finally:
+        os.remove(tmp_path)
+
+    combined = combine and os.path.exists(GRN_CSV_FILE_PATH)
+    if combined:
+        # La 280 vigente se lee en modo lazy: el filtro por GRN se aplica durante el escaneo
+        new_grns = new_data_df.get_column(GRN_COLUMN_NAME_IN_CSV).unique()
+        existing_data = (
+            pl.scan_csv(GRN_CSV_FILE_PATH, infer_schema_length=0)
+            .filter(~pl.col(GRN_COLUMN_NAME_IN_CSV).is_in(new_grns.implode()))
+        )
+        new_data_df = pl.concat([existing_data, new_data_df.lazy()], how="vertical").collect()
+
+    # Temporal + rename: la 280 nunca queda a medio escribir para otro worker
+    tmp_csv = f"{GRN_CSV_FILE_PATH}.{os.getpid()}.tmp"
+    new_data_df.write_csv(tmp_csv)
+    os.replace(tmp_csv, GRN_CSV_FILE_PATH)
+    csv_ingest.write_snapshot(GRN_CSV_FILE_PATH)
+    return combined
+
 # --- Endpoint para subir y procesar los archivos (POST) ---
 @router.post('/api/update', response_class=ORJSONResponse)
 async def update_files_post(
@@ -254,6 +296,7 @@ async def update_files_post(
     po_extractor: UploadFile = File(None), # Nuevo campo para Purchase Order Extractor
     update_option_280: str = Form(None),
     selected_grns_280: str = Form(None),
+    snapshot_in_background: bool = Form(True), # Snapshot previo a la 280 como trabajo en segundo plano
     db: AsyncSession = Depends(get_db),
     username: str = Depends(login_required)
 ):
@@ -261,43 +304,48 @@ async def update_files_post(
         return ORJSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"error": "Unauthorized"})
 
     files_uploaded = False
+    master_updated = False
+    snapshot_job_id = None
     message = ""
     error = ""
 
     # Manejo del maestro de items
     if item_master and item_master.filename:
-        with open(ITEM_MASTER_CSV_PATH, "wb") as buffer:
-            shutil.copyfileobj(item_master.file, buffer)
-        message += f'Archivo "{item_master.filename}" actualizado (Maestro). '
-        files_uploaded = True
+        try:
+            await csv_ingest.ingest_upload(item_master, "AURRSGLBD0250")
+            message += f'Archivo "{item_master.filename}" actualizado (Maestro). '
+            files_uploaded = master_updated = True
+        except Exception as e:
+            error += f'Error Maestro: {str(e)}. '
 
     # Manejo del archivo GRN (280)
     if grn_file and grn_file.filename:
         try:
             from app.services import reconciliation_service
-            auto_snap = await reconciliation_service.auto_snapshot_before_update(db, username)
-            if auto_snap:
-                message += f"Snapshot de seguridad generado: {auto_snap}. "
+            if snapshot_in_background:
+                # La conciliación se toma antes de tocar la 280; la escritura no bloquea la respuesta
+                snap_job = await reconciliation_service.schedule_auto_snapshot(db, username, background_tasks)
+                if snap_job:
+                    snapshot_job_id = snap_job["job_id"]
+                    message += f"Snapshot de seguridad en curso: {snap_job['archive_date']}. "
+            else:
+                auto_snap = await reconciliation_service.auto_snapshot_before_update(db, username)
+                if auto_snap:
+                    message += f"Snapshot de seguridad generado: {auto_snap}. "
 
-            grn_bytes = grn_file.file.read()
-            new_data_df = pl.read_csv(grn_bytes, infer_schema_length=0)
-            
+            # Recepción en streaming con validación de columnas; el combinado se hace desde el temporal
+            staged = await csv_ingest.receive_upload(grn_file, "AURRSGLBD0280", GRN_CSV_FILE_PATH)
+
+            selected_list = []
             if selected_grns_280:
                 try:
-                    selected_list = orjson.loads(selected_grns_280)
-                    if selected_list:
-                        new_data_df = new_data_df.filter(pl.col(GRN_COLUMN_NAME_IN_CSV).is_in(selected_list))
+                    selected_list = orjson.loads(selected_grns_280) or []
                 except: pass
 
-            if update_option_280 == 'combine' and os.path.exists(GRN_CSV_FILE_PATH):
-                existing_data_df = pl.read_csv(GRN_CSV_FILE_PATH, infer_schema_length=0)
-                new_grns = new_data_df.get_column(GRN_COLUMN_NAME_IN_CSV).unique()
-                existing_data_df = existing_data_df.filter(~pl.col(GRN_COLUMN_NAME_IN_CSV).is_in(new_grns))
-                combined_df = pl.concat([existing_data_df, new_data_df], how="vertical")
-                combined_df.write_csv(GRN_CSV_FILE_PATH)
+            # Lectura, combinado, escritura y snapshot fuera del event loop
+            if await run_in_threadpool(_write_grn_280, staged["tmp_path"], selected_list, update_option_280 == 'combine'):
                 message += f'Archivo "{grn_file.filename}" combinado. '
             else:
-                new_data_df.write_csv(GRN_CSV_FILE_PATH)
                 message += f'Archivo "{grn_file.filename}" reemplazado. '
             files_uploaded = True
         except Exception as e:
@@ -305,22 +353,26 @@ async def update_files_post(
 
     # Manejo del archivo de Reservas (AURRSLAMP0006)
     if reservation_file and reservation_file.filename:
-        with open(RESERVATION_CSV_PATH, "wb") as buffer:
-            shutil.copyfileobj(reservation_file.file, buffer)
-        
-        # [NUEVO] Generar caché rápido de Xdock en segundo plano
-        from app.services.csv_handler import generate_reservation_cache
-        background_tasks.add_task(generate_reservation_cache)
-        
-        message += f'Archivo "{reservation_file.filename}" actualizado (Xdock). '
-        files_uploaded = True
+        try:
+            await csv_ingest.ingest_upload(reservation_file, "AURRSLAMP0006")
+
+            # [NUEVO] Generar caché rápido de Xdock en segundo plano
+            from app.services.csv_handler import generate_reservation_cache
+            background_tasks.add_task(generate_reservation_cache)
+
+            message += f'Archivo "{reservation_file.filename}" actualizado (Xdock). '
+            files_uploaded = True
+        except Exception as e:
+            error += f'Error Reservas: {str(e)}. '
 
     # Manejo del archivo de picking (240)
     if picking_file and picking_file.filename:
-        with open(PICKING_CSV_PATH, "wb") as buffer:
-            shutil.copyfileobj(picking_file.file, buffer)
-        message += f'Archivo "{picking_file.filename}" actualizado (Picking). '
-        files_uploaded = True
+        try:
+            await csv_ingest.ingest_upload(picking_file, "AURRSGLBD0240")
+            message += f'Archivo "{picking_file.filename}" actualizado (Picking). '
+            files_uploaded = True
+        except Exception as e:
+            error += f'Error Picking: {str(e)}. '
 
     # Manejo del archivo Excel de GRN (Inbound) -> Convertir a JSON
     if grn_excel and grn_excel.filename:
@@ -362,7 +414,7 @@ async def update_files_post(
         background_tasks.add_task(load_csv_data)
         
         # Si se subió el maestro de ítems, sincronizar también la base de datos SQL
-        if item_master and item_master.filename:
+        if master_updated:
             from app.core.db import AsyncSessionLocal
             async def run_sql_sync():
                 async with AsyncSessionLocal() as session:
@@ -372,15 +424,15 @@ async def update_files_post(
         message += " Procesamiento en segundo plano iniciado."
 
     if error:
-        return ORJSONResponse(status_code=400, content={"error": error})
-    return ORJSONResponse(content={"message": message or "No se subieron archivos."})
+        return ORJSONResponse(status_code=400, content={"error": error, "snapshot_job_id": snapshot_job_id})
+    return ORJSONResponse(content={"message": message or "No se subieron archivos.", "snapshot_job_id": snapshot_job_id})
 
 
 @router.post('/api/reload_cache', response_class=ORJSONResponse)
 async def reload_cache_api(username: str = Depends(login_required)):
     """Fuerza la recarga de los datos CSV en la memoria RAM."""
     try:
-        await load_csv_data()
+        await load_csv_data(force=True)
         return {"message": "Caché de memoria RAM recargado correctamente"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al recargar caché: {e}")
@@ -405,6 +457,8 @@ async def clear_database_api(request: Request, password: str = Form(...), db: As
         return ORJSONResponse(status_code=401, content={"error": "Contraseña incorrecta"})
     await db.execute(delete(Log))
     await db.commit()
+    occupancy_service.invalidate_logs()
+    reconciliation_engine.mark_all_dirty()
     return ORJSONResponse(content={"message": "Base de datos de logs limpiada"})
 
 @router.post('/clear_database')
@@ -414,6 +468,8 @@ async def clear_database(request: Request, password: str = Form(...), db: AsyncS
         return RedirectResponse(url=f"{redirect_url}?error=Contraseña+incorrecta", status_code=302)
     await db.execute(delete(Log))
     await db.commit()
+    occupancy_service.invalidate_logs()
+    reconciliation_engine.mark_all_dirty()
     return RedirectResponse(url=f"{redirect_url}?message=Base+de+datos+limpiada", status_code=302)
 
 @router.post('/api/export_all_log')
@@ -421,27 +477,11 @@ async def export_all_log_api(request: Request, password: str = Form(...), db: As
     if password != ADMIN_PASSWORD:
          return ORJSONResponse(status_code=401, content={"error": "Contraseña incorrecta"})
     try:
-        from app.services import db_logs
-        import polars as pl
-        import openpyxl
-        
-        logs_data = await db_logs.load_all_logs_db_async(db)
-        if not logs_data: return ORJSONResponse(status_code=404, content={"error": "No hay datos"})
-        
-        df = pl.DataFrame(logs_data)
-        col_rename = {'timestamp': 'Date', 'importReference': 'Ref', 'itemCode': 'Item'}
-        available = {k: v for k, v in col_rename.items() if k in df.columns}
-        df_export = df.rename(available)
-        
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.append(df_export.columns)
-        for row in df_export.iter_rows():
-            ws.append(list(row))
-            
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        return Response(content=output.getvalue(), media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers={"Content-Disposition": "attachment; filename=backup_logs.xlsx"})
+        from app.services import excel_export, export_jobs
+
+        # Lectura columnar directa a Polars (mismas columnas que load_all_logs_db_async)
+        df_export = await export_jobs.build_all_log_frame(db)
+        if df_export.height == 0: return ORJSONResponse(status_code=404, content={"error": "No hay datos"})
+        return await excel_export.xlsx_response(df_export, "backup_logs.xlsx")
     except Exception as e:
         return ORJSONResponse(status_code=500, content={"error": str(e)})
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Añadir el directorio raíz al path para poder importar la app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import httpx
+import polars as pl
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.middleware.trustedhost import TrustedHostMiddleware
+
+import main
+from app.core.config import COLUMNS_TO_READ_MASTER
+from app.core.db import Base, get_db
+from app.middleware.request_pipeline import RequestPipelineMiddleware
+from app.models.sql_models import User
+from app.services import csv_handler
+
+REQUESTS = 5_000
+CONCURRENCY = 50
+BENCH_ITEMS = 50_000
+HEADERS = {"x-forwarded-proto": "https", "host": "localhost"}
+
+
+# --- Stack anterior (tres BaseHTTPMiddleware), copiado para comparar ---
+
+class LegacySchemeMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        scheme = request.scope.get('scheme', 'http')
+        if "x-forwarded-proto" in request.headers:
+            scheme = request.headers['x-forwarded-proto']
+        request.scope['scheme'] = scheme
+        return await call_next(request)
+
+
+class LegacyHSTSMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        response = await call_next(request)
+        if request.scope.get('scheme', 'http') == 'https':
+            response.headers['Strict-Transport-Security'] = 'max-age=63072000; includeSubDomains; preload'
+        return response
+
+
+class LegacyCSVCacheReloadMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, check_interval: int = 5):
+        super().__init__(app)
+        self.check_interval = check_interval
+        self.last_check = 0
+
+    async def dispatch(self, request: Request, call_next):
+        current_time = time.time()
+        if current_time - self.last_check > self.check_interval:
+            await csv_handler.refresh_generation()
+            self.last_check = current_time
+        return await call_next(request)
+
+
+def build_app(fused: bool, session_factory) -> FastAPI:
+    """Mismas rutas y middlewares que main.app; solo cambia la capa scheme/HSTS/caché."""
+    app = FastAPI(default_response_class=ORJSONResponse)
+    app.router.routes.extend(main.app.router.routes)
+    app.state.limiter = main.app.state.limiter
+
+    async def bench_db():
+        async with session_factory() as session:
+            yield session
+    app.dependency_overrides[get_db] = bench_db
+
+    @app.get("/__bench_login")
+    async def bench_login(request: Request):
+        request.session["user"] = "bench"
+        return {"ok": True}
+
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+    app.add_middleware(CORSMiddleware, allow_origins=main.ALLOWED_ORIGINS, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    app.add_middleware(TrustedHostMiddleware, allowed_hosts=["localhost", "127.0.0.1"])
+    if not fused:
+        app.add_middleware(LegacySchemeMiddleware)
+        app.add_middleware(LegacyHSTSMiddleware)
+    app.add_middleware(SessionMiddleware, secret_key=main.SECRET_KEY, max_age=None)
+    app.add_middleware(RequestPipelineMiddleware if fused else LegacyCSVCacheReloadMiddleware)
+    return app
+
+
+def use_bench_cache(folder: str):
+    """
+    Apunta el caché compartido de csv_handler a `folder` con un maestro sintético de BENCH_ITEMS ítems.
+    Así el benchmark no parsea los CSV reales ni publica generaciones en instance/cache.
+    """
+    master_path = os.path.join(folder, "AURRSGLBD0250.csv")
+    columns = {col: [f"{col}-{i}" for i in range(BENCH_ITEMS)] for col in COLUMNS_TO_READ_MASTER}
+    columns["Item_Code"] = [f"BENCH-{i:06d}" for i in range(BENCH_ITEMS)]
+    columns["Physical_Qty"] = [str(i % 100) for i in range(BENCH_ITEMS)]
+    pl.DataFrame(columns).write_csv(master_path)
+
+    cache_folder = os.path.join(folder, "cache")
+    os.makedirs(cache_folder, exist_ok=True)
+    csv_handler.ITEM_MASTER_CSV_PATH = master_path
+    csv_handler.CACHE_FOLDER = cache_folder
+    csv_handler.CACHE_MANIFEST_PATH = os.path.join(cache_folder, "cache_manifest.json")
+    csv_handler.CACHE_LOCK_PATH = os.path.join(cache_folder, "cache.lock")
+    csv_handler.RESERVATION_JSON_PATH = os.path.join(folder, "reservation_cache.json")
+    csv_handler.PO_LOOKUP_JSON_PATH = os.path.join(folder, "po_lookup.json")
+    # Sin 280, Xdock ni asociación GRN -> I.R.: solo el maestro forma parte de la generación
+    csv_handler._SOURCE_FILES = {key: os.path.join(folder, f"{key}.missing") for key in csv_handler._SOURCE_FILES}
+    csv_handler._SOURCE_FILES["mtime_master"] = master_path
+
+
+async def measure(client: httpx.AsyncClient, path: str) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            t0 = time.perf_counter()
+            response = await client.get(path, headers=HEADERS)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            assert "strict-transport-security" in response.headers
+
+    # Calentamiento
+    for _ in range(100):
+        await client.get(path, headers=HEADERS)
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": REQUESTS / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+async def run_benchmark():
+    """Compara req/s y latencia del stack de middlewares anterior contra el middleware ASGI unificado."""
+    with tempfile.TemporaryDirectory() as folder:
+        use_bench_cache(folder)
+        await csv_handler.load_csv_data()
+        item_code = csv_handler.df_master_cache["Item_Code"][BENCH_ITEMS // 2]
+
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(folder, 'bench.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        async with session_factory() as db:
+            db.add(User(username="bench", password_hash="x", is_approved=1, permissions="stock"))
+            await db.commit()
+
+        print(f"⏱️  Benchmark de middlewares ({REQUESTS} requests, concurrencia {CONCURRENCY}, in-process vía httpx ASGITransport)")
+        print(f"{'endpoint':>28} | {'stack':>10} | {'req/s':>8} | {'p50':>8} | {'p99':>8}")
+        for path in ("/health", f"/api/stock_item/{item_code}"):
+            for label, fused in (("anterior", False), ("unificado", True)):
+                app = build_app(fused, session_factory)
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+                    await client.get("/__bench_login", headers=HEADERS)
+                    r = await measure(client, path)
+                print(f"{path[:28]:>28} | {label:>10} | {r['rps']:>8.0f} | {r['p50']:>6.2f}ms | {r['p99']:>6.2f}ms")
+        await engine.dispose()
+    print("✅ Benchmark completado.")
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -0,0 +1,107 @@
+import random
+import statistics
+import sys
+import os
+import time
+
+# Añadir el directorio raíz al path para poder importar la app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.slotting_service import SlottingService
+
+SIZES = [5_000, 50_000, 200_000]
+QUERIES = 500
+SIC_CODES = ["W", "X", "Y", "K", "L", "Z", "0"]
+
+
+def build_layout(n_bins: int) -> dict:
+    """Genera un layout sintético con la misma forma que slotting_parameters.json."""
+    zones = ["Rack"] * 8 + ["Cantilever", "Minuteria"]
+    storage = {}
+    for i in range(n_bins):
+        storage[f"R{i // 500:03d}-{i % 500:03d}"] = {
+            "zone": random.choice(zones),
+            "aisle": f"{i // 500:03d}",
+            "level": random.randint(0, 5),
+            "spot": random.choice(["Hot", "Warm", "Cold"]),
+            "score": random.randint(0, 10),
+        }
+    return {"storage": storage, "turnover": {}, "zone_rules": {}, "mix_limits": {}}
+
+
+def linear_suggestion(config: dict, occupancy: dict, target_levels, score_min, score_max, ideal_spot: str):
+    """Búsqueda anterior: recorre todo el layout, filtra y ordena todos los candidatos."""
+    rules = config["rules"]
+    candidates = []
+    for bin_code, info in config["storage"].items():
+        level = info.get("level")
+        score = info.get("score", 0)
+        if info.get("zone") != "Rack": continue
+        if target_levels and level not in target_levels: continue
+        if score_min is not None and score < score_min: continue
+        if score_max is not None and score > score_max: continue
+        current_items = occupancy.get(bin_code.upper(), 0)
+        limit = rules["limit_n2"] if level == 2 else rules["limit_others"]
+        if current_items < limit:
+            candidates.append((str(info.get("spot", "Cold")).lower(), score, current_items, bin_code))
+    if not candidates:
+        return None
+    if ideal_spot in ("hot", "warm"):
+        candidates.sort(key=lambda x: (x[0] != ideal_spot, -x[1], x[2]))
+    else:
+        candidates.sort(key=lambda x: (x[0] != "cold", x[1], x[2]))
+    return candidates[0][3]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_benchmark():
+    """Mide el costo por sugerencia (índice vs recorrido lineal) a distintos tamaños de layout."""
+    random.seed(42)
+    service = SlottingService()
+    print(f"⏱️  Benchmark de slotting ({QUERIES} sugerencias por tamaño)")
+    print(f"{'bins':>8} | {'índice build':>12} | {'lineal p50':>10} | {'lineal p99':>10} | {'índice p50':>10} | {'índice p99':>10}")
+
+    for n_bins in SIZES:
+        config = build_layout(n_bins)
+        t0 = time.perf_counter()
+        config.update(service._build_layout_index(config))
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        occupancy = {code.upper(): random.randint(0, 6) for code in config["storage"]}
+        rules = config["rules"]
+        received_bins = list(occupancy)[:1000]
+
+        linear_times, index_times = [], []
+        for _ in range(QUERIES):
+            sic = random.choice(SIC_CODES)
+            if sic in ("W", "X"):
+                levels, s_min, s_max, spot = rules["high_rotation_levels"], rules["high_rotation_min_score"], rules["high_rotation_max_score"], "hot"
+            elif sic in ("Y", "K"):
+                levels, s_min, s_max, spot = rules["medium_rotation_levels"], rules["medium_rotation_min_score"], rules["medium_rotation_max_score"], "warm"
+            else:
+                levels, s_min, s_max, spot = rules["exile_levels"], None, None, "cold"
+
+            t0 = time.perf_counter()
+            linear_suggestion(config, occupancy, levels, s_min, s_max, spot)
+            linear_times.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            service._find_best_bin(config, ["Rack"], levels, s_min, s_max, spot, occupancy, token=1)
+            index_times.append((time.perf_counter() - t0) * 1000)
+
+            # Simular recepciones entre escaneos: algunos bins ganan un SKU (subida perezosa en el heap)
+            occupancy[random.choice(received_bins)] += 1
+
+        print(
+            f"{n_bins:>8} | {build_ms:>10.1f}ms | {statistics.median(linear_times):>8.3f}ms | {percentile(linear_times, 0.99):>8.3f}ms"
+            f" | {statistics.median(index_times):>8.3f}ms | {percentile(index_times, 0.99):>8.3f}ms"
+        )
+
+    print("✅ Benchmark completado.")
+
+if __name__ == "__main__":
+    run_benchmark()
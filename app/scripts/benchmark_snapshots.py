@@ -0,0 +1,134 @@
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Añadir el directorio raíz al path para poder importar la app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.core.db import Base
+from app.models.sql_models import ReconciliationHistory
+from app.services import reconciliation_service
+
+SIZES = [5_000, 50_000]
+SNAPSHOTS = 10
+CHANGED_PER_SNAPSHOT = 0.02   # Fracción de filas que cambian entre snapshots (recepciones nuevas)
+
+
+def build_reconciliation(n_rows: int) -> list:
+    """Conciliación sintética con la forma de get_reconciliation_calculations."""
+    descriptions = [f"REPUESTO {i} " + "X" * random.randint(10, 60) for i in range(n_rows // 4)]
+    bins = [f"R{i // 40:03d}-{i % 40:02d}" for i in range(2_000)]
+    rows = []
+    for i in range(n_rows):
+        expected = random.randint(1, 50)
+        received = random.randint(0, expected)
+        rows.append({
+            "Import_Reference": f"IR{i // 200:05d}",
+            "Waybill": f"WB{i // 200:07d}",
+            "GRN": f"G{i // 20:06d}",
+            "Codigo_Item": f"IT{random.randint(0, n_rows):07d}",
+            "Descripcion": random.choice(descriptions),
+            "Ubicacion": random.choice(bins),
+            "Reubicado": random.choice(["", "", random.choice(bins)]),
+            "Cant_Esperada": expected,
+            "Cant_Recibida": received,
+            "Diferencia": received - expected,
+            "Timestamp": f"2026-10-{random.randint(1, 28):02d}T{random.randint(0, 23):02d}:00:00",
+        })
+    return rows
+
+
+def legacy_rows(data: list, archive_date: str) -> list:
+    """Filas para reconciliation_history (formato anterior: una fila por línea y snapshot)."""
+    return [{
+        "archive_date": archive_date,
+        "import_reference": row["Import_Reference"], "waybill": row["Waybill"], "grn": row["GRN"],
+        "item_code": row["Codigo_Item"], "description": row["Descripcion"],
+        "bin_location": row["Ubicacion"], "relocated_bin": row["Reubicado"],
+        "qty_expected": row["Cant_Esperada"], "qty_received": row["Cant_Recibida"], "difference": row["Diferencia"],
+        "username": "benchmark", "timestamp": row["Timestamp"],
+    } for row in data]
+
+
+async def db_size_mb(engine) -> float:
+    async with engine.connect() as conn:
+        await conn.execute(text("VACUUM"))
+        page_count = (await conn.execute(text("PRAGMA page_count"))).scalar()
+        page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+    return page_count * page_size / 1024 / 1024
+
+
+async def run_size(folder: str, n_rows: int):
+    engines = {}
+    for name in ("legacy", "blob"):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(folder, f'{name}_{n_rows}.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        engines[name] = engine
+
+    data = build_reconciliation(n_rows)
+    write = {"legacy": [], "blob": []}
+    archive_dates = []
+    for s in range(SNAPSHOTS):
+        # Entre snapshots solo cambia una parte de las líneas
+        for row in random.sample(data, int(n_rows * CHANGED_PER_SNAPSHOT)):
+            row["Cant_Recibida"] += 1
+            row["Diferencia"] = row["Cant_Recibida"] - row["Cant_Esperada"]
+        archive_date = f"AUTO-2026-10-17 10:{s:02d}:00"
+        archive_dates.append(archive_date)
+
+        async with async_sessionmaker(engines["legacy"])() as db:
+            t0 = time.perf_counter()
+            await db.execute(insert(ReconciliationHistory), legacy_rows(data, archive_date))
+            await db.commit()
+            write["legacy"].append((time.perf_counter() - t0) * 1000)
+
+        async with async_sessionmaker(engines["blob"])() as db:
+            t0 = time.perf_counter()
+            await reconciliation_service.create_snapshot(db, data, "benchmark", is_auto=True, client_timestamp=f"2026-10-17T10:{s:02d}:00")
+            write["blob"].append((time.perf_counter() - t0) * 1000)
+
+    read = {"legacy": [], "blob": []}
+    for archive_date in archive_dates:
+        async with async_sessionmaker(engines["legacy"])() as db:
+            # Lectura anterior: objetos ORM -> dicts
+            t0 = time.perf_counter()
+            res = await db.execute(select(ReconciliationHistory).where(ReconciliationHistory.archive_date == archive_date))
+            [{"GRN": r.grn, "Codigo_Item": r.item_code, "Descripcion": r.description, "Diferencia": r.difference} for r in res.scalars().all()]
+            read["legacy"].append((time.perf_counter() - t0) * 1000)
+
+        async with async_sessionmaker(engines["blob"])() as db:
+            t0 = time.perf_counter()
+            (await reconciliation_service.load_snapshot(db, archive_date)).to_dicts()
+            read["blob"].append((time.perf_counter() - t0) * 1000)
+
+    sizes = {name: await db_size_mb(engine) for name, engine in engines.items()}
+    for engine in engines.values():
+        await engine.dispose()
+
+    for name in ("legacy", "blob"):
+        print(
+            f"{n_rows:>8} | {name:>7} | {sizes[name]:>8.2f}MB | {statistics.median(write[name]):>8.1f}ms"
+            f" | {statistics.median(read[name]):>8.1f}ms"
+        )
+
+
+async def run_benchmark():
+    """Compara almacenamiento y tiempos de escritura/lectura: reconciliation_history por filas vs blob comprimido."""
+    random.seed(42)
+    print(f"⏱️  Benchmark de snapshots de conciliación ({SNAPSHOTS} snapshots por tamaño, SQLite)")
+    print(f"{'filas':>8} | {'formato':>7} | {'tamaño DB':>10} | {'escritura':>10} | {'lectura':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for n_rows in SIZES:
+            await run_size(folder, n_rows)
+    print("✅ Benchmark completado.")
+
+if __name__ == "__main__":
+    asyncio.run(run_benchmark())
@@ -1,8 +1,9 @@
 import datetime
 import os
 import orjson
-from typing import Dict, Any, Optional, List
-from sqlalchemy import select, update, insert
+from collections import Counter
+from typing import Dict, Any, Optional, List, Iterable, Tuple
+from sqlalchemy import select, update, insert, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.sql_models import AIItemPattern, AICategoryPattern
 from app.core.config import PROJECT_ROOT
@@ -78,56 +79,58 @@ class AISlottingService:
         Registra una decisión de ubicación exitosa en la DB y actualiza el cache.
         Excluye ubicaciones virtuales como XDOCK para no contaminar la IA.
         """
-        if not final_bin or not item_code:
+        staged = await self.stage_decisions(db, [(item_code, final_bin, sic_code)])
+        if not staged[0]:
             return
+        await db.commit()
+        self.remember(staged)
 
-        final_bin = final_bin.strip().upper()
-        
-        # Filtro de seguridad: No aprender de bines virtuales
-        if final_bin in ["XDOCK", "PUTAWAY", "STAGE", "TRANSITO"]:
-            return
+    async def stage_decisions(self, db: AsyncSession, decisions: Iterable[Tuple[str, str, Optional[str]]]) -> Tuple[Counter, Counter]:
+        """
+        Suma en la sesión (sin commit) las decisiones (item_code, bin final, sic_code) de un lote:
+        una consulta por tabla para todo el lote, sin importar cuántas líneas traiga.
+        Retorna los incrementos (ítem, bin) y (categoría, bin); pasarlos a remember() después del commit.
+        """
+        item_increments, category_increments = Counter(), Counter()
+        for item_code, final_bin, sic_code in decisions:
+            if not final_bin or not item_code:
+                continue
+            final_bin = final_bin.strip().upper()
+            # Filtro de seguridad: No aprender de bines virtuales
+            if final_bin in ["XDOCK", "PUTAWAY", "STAGE", "TRANSITO"]:
+                continue
+            item_increments[(item_code.strip().upper(), final_bin)] += 1
+            category_increments[(sic_code.strip().upper() if sic_code else "N/A", final_bin)] += 1
+        if not item_increments:
+            return item_increments, category_increments
 
         await self._ensure_initialized(db)
-        
-        item_code = item_code.strip().upper()
-        sic_code = sic_code.strip().upper() if sic_code else "N/A"
         now = datetime.datetime.now(datetime.timezone.utc).isoformat()
 
-        # 1. Aprender por Item Específico (DB + Cache)
-        if item_code not in self._item_cache:
-            self._item_cache[item_code] = {}
-        
-        self._item_cache[item_code][final_bin] = self._item_cache[item_code].get(final_bin, 0) + 1
-        
-        stmt_item = select(AIItemPattern).where(AIItemPattern.item_code == item_code, AIItemPattern.bin_code == final_bin)
-        res_item = await db.execute(stmt_item)
-        existing_item = res_item.scalar_one_or_none()
-        
-        if existing_item:
-            existing_item.frequency += 1
-            existing_item.last_updated = now
-        else:
-            db.add(AIItemPattern(item_code=item_code, bin_code=final_bin, frequency=1, last_updated=now))
-
-        # 2. Aprender por Categoría (DB + Cache)
-        if sic_code not in self._category_cache:
-            self._category_cache[sic_code] = {}
-        
-        self._category_cache[sic_code][final_bin] = self._category_cache[sic_code].get(final_bin, 0) + 1
-        
-        stmt_cat = select(AICategoryPattern).where(AICategoryPattern.sic_code == sic_code, AICategoryPattern.bin_code == final_bin)
-        res_cat = await db.execute(stmt_cat)
-        existing_cat = res_cat.scalar_one_or_none()
-        
-        if existing_cat:
-            existing_cat.frequency += 1
-            existing_cat.last_updated = now
-        else:
-            db.add(AICategoryPattern(sic_code=sic_code, bin_code=final_bin, frequency=1, last_updated=now))
-
-        await db.commit()
-
-    async def predict_best_bin(self, db: AsyncSession, item_code: str, sic_code: str, fallback_bin: Optional[str] = None) -> Optional[str]:
+        for model, key_column, increments in (
+            (AIItemPattern, AIItemPattern.item_code, item_increments),
+            (AICategoryPattern, AICategoryPattern.sic_code, category_increments),
+        ):
+            result = await db.execute(select(model).where(tuple_(key_column, model.bin_code).in_(list(increments))))
+            pending = dict(increments)
+            for pattern in result.scalars().all():
+                inc = pending.pop((getattr(pattern, key_column.key), pattern.bin_code), None)
+                if inc:
+                    pattern.frequency += inc
+                    pattern.last_updated = now
+            for (key, bin_code), inc in pending.items():
+                db.add(model(**{key_column.key: key, "bin_code": bin_code, "frequency": inc, "last_updated": now}))
+        return item_increments, category_increments
+
+    def remember(self, staged: Tuple[Counter, Counter]):
+        """Aplica al cache en memoria los incrementos de stage_decisions ya confirmados en la DB."""
+        item_increments, category_increments = staged
+        for cache, increments in ((self._item_cache, item_increments), (self._category_cache, category_increments)):
+            for (key, bin_code), inc in increments.items():
+                bins = cache.setdefault(key, {})
+                bins[bin_code] = bins.get(bin_code, 0) + inc
+
+    async def predict_best_bin(self, db: AsyncSession, item_code: str, sic_code: str, fallback_bin: Optional[str] = None, layout_config: Optional[Dict[str, Any]] = None) -> Optional[str]:
         """
         Predice la ubicación más probable basada en el cache de memoria (respaldado por DB).
         Filtra las predicciones por categoría asegurando que el spot (Hot/Cold) coincida.
@@ -147,8 +150,10 @@ class AISlottingService:
         # Prioridad 2: Categoría SIC (Media Confianza con Conciencia Espacial)
         if sic_code in self._category_cache:
             # Obtener configuración del almacén localmente para evitar importaciones circulares
-            from app.services.slotting_service import slotting_service
-            config = await slotting_service._get_layout_config(db)
+            config = layout_config
+            if config is None:
+                from app.services.slotting_service import slotting_service
+                config = await slotting_service._get_layout_config(db)
             storage = config.get('storage', {})
             turnover_map = config.get('turnover', {})
 
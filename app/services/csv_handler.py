@@ -1,13 +1,22 @@
 import os
+import asyncio
 import orjson
 import polars as pl
+from contextlib import contextmanager
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.models.sql_models import MasterItem
+from app.services import csv_ingest
+from app.services.grn_ir_map import grn_ir_map, build_from_files
 from fastapi import HTTPException
 import time
 import traceback
 
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): sin bloqueo entre procesos
+    fcntl = None
+
 # Importaciones de configuración
 from app.core.config import (
     ITEM_MASTER_CSV_PATH,
@@ -15,128 +24,467 @@ from app.core.config import (
     COLUMNS_TO_READ_MASTER,
     COLUMNS_TO_READ_GRN,
     RESERVATION_CSV_PATH,
-    RESERVATION_JSON_PATH
+    RESERVATION_JSON_PATH,
+    GRN_JSON_DATA_PATH,
+    PO_LOOKUP_JSON_PATH,
+    CACHE_FOLDER,
+    CACHE_MANIFEST_PATH,
+    CACHE_LOCK_PATH
 )
 
 # --- CACHÉ DE ALTO RENDIMIENTO (ESTADO CALIENTE) ---
-df_master_cache = None 
-df_grn_cache = None    
-master_qty_map = {} 
+# Los DataFrames se mapean en memoria (zero-copy) desde archivos Arrow IPC compartidos
+# por todos los workers de Granian. Un único worker parsea los CSV y publica una nueva
+# "generación"; el resto solo la mapea cuando detecta que el contador cambió.
+df_master_cache = None
+df_grn_cache = None
+master_qty_map = {}
+master_index = {} # Índice hash Item_Code -> posición de fila en df_master_cache (O(1))
 reservation_qty_map = {} # Cache para Xdock (Item_Code -> dict con total y customers)
+grn_expected_map = {} # Item_Code normalizado -> cantidad total esperada en la 280
+grn_ir_expected_map = {} # (Import_Reference, Item_Code) -> cantidad esperada en la 280
+ir_items_map = {} # Import_Reference -> lista de Item_Code (po_lookup + 280)
+cache_generation = 0 # Generación del caché compartido mapeada por este worker
 
 _last_check = 0
-_mtime_master = 0
-_mtime_grn = 0
+_attached_files = {} # Clave *_file del manifiesto -> archivo IPC mapeado por este worker
+_attach_lock = asyncio.Lock()
 
-async def generate_reservation_cache():
-    """Genera el caché de Xdock desde CSV o JSON usando orjson."""
-    global reservation_qty_map
+# Archivos fuente que forman parte de una generación (clave en el manifiesto -> ruta)
+_SOURCE_FILES = {
+    "mtime_master": ITEM_MASTER_CSV_PATH,
+    "mtime_grn": GRN_CSV_FILE_PATH,
+    "mtime_reservation": RESERVATION_CSV_PATH,
+    # La asociación GRN -> I.R. alimenta el mapa (I.R., Item) de cantidades esperadas
+    "mtime_grn_json": GRN_JSON_DATA_PATH,
+    "mtime_po_lookup": PO_LOOKUP_JSON_PATH,
+}
+
+# --- Manifiesto de generaciones (compartido entre workers) ---
+
+def _read_manifest() -> dict:
+    """Lee el manifiesto de la generación publicada (vacío si aún no existe)."""
+    try:
+        with open(CACHE_MANIFEST_PATH, 'rb') as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+def _write_atomic(path: str, payload: bytes):
+    """Escribe un archivo de forma atómica (tmp + rename) para que ningún worker lea datos a medias."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+@contextmanager
+def _generation_lock():
+    """Bloqueo entre procesos para que un solo worker reconstruya el caché a la vez."""
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    with open(CACHE_LOCK_PATH, 'a+b') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _current_source_mtimes() -> dict:
+    return {key: (os.path.getmtime(path) if os.path.exists(path) else 0) for key, path in _SOURCE_FILES.items()}
+
+def _sources_changed(manifest: dict) -> bool:
+    """True si algún CSV fuente es más reciente que la generación publicada."""
+    if not manifest:
+        return any(os.path.exists(p) for p in _SOURCE_FILES.values())
+    return any(mtime > manifest.get(key, 0) for key, mtime in _current_source_mtimes().items())
+
+def read_cache_generation() -> int:
+    """Retorna el contador de la última generación publicada por cualquier worker."""
+    return int(_read_manifest().get("generation", 0))
+
+# --- Parseo de CSV (solo lo ejecuta el worker que publica la generación) ---
+
+def _parse_master_csv() -> pl.DataFrame:
+    raw_master = csv_ingest.scan_report(ITEM_MASTER_CSV_PATH, COLUMNS_TO_READ_MASTER,
+                                        null_values=['', 'nan', 'NaN', 'None', 'null'])
+    return (
+        raw_master
+        .filter(pl.col("Item_Code").is_not_null())
+        .with_columns([
+            pl.col("Item_Code").str.strip_chars().str.to_uppercase(),
+            pl.col("Physical_Qty").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0)
+        ])
+        .collect()
+    )
+
+def _parse_grn_csv() -> pl.DataFrame:
+    raw_grn = csv_ingest.scan_report(GRN_CSV_FILE_PATH, COLUMNS_TO_READ_GRN)
+    return (
+        raw_grn
+        .filter(pl.col("Item_Code").is_not_null())
+        .with_columns([
+            pl.col("Quantity").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0)
+        ])
+        .collect()
+    )
+
+def _load_grn_to_ir_frame() -> pl.DataFrame:
+    """Asociación GRN -> I.R. desde el mapa persistido (o desde los JSON si aún no está al día)."""
+    df = grn_ir_map.get_persisted()
+    if df is None:
+        df = build_from_files()
+    return df.select(["grn_map", "ir_map"])
+
+def _aggregate_grn_by_ir(df_grn: pl.DataFrame) -> pl.DataFrame:
+    """Agrupa la 280 por (I.R., Item) resolviendo la I.R. a partir del GRN (la 280 no trae la I.R.)."""
+    return (
+        df_grn
+        .select([
+            pl.col("GRN_Number").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+            pl.col("Item_Code").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+            pl.col("Quantity"),
+        ])
+        .join(_load_grn_to_ir_frame(), left_on="GRN_Number", right_on="grn_map", how="inner")
+        .group_by(["ir_map", "Item_Code"])
+        .agg(pl.col("Quantity").sum())
+        .rename({"ir_map": "Import_Reference"})
+    )
+
+def _aggregate_grn_by_item(df_grn: pl.DataFrame) -> pl.DataFrame:
+    """Cantidad total esperada por Item_Code normalizado en la 280."""
+    return (
+        df_grn
+        .group_by(pl.col("Item_Code").str.strip_chars().str.to_uppercase())
+        .agg(pl.col("Quantity").sum().cast(pl.Int64))
+        .filter(pl.col("Item_Code").is_not_null() & (pl.col("Item_Code") != ""))
+    )
+
+def _load_ir_items_frame() -> pl.DataFrame:
+    """Pares (I.R., Item) declarados en po_lookup.json (ir_to_data)."""
+    pairs = []
+    if os.path.exists(PO_LOOKUP_JSON_PATH):
+        try:
+            with open(PO_LOOKUP_JSON_PATH, 'rb') as f:
+                po_cache = orjson.loads(f.read())
+            for ir, data in po_cache.get("ir_to_data", {}).items():
+                ir = str(ir).strip().upper()
+                for item in data.get("items", []):
+                    code = str(item.get("item_code", "")).strip().upper()
+                    if ir and code:
+                        pairs.append({"Import_Reference": ir, "Item_Code": code})
+        except Exception as e:
+            print(f"⚠️ Error leyendo po_lookup para ítems por I.R.: {e}")
+    if not pairs:
+        return pl.DataFrame(schema={"Import_Reference": pl.Utf8, "Item_Code": pl.Utf8})
+    return pl.DataFrame(pairs)
+
+def _build_reservation_json():
+    """Procesa el CSV de reservas (Xdock) y guarda el mapa agregado en JSON con orjson."""
     if not os.path.exists(RESERVATION_CSV_PATH):
-        if os.path.exists(RESERVATION_JSON_PATH):
-            try:
-                with open(RESERVATION_JSON_PATH, 'rb') as f:
-                    reservation_qty_map = orjson.loads(f.read())
-            except: pass
         return
-    
-    try:
-        df = pl.read_csv(RESERVATION_CSV_PATH, infer_schema_length=0, null_values=['', 'nan', 'NaN'], 
-                         columns=["Item_Code", "Quantity_reserved", "SO_Number", "Customer_Code", "Customer_Name"], 
-                         ignore_errors=True)
-        
-        processed_df = (
-            df.filter(
-                (pl.col("Item_Code").is_not_null()) & 
-                (pl.col("SO_Number").is_not_null()) & 
-                (pl.col("SO_Number").cast(pl.Utf8).str.strip_chars() != "")
-            )
-            .with_columns([
-                pl.col("Item_Code").str.strip_chars().str.to_uppercase(),
-                pl.col("Quantity_reserved").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
-                pl.col("Customer_Name").fill_null("SIN NOMBRE"),
-                pl.col("Customer_Code").fill_null("N/A")
-            ])
-        )
 
-        customer_summary = (
-            processed_df.group_by(["Item_Code", "Customer_Code", "Customer_Name"])
-            .agg(pl.col("Quantity_reserved").sum().alias("customer_qty"))
-            .filter(pl.col("customer_qty") > 0)
+    df = csv_ingest.scan_report(
+        RESERVATION_CSV_PATH, ["Item_Code", "Quantity_reserved", "SO_Number", "Customer_Code", "Customer_Name"]
+    ).collect()
+
+    processed_df = (
+        df.filter(
+            (pl.col("Item_Code").is_not_null()) &
+            (pl.col("SO_Number").is_not_null()) &
+            (pl.col("SO_Number").cast(pl.Utf8).str.strip_chars() != "")
         )
+        .with_columns([
+            pl.col("Item_Code").str.strip_chars().str.to_uppercase(),
+            pl.col("Quantity_reserved").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
+            pl.col("Customer_Name").fill_null("SIN NOMBRE"),
+            pl.col("Customer_Code").fill_null("N/A")
+        ])
+    )
+
+    customer_summary = (
+        processed_df.group_by(["Item_Code", "Customer_Code", "Customer_Name"])
+        .agg(pl.col("Quantity_reserved").sum().alias("customer_qty"))
+        .filter(pl.col("customer_qty") > 0)
+    )
+
+    final_map = {}
+    for row in customer_summary.to_dicts():
+        item = row["Item_Code"]
+        if item not in final_map:
+            final_map[item] = {"total": 0, "customers": []}
+
+        qty = int(row["customer_qty"])
+        final_map[item]["total"] += qty
+        final_map[item]["customers"].append({
+            "code": row["Customer_Code"],
+            "name": row["Customer_Name"],
+            "qty": qty
+        })
+
+    _write_atomic(RESERVATION_JSON_PATH, orjson.dumps(final_map))
+
+def _cleanup_old_generations(keep: set):
+    """Elimina archivos IPC de generaciones anteriores (los workers que aún los mapean no se ven afectados en Linux)."""
+    for name in os.listdir(CACHE_FOLDER):
+        if name.endswith('.arrow') and name not in keep:
+            try:
+                os.remove(os.path.join(CACHE_FOLDER, name))
+            except OSError:
+                pass
+
+def _publish_generation(manifest: dict, updates: dict) -> dict:
+    """Escribe un nuevo manifiesto con el contador incrementado. Debe llamarse con el lock tomado."""
+    new_manifest = {**manifest, **updates, "generation": int(manifest.get("generation", 0)) + 1, "published_at": time.time()}
+    _write_atomic(CACHE_MANIFEST_PATH, orjson.dumps(new_manifest))
+
+    # Conservar la generación actual y la anterior para los workers que aún no hayan cambiado
+    keep = {v for m in (new_manifest, manifest) for k, v in m.items() if k.endswith("_file") and v}
+    _cleanup_old_generations(keep)
+    return new_manifest
+
+def _master_index_frame(df_master: pl.DataFrame) -> pl.DataFrame:
+    """Item_Code -> (fila, stock) del maestro; ante códigos duplicados prevalece la primera fila."""
+    return (
+        df_master
+        .with_row_index("row")
+        .filter(pl.col("Item_Code").is_not_null() & (pl.col("Item_Code") != ""))
+        .unique(subset="Item_Code", keep="first", maintain_order=True)
+        .select(["Item_Code", "row", pl.col("Physical_Qty").cast(pl.Int64)])
+    )
+
+def _reusable(manifest: dict, updates: dict, force: bool, mtime_keys: tuple, file_keys: tuple) -> bool:
+    """True si los archivos de la generación vigente siguen valiendo: mismas fuentes y presentes en disco."""
+    if force:
+        return False
+    return all(manifest.get(key) == updates[key] for key in mtime_keys) and all(
+        manifest.get(key) and os.path.exists(os.path.join(CACHE_FOLDER, manifest[key])) for key in file_keys
+    )
+
+def _build_shared_generation(force: bool = False) -> dict:
+    """
+    Parsea los CSV y publica una nueva generación IPC si los archivos fuente cambiaron.
+    Solo se rehacen los archivos cuyas fuentes cambiaron; el resto conserva el nombre de la generación
+    anterior (y los workers, que comparan nombres, no reconstruyen sus mapas).
+    Si otro worker ya publicó la generación vigente mientras esperábamos el lock, solo la retorna.
+    """
+    with _generation_lock():
+        manifest = _read_manifest()
+        if not force and not _sources_changed(manifest):
+            return manifest
+
+        generation = int(manifest.get("generation", 0)) + 1
+        updates = _current_source_mtimes()
+        df_grn = df_grn_ir = None
 
-        final_map = {}
-        for row in customer_summary.to_dicts():
-            item = row["Item_Code"]
-            if item not in final_map:
-                final_map[item] = {"total": 0, "customers": []}
-            
-            qty = int(row["customer_qty"])
-            final_map[item]["total"] += qty
-            final_map[item]["customers"].append({
-                "code": row["Customer_Code"],
-                "name": row["Customer_Name"],
-                "qty": qty
-            })
-
-        reservation_qty_map = final_map
-        with open(RESERVATION_JSON_PATH, 'wb') as f:
-            f.write(orjson.dumps(reservation_qty_map))
+        if os.path.exists(ITEM_MASTER_CSV_PATH) and not _reusable(manifest, updates, force, ("mtime_master",), ("master_file", "master_index_file")):
+            master_file = f"master.{generation}.arrow"
+            df_master = _parse_master_csv()
+            # Sin compresión: requisito para mapear el archivo en memoria sin copias
+            df_master.write_ipc(os.path.join(CACHE_FOLDER, master_file), compression='uncompressed')
+            updates["master_file"] = master_file
+
+            # Índice y stock por ítem: cada worker solo los pasa a diccionario, sin recorrer el maestro
+            master_index_file = f"master_index.{generation}.arrow"
+            _master_index_frame(df_master).write_ipc(os.path.join(CACHE_FOLDER, master_index_file), compression='uncompressed')
+            updates["master_index_file"] = master_index_file
+
+        has_grn = os.path.exists(GRN_CSV_FILE_PATH)
+        if has_grn and not _reusable(manifest, updates, force, ("mtime_grn",), ("grn_file", "grn_expected_file")):
+            grn_file = f"grn.{generation}.arrow"
+            df_grn = _parse_grn_csv()
+            df_grn.write_ipc(os.path.join(CACHE_FOLDER, grn_file), compression='uncompressed')
+            updates["grn_file"] = grn_file
+
+            # Total esperado por ítem: una sola agregación por 280, no una por worker y generación
+            grn_expected_file = f"grn_expected.{generation}.arrow"
+            _aggregate_grn_by_item(df_grn).write_ipc(os.path.join(CACHE_FOLDER, grn_expected_file), compression='uncompressed')
+            updates["grn_expected_file"] = grn_expected_file
+
+        if has_grn and (df_grn is not None or not _reusable(manifest, updates, force, ("mtime_grn_json",), ("grn_ir_file",))):
+            if df_grn is None:
+                df_grn = pl.read_ipc(os.path.join(CACHE_FOLDER, manifest["grn_file"]))
+            # Totales por (I.R., Item) precalculados una sola vez por generación
+            grn_ir_file = f"grn_ir.{generation}.arrow"
+            df_grn_ir = _aggregate_grn_by_ir(df_grn)
+            df_grn_ir.write_ipc(os.path.join(CACHE_FOLDER, grn_ir_file), compression='uncompressed')
+            updates["grn_ir_file"] = grn_ir_file
+
+        # Ítems por I.R. (po_lookup + asociación GRN de la 280) para las sugerencias en lote
+        if df_grn_ir is not None or not _reusable(manifest, updates, force, ("mtime_po_lookup",), ("ir_items_file",)):
+            if df_grn_ir is None and has_grn and manifest.get("grn_ir_file"):
+                df_grn_ir = pl.read_ipc(os.path.join(CACHE_FOLDER, manifest["grn_ir_file"]))
+            ir_items = _load_ir_items_frame()
+            if df_grn_ir is not None:
+                ir_items = pl.concat([ir_items, df_grn_ir.select(["Import_Reference", "Item_Code"])])
+            ir_items_file = f"ir_items.{generation}.arrow"
+            ir_items.unique(maintain_order=True).write_ipc(os.path.join(CACHE_FOLDER, ir_items_file), compression='uncompressed')
+            updates["ir_items_file"] = ir_items_file
+
+        if force or manifest.get("mtime_reservation") != updates["mtime_reservation"] or not os.path.exists(RESERVATION_JSON_PATH):
+            try:
+                _build_reservation_json()
+            except Exception as e:
+                print(f"❌ Error Xdock Cache: {e}")
+
+        return _publish_generation(manifest, updates)
+
+# --- Mapeo de la generación publicada en este worker ---
+
+def _map_ipc(file_name: str):
+    """Mapea un IPC de la generación; FileNotFoundError si el manifiesto lo referencia pero ya no está."""
+    if not file_name:
+        return None
+    path = os.path.join(CACHE_FOLDER, file_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    # Polars mapea en memoria los IPC locales sin comprimir por defecto (lectura zero-copy)
+    return pl.read_ipc(path)
+
+def _load_generation(manifest: dict):
+    """
+    Arma el estado caliente de la generación indicada (se ejecuta en un hilo, fuera del event loop).
+    Solo se vuelven a mapear y convertir a diccionario los archivos que cambiaron respecto de la
+    generación mapeada; el resto se reutiliza. Retorna None si falta algún archivo referenciado.
+    """
+    def changed(key: str) -> bool:
+        return manifest.get(key) != _attached_files.get(key)
+
+    state = {
+        "df_master_cache": df_master_cache, "df_grn_cache": df_grn_cache,
+        "master_qty_map": master_qty_map, "master_index": master_index,
+        "grn_expected_map": grn_expected_map, "grn_ir_expected_map": grn_ir_expected_map,
+        "ir_items_map": ir_items_map, "reservation_qty_map": reservation_qty_map,
+    }
+    try:
+        if changed("master_file") or changed("master_index_file"):
+            state["df_master_cache"] = _map_ipc(manifest.get("master_file"))
+            df_index = _map_ipc(manifest.get("master_index_file"))
+            codes = df_index.get_column("Item_Code").to_list() if df_index is not None else []
+            state["master_index"] = dict(zip(codes, df_index.get_column("row").to_list())) if codes else {}
+            state["master_qty_map"] = dict(zip(codes, df_index.get_column("Physical_Qty").to_list())) if codes else {}
+
+        if changed("grn_file"):
+            state["df_grn_cache"] = _map_ipc(manifest.get("grn_file"))
+
+        # Generaciones que no tocan la 280 (p. ej. solo Xdock) conservan el archivo: no se rehace el mapa
+        if changed("grn_expected_file"):
+            state["grn_expected_map"] = {}
+            df_expected = _map_ipc(manifest.get("grn_expected_file"))
+            if df_expected is not None:
+                state["grn_expected_map"] = dict(zip(df_expected.get_column("Item_Code").to_list(), df_expected.get_column("Quantity").to_list()))
+
+        if changed("grn_ir_file"):
+            state["grn_ir_expected_map"] = {}
+            new_grn_ir = _map_ipc(manifest.get("grn_ir_file"))
+            if new_grn_ir is not None:
+                state["grn_ir_expected_map"] = {
+                    (str(ir), str(code)): int(qty)
+                    for ir, code, qty in new_grn_ir.select(["Import_Reference", "Item_Code", "Quantity"]).iter_rows()
+                    if code
+                }
+
+        if changed("ir_items_file"):
+            state["ir_items_map"] = {}
+            df_ir_items = _map_ipc(manifest.get("ir_items_file"))
+            if df_ir_items is not None:
+                for ir, code in df_ir_items.iter_rows():
+                    state["ir_items_map"].setdefault(ir, []).append(code)
+    except FileNotFoundError as e:
+        print(f"⚠️ [ARROW] Generación {manifest.get('generation')} incompleta en disco: {e}")
+        return None
+
+    if changed("mtime_reservation") and os.path.exists(RESERVATION_JSON_PATH):
+        try:
+            with open(RESERVATION_JSON_PATH, 'rb') as f:
+                state["reservation_qty_map"] = orjson.loads(f.read())
+        except Exception as e:
+            print(f"❌ Error Xdock Cache: {e}")
+
+    state["files"] = {key: value for key, value in manifest.items() if key.endswith("_file") or key == "mtime_reservation"}
+    return state
+
+async def _attach_generation(manifest: dict) -> bool:
+    """
+    Mapea en memoria la generación indicada y sustituye el estado caliente de este worker.
+    El mapeo y los diccionarios se arman en un hilo; en el event loop solo se intercambian las
+    referencias (atómico para las corrutinas). Si la limpieza de otro worker ya borró algún archivo
+    se relee el manifiesto una vez; si tampoco está completa se conserva la generación actual.
+    """
+    global df_master_cache, df_grn_cache, master_qty_map, master_index, reservation_qty_map, cache_generation
+    global grn_expected_map, grn_ir_expected_map, ir_items_map, _attached_files
+    async with _attach_lock:
+        for _ in range(2):
+            if not manifest:
+                return False
+            if int(manifest.get("generation", 0)) == cache_generation:
+                return True   # Otra corrutina ya la mapeó mientras esperábamos el lock
+            state = await asyncio.to_thread(_load_generation, manifest)
+            if state is not None:
+                break
+            manifest = _read_manifest()
+        else:
+            print(f"⚠️ [ARROW] Worker {os.getpid()} conserva la generación {cache_generation}")
+            return False
+
+        df_master_cache, df_grn_cache = state["df_master_cache"], state["df_grn_cache"]
+        master_qty_map, master_index, reservation_qty_map = state["master_qty_map"], state["master_index"], state["reservation_qty_map"]
+        grn_expected_map, grn_ir_expected_map, ir_items_map = state["grn_expected_map"], state["grn_ir_expected_map"], state["ir_items_map"]
+        _attached_files = state["files"]
+        cache_generation = int(manifest.get("generation", 0))
+        return True
+
+async def refresh_generation() -> bool:
+    """Cambia a la última generación publicada si difiere de la mapeada. Solo compara el contador."""
+    manifest = _read_manifest()
+    if manifest and int(manifest.get("generation", 0)) != cache_generation:
+        if await _attach_generation(manifest):
+            print(f"🔄 [ARROW] Worker {os.getpid()} cambió a la generación {cache_generation}")
+            return True
+    return False
+
+async def generate_reservation_cache():
+    """Regenera el caché de Xdock y lo publica como nueva generación para todos los workers."""
+    def _publish_reservations():
+        with _generation_lock():
+            _build_reservation_json()
+            manifest = _read_manifest()
+            return _publish_generation(manifest, {"mtime_reservation": _current_source_mtimes()["mtime_reservation"]})
+
+    try:
+        await _attach_generation(await asyncio.to_thread(_publish_reservations))
     except Exception as e:
         print(f"❌ Error Xdock Cache: {e}")
 
-async def load_csv_data():
-    """Carga y sincroniza todos los archivos maestros en memoria RAM con Polars."""
-    global df_master_cache, df_grn_cache, master_qty_map, _mtime_master, _mtime_grn
+async def load_csv_data(force: bool = False):
+    """
+    Sincroniza los archivos maestros con el caché compartido y los mapea en este worker.
+    Solo parsea los CSV si cambiaron (o si force=True); en otro caso mapea la generación existente.
+    """
     t0 = time.time()
     try:
-        if os.path.exists(ITEM_MASTER_CSV_PATH):
-            _mtime_master = os.path.getmtime(ITEM_MASTER_CSV_PATH)
-            raw_master = pl.read_csv(ITEM_MASTER_CSV_PATH, columns=COLUMNS_TO_READ_MASTER, infer_schema_length=0, 
-                                         null_values=['', 'nan', 'NaN', 'None', 'null'], ignore_errors=True, encoding='utf8')
-            df_master_cache = (
-                raw_master
-                .filter(pl.col("Item_Code").is_not_null())
-                .with_columns([
-                    pl.col("Item_Code").str.strip_chars().str.to_uppercase(),
-                    pl.col("Physical_Qty").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0)
-                ])
-            )
-            master_qty_map = {
-                str(r["Item_Code"]): int(r["Physical_Qty"]) 
-                for r in df_master_cache.select(["Item_Code", "Physical_Qty"]).to_dicts() 
-                if r["Item_Code"]
-            }
-
-        if os.path.exists(GRN_CSV_FILE_PATH):
-            _mtime_grn = os.path.getmtime(GRN_CSV_FILE_PATH)
-            raw_grn = pl.read_csv(GRN_CSV_FILE_PATH, columns=COLUMNS_TO_READ_GRN, infer_schema_length=0, null_values=['', 'nan', 'NaN'], ignore_errors=True)
-            df_grn_cache = (
-                raw_grn
-                .filter(pl.col("Item_Code").is_not_null())
-                .with_columns([
-                    pl.col("Quantity").str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0)
-                ])
-            )
-
-        await generate_reservation_cache()
-        print(f"✅ [POLARS] Sincronización RAM completa ({time.time() - t0:.3f}s)")
+        # El parseo es CPU-bound: se ejecuta fuera del event loop
+        manifest = await asyncio.to_thread(_build_shared_generation, force)
+        await _attach_generation(manifest)
+        print(f"✅ [ARROW] Generación {cache_generation} mapeada en worker {os.getpid()} ({time.time() - t0:.3f}s)")
     except Exception as e:
         print(f"❌ Error cargando CSVs: {e}")
 
 async def reload_cache_if_needed():
-    global _last_check, _mtime_master, _mtime_grn
+    global _last_check
     now = time.time()
-    if now - _last_check < 5: return 
-    needs_reload = False
-    if os.path.exists(ITEM_MASTER_CSV_PATH) and os.path.getmtime(ITEM_MASTER_CSV_PATH) > _mtime_master: needs_reload = True
-    if os.path.exists(GRN_CSV_FILE_PATH) and os.path.getmtime(GRN_CSV_FILE_PATH) > _mtime_grn: needs_reload = True
-    if needs_reload: await load_csv_data()
+    if now - _last_check < 5: return
     _last_check = now
+    manifest = _read_manifest()
+    if _sources_changed(manifest):
+        await load_csv_data()
+    elif int(manifest.get("generation", 0)) != cache_generation:
+        await refresh_generation()
 
 async def get_item_details_from_master_csv(item_code: str, db: AsyncSession = None):
     """Obtiene detalles del ítem con prioridad en DB SQL y fallback en Polars."""
     item_code = item_code.upper().strip()
-    
+
     # 1. Prioridad: Base de Datos SQL
     if db:
         try:
@@ -144,42 +492,60 @@ async def get_item_details_from_master_csv(item_code: str, db: AsyncSession = No
             result = await db.execute(stmt)
             db_item = result.scalar_one_or_none()
             if db_item:
-                return {
-                    "Item_Code": db_item.item_code,
-                    "Item_Description": db_item.description,
-                    "Bin_1": db_item.bin_1,
-                    "ABC_Code_stockroom": db_item.abc_code,
-                    "Physical_Qty": db_item.physical_qty,
-                    "Weight_per_Unit": db_item.weight_per_unit,
-                    "SIC_Code_stockroom": db_item.sic_code_stockroom,
-                    "Aditional_Bin_Location": db_item.additional_bin,
-                    "Cost_per_Unit": float(db_item.cost_per_unit) if db_item.cost_per_unit else 0.0,
-                    "Date_Last_Received": db_item.date_last_received,
-                    "SupersededBy": db_item.superseded_by
-                }
+                return master_item_to_dict(db_item)
         except Exception as e:
             print(f"⚠️ Error consultando MasterItem en DB: {e}")
 
-    # 2. Fallback: Caché en RAM (Polars)
-    global df_master_cache
+    # 2. Fallback: Caché en RAM (Polars) vía índice hash, sin escanear la columna
     await reload_cache_if_needed()
-    if df_master_cache is not None:
-        res = df_master_cache.filter(pl.col("Item_Code") == item_code)
-        if res.height > 0:
-            return res.to_dicts()[0]
-    return None
+    return get_master_row(item_code)
+
+def master_item_to_dict(db_item: MasterItem) -> dict:
+    """Convierte un MasterItem de SQL al formato de columnas del CSV maestro."""
+    return {
+        "Item_Code": db_item.item_code,
+        "Item_Description": db_item.description,
+        "Bin_1": db_item.bin_1,
+        "ABC_Code_stockroom": db_item.abc_code,
+        "Physical_Qty": db_item.physical_qty,
+        "Weight_per_Unit": db_item.weight_per_unit,
+        "SIC_Code_stockroom": db_item.sic_code_stockroom,
+        "Aditional_Bin_Location": db_item.additional_bin,
+        "Cost_per_Unit": float(db_item.cost_per_unit) if db_item.cost_per_unit else 0.0,
+        "Date_Last_Received": db_item.date_last_received,
+        "SupersededBy": db_item.superseded_by
+    }
+
+def get_master_row(item_code: str):
+    """Retorna la fila del maestro como dict en O(1) usando el índice de la generación mapeada."""
+    # Tomar ambas referencias juntas: el índice siempre corresponde al DataFrame de su misma generación
+    df, index = df_master_cache, master_index
+    if df is None:
+        return None
+    row_idx = index.get(item_code)
+    if row_idx is None:
+        return None
+    return df.row(row_idx, named=True)
 
 async def get_total_expected_quantity_for_item(item_code: str):
-    global df_grn_cache
+    """Cantidad total esperada del ítem en la 280 (consulta O(1) sobre el mapa pre-agregado)."""
+    await reload_cache_if_needed()
+    return grn_expected_map.get(item_code.upper().strip(), 0)
+
+async def get_expected_quantity_for_import_reference(import_reference: str, item_code: str):
+    """Cantidad esperada del ítem dentro de una I.R. (GRN de la 280 asociados a esa I.R.)."""
+    await reload_cache_if_needed()
+    return grn_ir_expected_map.get((import_reference.upper().strip(), item_code.upper().strip()), 0)
+
+async def get_import_reference_items(import_reference: str) -> list:
+    """Ítems esperados en una I.R. (po_lookup ir_to_data + GRN de la 280 asociados a la I.R.)."""
     await reload_cache_if_needed()
-    if df_grn_cache is None: return 0
-    res = df_grn_cache.filter(pl.col("Item_Code").str.strip_chars().str.to_uppercase() == item_code.upper().strip())
-    return int(res.select(pl.col("Quantity").sum())[0,0] or 0) if res.height > 0 else 0
+    return ir_items_map.get(import_reference.upper().strip(), [])
 
 async def get_xdock_info(item_code: str):
     """Retorna dict con total y lista de clientes de Xdock."""
     global reservation_qty_map
-    if not reservation_qty_map: await generate_reservation_cache()
+    if not reservation_qty_map and cache_generation == 0: await load_csv_data()
     return reservation_qty_map.get(item_code.upper().strip(), {"total": 0, "customers": []})
 
 async def get_locations_with_stock_count():
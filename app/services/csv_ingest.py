@@ -0,0 +1,223 @@
+"""
+Ingesta de reportes SSRS (CSV) en streaming.
+El archivo se recibe por bloques directamente a disco (sin cargarlo completo en memoria),
+el encabezado se valida contra el contrato de columnas del reporte en cuanto llega,
+y al terminar se publica un snapshot columnar (Parquet) junto al CSV.
+Los cachés y la sincronización del maestro leen el snapshot si está al día con el CSV.
+"""
+import csv
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import polars as pl
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import (
+    ITEM_MASTER_CSV_PATH,
+    GRN_CSV_FILE_PATH,
+    PICKING_CSV_PATH,
+    RESERVATION_CSV_PATH,
+    COLUMNS_TO_READ_MASTER,
+    COLUMNS_TO_READ_GRN,
+)
+
+CHUNK_SIZE = 1024 * 1024          # 1 MiB por lectura del UploadFile
+MAX_HEADER_BYTES = 64 * 1024      # Un encabezado más largo que esto no es un reporte válido
+
+
+class CSVSchemaError(ValueError):
+    """El CSV recibido no cumple el contrato de columnas del reporte."""
+
+
+@dataclass(frozen=True)
+class ReportSchema:
+    path: str
+    required: List[str]
+    # Grupos de columnas alternativas: debe existir al menos una de cada grupo
+    any_of: List[List[str]] = field(default_factory=list)
+
+
+REPORT_SCHEMAS: Dict[str, ReportSchema] = {
+    "AURRSGLBD0250": ReportSchema(ITEM_MASTER_CSV_PATH, COLUMNS_TO_READ_MASTER),
+    "AURRSGLBD0280": ReportSchema(GRN_CSV_FILE_PATH, COLUMNS_TO_READ_GRN),
+    "AURRSGLBD0240": ReportSchema(
+        PICKING_CSV_PATH,
+        ["ORDER_", "DESPATCH_", "ITEM", "DESCRIPTION", "QTY", "CUSTOMER_NAME", "ORDER_LINE"],
+        any_of=[["CUSTOMER", "CUSTOMER_CODE"]],
+    ),
+    "AURRSLAMP0006": ReportSchema(
+        RESERVATION_CSV_PATH,
+        ["Item_Code", "Quantity_reserved", "SO_Number", "Customer_Code", "Customer_Name"],
+    ),
+}
+
+
+def snapshot_path(csv_path: str) -> str:
+    """Ruta del snapshot Parquet que acompaña a un CSV (mismo nombre, extensión .parquet)."""
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def _snapshot_is_fresh(csv_path: str, snap_path: str) -> bool:
+    try:
+        return os.stat(snap_path).st_mtime_ns >= os.stat(csv_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+# --- Validación del encabezado ---
+
+def _parse_header(raw: bytes) -> List[str]:
+    first_line = raw.split(b"\n", 1)[0].decode("utf-8-sig", errors="replace").rstrip("\r")
+    row = next(csv.reader([first_line]), [])
+    return [name.strip().lstrip("\ufeff") for name in row]
+
+
+def validate_header(report: str, columns: Sequence[str]):
+    """Lanza CSVSchemaError si faltan columnas del contrato del reporte."""
+    schema = REPORT_SCHEMAS[report]
+    present = set(columns)
+    missing = [c for c in schema.required if c not in present]
+    missing += [" o ".join(group) for group in schema.any_of if not present.intersection(group)]
+    if missing:
+        raise CSVSchemaError(f"El archivo no corresponde al reporte {report}. Faltan columnas: {', '.join(missing)}")
+
+
+# --- Recepción en streaming ---
+
+async def receive_upload(upload: UploadFile, report: Optional[str], dest_path: str) -> dict:
+    """
+    Copia el UploadFile por bloques a un archivo temporal junto a `dest_path`.
+    Valida el encabezado con el primer bloque (si el reporte tiene contrato) y cuenta filas al vuelo.
+    Retorna {"tmp_path", "columns", "rows", "size_bytes"}; el llamador publica o elimina el temporal.
+    """
+    tmp_path = f"{dest_path}.{os.getpid()}.part"
+    header = None
+    pending = b""
+    size = newlines = 0
+    last_byte = b""
+
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                newlines += chunk.count(b"\n")
+                last_byte = chunk[-1:]
+
+                if header is None:
+                    # Acumular hasta tener la primera línea completa para validar antes de escribir
+                    pending += chunk
+                    if b"\n" not in pending and len(pending) < MAX_HEADER_BYTES:
+                        continue
+                    header = _parse_header(pending)
+                    if report in REPORT_SCHEMAS:
+                        validate_header(report, header)
+                    out.write(pending)
+                    pending = b""
+                else:
+                    out.write(chunk)
+
+            if header is None:
+                # Archivo de una sola línea (sin salto final)
+                header = _parse_header(pending)
+                if report in REPORT_SCHEMAS:
+                    validate_header(report, header)
+                out.write(pending)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if size == 0:
+        os.remove(tmp_path)
+        raise CSVSchemaError("El archivo está vacío.")
+
+    # Filas de datos = líneas - encabezado (la última línea puede no terminar en salto)
+    rows = max(0, newlines + (0 if last_byte == b"\n" else 1) - 1)
+    return {"tmp_path": tmp_path, "columns": header, "rows": rows, "size_bytes": size}
+
+
+# --- Snapshot columnar ---
+
+def write_snapshot(csv_path: str, source_path: Optional[str] = None) -> str:
+    """
+    Convierte el CSV a Parquet con el motor streaming de Polars (memoria acotada).
+    Todas las columnas se guardan como texto: cada consumidor aplica sus propias conversiones,
+    igual que cuando leía el CSV con infer_schema_length=0.
+    """
+    snap_path = snapshot_path(csv_path)
+    tmp_snap = f"{snap_path}.{os.getpid()}.part"
+    try:
+        pl.scan_csv(source_path or csv_path, infer_schema_length=0, encoding="utf8").sink_parquet(tmp_snap)
+        os.replace(tmp_snap, snap_path)
+    except Exception:
+        if os.path.exists(tmp_snap):
+            os.remove(tmp_snap)
+        raise
+    return snap_path
+
+
+async def ingest_upload(upload: UploadFile, report: Optional[str], dest_path: Optional[str] = None) -> dict:
+    """
+    Recibe el reporte en streaming, lo valida y lo publica de forma atómica en `dest_path`
+    (por defecto la ruta configurada del reporte) junto con su snapshot Parquet.
+    Lanza CSVSchemaError si el archivo no cumple el contrato; en ese caso el archivo vigente no se toca.
+    """
+    dest_path = dest_path or REPORT_SCHEMAS[report].path
+    received = await receive_upload(upload, report, dest_path)
+    tmp_path = received.pop("tmp_path")
+    if report in REPORT_SCHEMAS:
+        # El snapshot se escribe después que el temporal, así queda más nuevo que el CSV publicado
+        try:
+            await run_in_threadpool(write_snapshot, dest_path, tmp_path)
+        except Exception as e:
+            # Sin snapshot nuevo el anterior queda más viejo que el CSV y los lectores usan el CSV
+            print(f"⚠️ [INGESTA] No se pudo generar el snapshot de {os.path.basename(dest_path)}: {e}")
+    try:
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    received["path"] = dest_path
+    print(f"📥 [INGESTA] {os.path.basename(dest_path)}: {received['rows']} filas, {received['size_bytes']} bytes")
+    return received
+
+
+# --- Lectura ---
+
+def scan_report(csv_path: str, columns: Sequence[str], null_values: Sequence[str] = ("", "nan", "NaN")) -> pl.LazyFrame:
+    """
+    LazyFrame (todo texto) con `columns` del reporte, desde el snapshot si está al día o desde el CSV.
+    Ambas rutas devuelven los mismos valores: los textos de `null_values` se convierten en nulos.
+    """
+    snap_path = snapshot_path(csv_path)
+    if _snapshot_is_fresh(csv_path, snap_path):
+        nulls = list(null_values)
+        return pl.scan_parquet(snap_path).select([
+            pl.when(pl.col(c).is_in(nulls)).then(None).otherwise(pl.col(c)).alias(c) for c in columns
+        ])
+    return pl.scan_csv(
+        csv_path, infer_schema_length=0, null_values=list(null_values), ignore_errors=True, encoding="utf8"
+    ).select(list(columns))
+
+
+def report_columns(csv_path: str) -> List[str]:
+    """Nombres de columnas del reporte (desde el snapshot si está al día)."""
+    snap_path = snapshot_path(csv_path)
+    if _snapshot_is_fresh(csv_path, snap_path):
+        return list(pl.read_parquet_schema(snap_path).keys())
+    return pl.scan_csv(csv_path, infer_schema_length=0).collect_schema().names()
+
+
+def read_report(csv_path: str) -> pl.DataFrame:
+    """Reporte completo (todo texto) desde el snapshot si está al día o desde el CSV."""
+    snap_path = snapshot_path(csv_path)
+    if _snapshot_is_fresh(csv_path, snap_path):
+        return pl.read_parquet(snap_path)
+    return pl.read_csv(csv_path, infer_schema_length=0)
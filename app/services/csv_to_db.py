@@ -1,120 +1,175 @@
 import polars as pl
 import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.dialects.mysql import insert
-from sqlalchemy import update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import update, select, func
 from app.models.sql_models import MasterItem
-from app.core.config import ITEM_MASTER_CSV_PATH
+from app.core.config import ITEM_MASTER_CSV_PATH, CACHE_FOLDER, MASTER_SYNC_STATE_PATH
+from app.services.occupancy_service import occupancy_service
+from app.services import csv_ingest
 import os
+import time
+
+# Mapeo de columnas CSV a Modelo DB
+COL_MAP = {
+    'Item_Code': 'item_code',
+    'Item_Description': 'description',
+    'ABC_Code_stockroom': 'abc_code',
+    'Physical_Qty': 'physical_qty',
+    'Bin_1': 'bin_1',
+    'Aditional_Bin_Location': 'additional_bin',
+    'Weight_per_Unit': 'weight_per_unit',
+    'Item_Type': 'item_type',
+    'Item_Class': 'item_class',
+    'Item_Group_Major': 'item_group_major',
+    'Stockroom': 'stockroom',
+    'Cost_per_Unit': 'cost_per_unit',
+    'SIC_Code_Company': 'sic_code_company',
+    'SIC_Code_stockroom': 'sic_code_stockroom',
+    'Date_Last_Received': 'date_last_received',
+    'SupersededBy': 'superseded_by'
+}
+
+# Truncado de strings por seguridad (largo de la columna en la DB)
+_TRUNCATE = {'description': 255, 'abc_code': 10, 'bin_1': 100, 'additional_bin': 100}
+_MAX_COST = 99999999.99
+# Filas por sentencia: SQLite limita la cantidad de parámetros por consulta
+_CHUNK_SIZE = {'sqlite': 1000}
+_DEFAULT_CHUNK_SIZE = 5000
+
+
+def _read_master_frame() -> pl.DataFrame:
+    """CSV maestro (o su snapshot) normalizado con los nombres y tipos de la tabla master_items."""
+    available = set(csv_ingest.report_columns(ITEM_MASTER_CSV_PATH))
+    db_columns = {v for k, v in COL_MAP.items() if k in available}
+    q = (
+        csv_ingest.scan_report(
+            ITEM_MASTER_CSV_PATH,
+            [c for c in COL_MAP.keys() if c in available],
+            null_values=['', 'nan', 'NAN', 'NaN', 'None']
+        )
+        .with_columns([
+            pl.col('Item_Code').str.strip_chars().str.to_uppercase(),
+            pl.col('Physical_Qty').cast(pl.Utf8).str.replace(',', '').cast(pl.Float64, strict=False).fill_null(0).cast(pl.Int64),
+            pl.col('Cost_per_Unit').cast(pl.Utf8).str.replace(',', '').cast(pl.Float64, strict=False)
+                .clip(upper_bound=_MAX_COST).round(2),
+        ])
+        .filter(pl.col('Item_Code').is_not_null() & (pl.col('Item_Code') != ""))
+        .rename({k: v for k, v in COL_MAP.items() if k in available})
+        .with_columns([pl.col(c).str.slice(0, n) for c, n in _TRUNCATE.items() if c in db_columns])
+        # Un Item_Code repetido en el CSV: gana la última fila (igual que el upsert por lotes)
+        .unique(subset='item_code', keep='last', maintain_order=True)
+    )
+    return q.collect()
+
+
+def _row_hashes(df: pl.DataFrame) -> pl.DataFrame:
+    """Item_Code + hash de todas las columnas sincronizadas (updated_at no participa)."""
+    value_cols = sorted(c for c in df.columns if c != 'item_code')
+    return pl.DataFrame({
+        'item_code': df.get_column('item_code'),
+        'row_hash': df.select(value_cols).hash_rows(seed=0),
+    })
+
+
+async def _baseline_from_db(db: AsyncSession, columns: list) -> pl.DataFrame:
+    """Hashes del contenido actual de master_items (primera sincronización o estado desincronizado)."""
+    rows = (await db.execute(select(*[getattr(MasterItem, c) for c in columns]))).all()
+    data = {c: [row[i] for row in rows] for i, c in enumerate(columns)}
+    if 'cost_per_unit' in data:
+        # Numeric(10, 2) llega como Decimal
+        data['cost_per_unit'] = [round(float(v), 2) if v is not None else None for v in data['cost_per_unit']]
+    schema = {c: (pl.Int64 if c == 'physical_qty' else pl.Float64 if c == 'cost_per_unit' else pl.Utf8) for c in columns}
+    return _row_hashes(pl.DataFrame(data, schema=schema))
+
+
+async def _load_previous_state(db: AsyncSession, columns: list) -> pl.DataFrame:
+    """Estado de la última sincronización; si falta o la tabla no lo respalda, se toma la DB como base."""
+    if os.path.exists(MASTER_SYNC_STATE_PATH):
+        try:
+            previous = pl.read_parquet(MASTER_SYNC_STATE_PATH)
+            db_count = (await db.execute(select(func.count(MasterItem.item_code)))).scalar() or 0
+            # La tabla conserva los ítems ausentes del CSV (con stock 0): nunca puede tener menos filas que el estado
+            if db_count >= previous.height:
+                return previous
+            print("⚠️ [SYNC] master_items no coincide con el último estado; se usa la DB como base del diff")
+        except Exception as e:
+            print(f"⚠️ [SYNC] Estado de sincronización ilegible ({e}); se usa la DB como base del diff")
+    return await _baseline_from_db(db, columns)
+
+
+def _save_state(state: pl.DataFrame):
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    tmp_path = f"{MASTER_SYNC_STATE_PATH}.{os.getpid()}.tmp"
+    state.write_parquet(tmp_path)
+    os.replace(tmp_path, MASTER_SYNC_STATE_PATH)
+
+
+def _upsert_statement(dialect: str, rows: list):
+    if dialect == 'sqlite':
+        stmt = sqlite_insert(MasterItem).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=[MasterItem.item_code],
+            set_={k: stmt.excluded[k] for k in rows[0] if k != 'item_code'}
+        )
+    stmt = mysql_insert(MasterItem).values(rows)
+    return stmt.on_duplicate_key_update({k: stmt.inserted[k] for k in rows[0] if k != 'item_code'})
+
 
 async def sync_master_csv_to_db(db: AsyncSession):
     """
-    Lee el CSV maestro usando Polars y sincroniza la tabla master_items en la DB.
-    Optimizado para velocidad y bajo consumo de memoria.
+    Sincroniza la tabla master_items con el CSV maestro aplicando solo las diferencias.
+    Compara el hash por fila contra la sincronización anterior y en una sola transacción:
+    inserta/actualiza los ítems nuevos o modificados y deja en 0 el stock de los que ya no vienen.
     """
     if not os.path.exists(ITEM_MASTER_CSV_PATH):
         raise FileNotFoundError(f"Archivo maestro no encontrado: {ITEM_MASTER_CSV_PATH}")
 
     print("⏳ [POLARS] Iniciando sincronización CSV -> DB...")
+    start = time.time()
 
     try:
-        # 0. Pre-procesamiento: Resetear stock a 0 para items que podrían no venir en el CSV
-        print("   Resetear cantidades a 0 antes de la carga...")
-        await db.execute(update(MasterItem).values(physical_qty=0))
-        await db.commit()
-    except Exception as e:
-        print(f"⚠️ Error al resetear cantidades: {e}")
-    
-    try:
-        # Mapeo de columnas CSV a Modelo DB
-        col_map = {
-            'Item_Code': 'item_code',
-            'Item_Description': 'description',
-            'ABC_Code_stockroom': 'abc_code',
-            'Physical_Qty': 'physical_qty',
-            'Bin_1': 'bin_1',
-            'Aditional_Bin_Location': 'additional_bin',
-            'Weight_per_Unit': 'weight_per_unit',
-            'Item_Type': 'item_type',
-            'Item_Class': 'item_class',
-            'Item_Group_Major': 'item_group_major',
-            'Stockroom': 'stockroom',
-            'Cost_per_Unit': 'cost_per_unit',
-            'SIC_Code_Company': 'sic_code_company',
-            'SIC_Code_stockroom': 'sic_code_stockroom',
-            'Date_Last_Received': 'date_last_received',
-            'SupersededBy': 'superseded_by'
-        }
-        
-        # 1. Leer y transformar con Polars (Lazy loading para eficiencia)
-        q = (
-            pl.scan_csv(
-                ITEM_MASTER_CSV_PATH,
-                encoding='utf8',
-                infer_schema_length=10000,
-                null_values=['', 'nan', 'NAN', 'NaN', 'None'],
-                schema_overrides={
-                    "Physical_Qty": pl.String,
-                    "Cost_per_Unit": pl.String,
-                    "Item_Code": pl.String,
-                    "Date_Last_Received": pl.String,
-                    "SupersededBy": pl.String
-                }
-            )
-            .select([pl.col(c) for c in col_map.keys() if c in pl.scan_csv(ITEM_MASTER_CSV_PATH).columns])
-            .with_columns([
-                pl.col('Item_Code').str.strip_chars().str.to_uppercase(),
-                pl.col('Physical_Qty').cast(pl.Utf8).str.replace(',', '').cast(pl.Float64, strict=False).fill_null(0).cast(pl.Int64),
-                pl.col('Cost_per_Unit').cast(pl.Utf8).str.replace(',', '').cast(pl.Float64, strict=False),
-            ])
-            .filter(pl.col('Item_Code').is_not_null() & (pl.col('Item_Code') != ""))
-        )
-
-        df = q.collect()
+        # 1. Leer y normalizar con Polars (desde el snapshot Parquet de la ingesta si está al día)
+        df = _read_master_frame()
         total_items = df.height
-        print(f"📦 Procesando {total_items} items con Polars...")
+        current = _row_hashes(df)
+        previous = await _load_previous_state(db, df.columns)
 
-        # 2. Sincronización por lotes (Chunks) para no saturar la memoria de la DB
-        chunk_size = 5000
-        total_processed = 0
+        # 2. Diff por Item_Code
+        diff = current.join(previous, on='item_code', how='left', suffix='_prev')
+        upsert_codes = diff.filter(
+            pl.col('row_hash_prev').is_null() | (pl.col('row_hash') != pl.col('row_hash_prev'))
+        ).get_column('item_code')
+        vanished = previous.join(current, on='item_code', how='anti').get_column('item_code').to_list()
+        inserted = diff.get_column('row_hash_prev').null_count()
+        print(f"📦 {total_items} items: {inserted} nuevos, {upsert_codes.len() - inserted} modificados, {len(vanished)} sin stock en el CSV")
+
+        # 3. Aplicar en una sola transacción
+        dialect = db.bind.dialect.name
+        chunk_size = _CHUNK_SIZE.get(dialect, _DEFAULT_CHUNK_SIZE)
         today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        is_sqlite = db.bind.dialect.name == 'sqlite'
-
-        for i in range(0, total_items, chunk_size):
-            chunk_df = df.slice(i, chunk_size)
-            insert_data = []
-
-            for row in chunk_df.to_dicts():
-                item_data = {col_map[k]: v for k, v in row.items() if k in col_map}
-                
-                # Truncado de strings por seguridad
-                if item_data.get('description'): item_data['description'] = str(item_data['description'])[:255]
-                if item_data.get('abc_code'): item_data['abc_code'] = str(item_data['abc_code'])[:10]
-                if item_data.get('bin_1'): item_data['bin_1'] = str(item_data['bin_1'])[:100]
-                if item_data.get('additional_bin'): item_data['additional_bin'] = str(item_data['additional_bin'])[:100]
-                
-                if item_data.get('cost_per_unit') and item_data['cost_per_unit'] > 99999999.99:
-                    item_data['cost_per_unit'] = 99999999.99
-                
-                item_data['updated_at'] = today
-                insert_data.append(item_data)
-
-            if insert_data:
-                if is_sqlite:
-                    for item in insert_data:
-                        await db.merge(MasterItem(**item))
-                else:
-                    stmt = insert(MasterItem).values(insert_data)
-                    update_dict = {k: getattr(stmt.inserted, k) for k in item_data.keys() if k != 'item_code'}
-                    on_duplicate_key_stmt = stmt.on_duplicate_key_update(update_dict)
-                    await db.execute(on_duplicate_key_stmt)
-                
-                total_processed += len(insert_data)
-                print(f"   ➤ {total_processed}/{total_items} sincronizados...")
+
+        changed_rows = df.filter(pl.col('item_code').is_in(upsert_codes.implode())).with_columns(pl.lit(today).alias('updated_at'))
+        for i in range(0, changed_rows.height, chunk_size):
+            await db.execute(_upsert_statement(dialect, changed_rows.slice(i, chunk_size).to_dicts()))
+
+        for i in range(0, len(vanished), chunk_size):
+            await db.execute(
+                update(MasterItem)
+                .where(MasterItem.item_code.in_(vanished[i:i + chunk_size]))
+                .values(physical_qty=0, updated_at=today)
+            )
 
         await db.commit()
-        print(f"✅ [POLARS] Sincronización completada. {total_processed} items procesados.")
-        return total_processed
+        # El estado se guarda solo después del commit: si algo falla, el próximo diff repite los cambios
+        _save_state(current)
+
+        if changed_rows.height or vanished:
+            # El stock por bin cambió: recalcular la ocupación del maestro una sola vez
+            occupancy_service.invalidate_master()
+        print(f"✅ [POLARS] Sincronización completada en {time.time() - start:.2f}s. {changed_rows.height + len(vanished)} cambios aplicados.")
+        return total_items
 
     except Exception as e:
         print(f"❌ Error en sincronización Polars CSV -> DB: {e}")
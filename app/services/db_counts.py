@@ -5,8 +5,9 @@ import datetime
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
-from app.models.sql_models import StockCount, CountSession, AppState, SessionLocation, CycleCount
-from typing import List, Dict, Any, Optional
+from app.models.sql_models import StockCount, CountSession, AppState, SessionLocation, CycleCount, CycleCountRecording, MasterItem
+from app.models.schemas import CountExecutionRequest
+from typing import List, Dict, Any, Optional, Tuple
 
 async def load_all_counts_db_async(db: AsyncSession) -> List[Dict[str, Any]]:
     """Carga todos los conteos de stock."""
@@ -275,3 +276,51 @@ async def delete_stock_count(db: AsyncSession, count_id: int) -> bool:
         print(f"DB Error (delete_stock_count) para ID {count_id}: {e}")
         await db.rollback()
         return False
+
+async def apply_count_execution_async(db: AsyncSession, execution_data: CountExecutionRequest, username: str) -> Tuple[int, int]:
+    """
+    Registra los conteos ejecutados del planificador (sin commit: lo hace quien llama).
+    system_qty siempre sale del maestro del servidor. Retorna (nuevos, actualizados).
+    """
+    today_iso = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    item_codes = list({it.item_code for it in execution_data.items})
+    res_master = await db.execute(select(MasterItem).where(MasterItem.item_code.in_(item_codes)))
+    master_map = {m.item_code: m for m in res_master.scalars().all()}
+    res_exist = await db.execute(select(CycleCountRecording).where(
+        CycleCountRecording.item_code.in_(item_codes), CycleCountRecording.planned_date == execution_data.date
+    ))
+    existing_map = {r.item_code: r for r in res_exist.scalars().all()}
+
+    saved, updated = 0, 0
+    for item in execution_data.items:
+        m_item = master_map.get(item.item_code)
+        if not m_item: continue
+
+        physical = item.physical_qty
+        system = m_item.physical_qty or 0
+
+        existing = existing_map.get(item.item_code)
+        if existing:
+            existing.physical_qty, existing.system_qty = physical, system
+            existing.difference, existing.username, existing.executed_date = physical - system, username, today_iso
+            updated += 1
+        else:
+            bin_loc = m_item.bin_1
+            if m_item.additional_bin:
+                bin_loc = f"{bin_loc} | {m_item.additional_bin}"
+
+            existing_map[item.item_code] = CycleCountRecording(
+                planned_date=execution_data.date,
+                executed_date=today_iso,
+                item_code=item.item_code,
+                item_description=m_item.description,
+                bin_location=bin_loc,
+                system_qty=system,
+                physical_qty=physical,
+                difference=physical-system,
+                username=username,
+                abc_code=m_item.abc_code
+            )
+            db.add(existing_map[item.item_code])
+            saved += 1
+    return saved, updated
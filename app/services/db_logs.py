@@ -2,12 +2,39 @@
 Servicio de base de datos - Operaciones de logs (inbound).
 """
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete, func, desc
+from sqlalchemy import select, insert, update, delete, func, desc, or_
+from sqlalchemy.exc import IntegrityError
 from app.models.sql_models import Log
-from typing import Dict, Any, Optional, List
+from app.services.ai_slotting import ai_slotting
+from app.services.occupancy_service import occupancy_service
+from app.services.reconciliation_engine import reconciliation_engine
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Sequence, Iterable, Tuple, Set
 import datetime
+import uuid
+import polars as pl
 from sqlalchemy import distinct
 
+# Bines virtuales que nunca se consideran ubicación física de un ítem
+VIRTUAL_BINS = ["XDOCK", "PUTAWAY", "STAGE", "TRANSITO", "RECIBO"]
+
+# Lectura columnar de logs: tipos de cada columna en el DataFrame y filas por lote del cursor
+LOG_FRAME_SCHEMA = {
+    "id": pl.Int64, "timestamp": pl.Utf8, "importReference": pl.Utf8, "waybill": pl.Utf8,
+    "itemCode": pl.Utf8, "itemDescription": pl.Utf8, "binLocation": pl.Utf8, "relocatedBin": pl.Utf8,
+    "qtyReceived": pl.Int64, "qtyGrn": pl.Int64, "difference": pl.Int64, "username": pl.Utf8,
+    "client_id": pl.Utf8, "archived_at": pl.Utf8,
+}
+LOG_FETCH_BATCH_SIZE = 20000
+LOG_INSERT_CHUNK_SIZE = 500  # Filas por INSERT multi-VALUES del escritor en lote
+
+# Columnas (y orden) que entrega cada cargador de logs como dicts
+_BASE_LOG_COLUMNS = ["id", "timestamp", "importReference", "waybill", "itemCode", "itemDescription",
+                     "binLocation", "relocatedBin", "qtyReceived", "qtyGrn", "difference"]
+ACTIVE_LOG_COLUMNS = _BASE_LOG_COLUMNS + ["username", "client_id"]
+ARCHIVED_LOG_COLUMNS = _BASE_LOG_COLUMNS + ["username"]
+ALL_LOG_COLUMNS = _BASE_LOG_COLUMNS + ["archived_at", "username"]
+
 async def add_log(db: AsyncSession, username: str, action_type: str, message: str) -> bool:
     """
     Agrega un registro genérico a la tabla de logs para auditoría.
@@ -24,46 +51,98 @@ async def add_log(db: AsyncSession, username: str, action_type: str, message: st
         )
         db.add(new_log)
         await db.commit()
+        reconciliation_engine.mark_dirty(action_type)
         return True
     except Exception as e:
         print(f"Error en add_log: {e}")
         await db.rollback()
         return False
 
-async def save_log_entry_db_async(db: AsyncSession, entry_data: Dict[str, Any]) -> Optional[int]:
-    """Guarda una entrada de log en la base de datos."""
-    try:
-        # DEDUPLICACIÓN: Verificar si ya existe un registro con este client_id
-        client_id = entry_data.get('client_id')
-        if client_id:
-            existing = await db.execute(select(Log).where(Log.client_id == client_id))
-            if existing.scalar_one_or_none():
-                print(f"Logix: Registro duplicado detectado para client_id {client_id}. Ignorando.")
-                return 0 # Indica que no se insertó pero no es un error
-        
-        new_log = Log(
-            timestamp=entry_data.get('timestamp'),
-            importReference=entry_data.get('importReference', ''),
-            waybill=entry_data.get('waybill'),
-            itemCode=entry_data.get('itemCode'),
-            itemDescription=entry_data.get('itemDescription'),
-            binLocation=entry_data.get('binLocation'),
-            relocatedBin=entry_data.get('relocatedBin'),
-            qtyReceived=entry_data.get('qtyReceived'),
-            qtyGrn=entry_data.get('qtyGrn'),
-            difference=entry_data.get('difference'),
-            username=entry_data.get('username'),
-            client_id=client_id
-            # Nota: observaciones se omiite porque no existe en tabla MySQL
-        )
-        db.add(new_log)
-        await db.commit()
-        await db.refresh(new_log)
-        return new_log.id
-    except Exception as e:
-        print(f"DB Error (save_log_entry_db_async): {e}")
-        await db.rollback()
+def _log_row(entry_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "timestamp": entry_data.get('timestamp'),
+        "importReference": entry_data.get('importReference', ''),
+        "waybill": entry_data.get('waybill'),
+        "itemCode": entry_data.get('itemCode'),
+        "itemDescription": entry_data.get('itemDescription'),
+        "binLocation": entry_data.get('binLocation'),
+        "relocatedBin": entry_data.get('relocatedBin'),
+        "qtyReceived": entry_data.get('qtyReceived'),
+        "qtyGrn": entry_data.get('qtyGrn'),
+        "difference": entry_data.get('difference'),
+        "username": entry_data.get('username'),
+        "client_id": entry_data.get('client_id'),
+        # Nota: observaciones se omiite porque no existe en tabla MySQL
+    }
+
+
+async def _insert_new_logs(db: AsyncSession, rows: List[Dict[str, Any]]) -> Set[str]:
+    """
+    INSERT multi-VALUES por bloques, cada uno en un SAVEPOINT. Si otra subida del mismo registro ganó
+    la carrera posterior a la consulta IN (índice único de client_id), el bloque se deshace y se inserta
+    fila por fila: así se sabe con certeza qué filas escribió esta transacción.
+    Retorna los client_id que resultaron duplicados.
+    """
+    duplicates = set()
+    for i in range(0, len(rows), LOG_INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + LOG_INSERT_CHUNK_SIZE]
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(Log).values(chunk))
+            continue
+        except IntegrityError:
+            pass
+        for row in chunk:
+            try:
+                async with db.begin_nested():
+                    await db.execute(insert(Log).values(row))
+            except IntegrityError:
+                # Lectura con bloqueo: ve la fila que la otra transacción acaba de confirmar.
+                # Solo un client_id ya guardado es duplicado; cualquier otra violación es un error real
+                existing = await db.execute(select(Log.id).where(Log.client_id == row["client_id"]).with_for_update())
+                if existing.first() is None:
+                    raise
+                duplicates.add(row["client_id"])
+    return duplicates
+
+
+def _apply_log_update(log: Log, entry_data_for_db: Dict[str, Any]):
+    """Actualiza solo los campos proporcionados (y recalcula la diferencia si cambia la cantidad)."""
+    if 'importReference' in entry_data_for_db:
+        log.importReference = entry_data_for_db['importReference']
+    if 'waybill' in entry_data_for_db:
+        log.waybill = entry_data_for_db['waybill']
+    if 'relocatedBin' in entry_data_for_db:
+        log.relocatedBin = entry_data_for_db['relocatedBin']
+    if 'qtyReceived' in entry_data_for_db:
+        log.qtyReceived = entry_data_for_db['qtyReceived']
+        # Recalcular la diferencia si qtyGrn existe
+        if log.qtyGrn is not None:
+            try:
+                log.difference = float(log.qtyReceived) - float(log.qtyGrn)
+            except ValueError:
+                pass
+    if 'timestamp' in entry_data_for_db:
+        log.timestamp = entry_data_for_db['timestamp']
+
+
+async def save_log_entry_db_async(
+    db: AsyncSession, entry_data: Dict[str, Any], decision: Optional[Tuple[str, str, Optional[str]]] = None
+) -> Optional[int]:
+    """
+    Guarda una entrada de log en la base de datos (lote de uno de save_log_batch_db_async).
+    `decision` (item_code, bin final, sic_code) se aprende para la IA de slotting en la misma transacción.
+    Retorna el id, 0 si el client_id ya existía o None si hubo error.
+    """
+    result = await save_log_batch_db_async(
+        db, [entry_data], decisions={entry_data.get('client_id'): decision} if decision else None
+    )
+    if result is None:
         return None
+    if result.duplicates:
+        print(f"Logix: Registro duplicado detectado para client_id {entry_data.get('client_id')}. Ignorando.")
+        return 0 # Indica que no se insertó pero no es un error
+    return result.ids[entry_data['client_id']]
 
 
 async def update_log_entry_db_async(db: AsyncSession, log_id: int, entry_data_for_db: Dict[str, Any]) -> bool:
@@ -75,26 +154,14 @@ async def update_log_entry_db_async(db: AsyncSession, log_id: int, entry_data_fo
         
         if not log:
             return False
-            
-        # Actualizar solo los campos proporcionados
-        if 'importReference' in entry_data_for_db:
-            log.importReference = entry_data_for_db['importReference']
-        if 'waybill' in entry_data_for_db:
-            log.waybill = entry_data_for_db['waybill']
-        if 'relocatedBin' in entry_data_for_db:
-            log.relocatedBin = entry_data_for_db['relocatedBin']
-        if 'qtyReceived' in entry_data_for_db:
-            log.qtyReceived = entry_data_for_db['qtyReceived']
-            # Recalcular la diferencia si qtyGrn existe
-            if log.qtyGrn is not None:
-                try:
-                    log.difference = float(log.qtyReceived) - float(log.qtyGrn)
-                except ValueError:
-                    pass
-        if 'timestamp' in entry_data_for_db:
-            log.timestamp = entry_data_for_db['timestamp']
-            
+
+        previous_bin = log.relocatedBin
+        previous_ir = log.importReference
+        _apply_log_update(log, entry_data_for_db)
         await db.commit()
+        if log.archived_at is None:
+            occupancy_service.log_moved(log.itemCode, previous_bin, log.relocatedBin)
+            reconciliation_engine.mark_dirty(previous_ir, log.importReference)
         return True
     except Exception as e:
         print(f"DB Error (update_log_entry_db_async) para ID {log_id}: {e}")
@@ -102,36 +169,102 @@ async def update_log_entry_db_async(db: AsyncSession, log_id: int, entry_data_fo
         return False
 
 
+async def get_existing_client_ids_async(db: AsyncSession, client_ids: Iterable[str]) -> Set[str]:
+    """client_id que ya tienen un log guardado (una sola consulta IN)."""
+    client_ids = [c for c in set(client_ids) if c]
+    if not client_ids:
+        return set()
+    result = await db.execute(select(Log.client_id).where(Log.client_id.in_(client_ids)))
+    return set(result.scalars().all())
+
+
+@dataclass
+class LogBatchResult:
+    """Resultado de save_log_batch_db_async."""
+    ids: Dict[str, int] = field(default_factory=dict)   # client_id -> id de los logs insertados
+    duplicates: Set[str] = field(default_factory=set)   # client_id que ya estaban guardados
+    updated: Set[int] = field(default_factory=set)      # ids actualizados
+
+
+async def save_log_batch_db_async(
+    db: AsyncSession,
+    new_entries: List[Dict[str, Any]],
+    updates: Optional[Dict[int, Dict[str, Any]]] = None,
+    decisions: Optional[Dict[str, Tuple[str, str, Optional[str]]]] = None,
+) -> Optional[LogBatchResult]:
+    """
+    Escritor en lote de logs, todo en una transacción:
+    - `new_entries`: deduplicación por client_id con una consulta IN e INSERT multi-VALUES; la carrera
+      entre dos subidas del mismo registro se resuelve en _insert_new_logs. Una entrada sin client_id
+      recibe uno generado (es la clave para recuperar su id).
+    - `updates`: id -> campos a editar.
+    - `decisions`: client_id -> (item_code, bin final, sic_code) para la IA de slotting; solo se
+      aprenden las de logs insertados y los incrementos van en la misma transacción.
+    Ocupación, marcas de conciliación y aprendizaje se aplican solo a las filas que insertó esta
+    transacción; las que ganó otra subida se informan como duplicadas.
+    Retorna None si la transacción falló.
+    """
+    for entry in new_entries:
+        if not entry.get('client_id'):
+            entry['client_id'] = str(uuid.uuid4())
+    result = LogBatchResult()
+    try:
+        result.duplicates = await get_existing_client_ids_async(db, [entry['client_id'] for entry in new_entries])
+        rows, seen = [], set(result.duplicates)
+        for entry in new_entries:
+            if entry['client_id'] not in seen:
+                seen.add(entry['client_id'])
+                rows.append(_log_row(entry))
+
+        raced = await _insert_new_logs(db, rows)
+        if raced:
+            result.duplicates |= raced
+            rows = [row for row in rows if row["client_id"] not in raced]
+        if rows:
+            # Todos los client_id de `rows` los escribió esta transacción (índice único)
+            inserted_ids = await db.execute(
+                select(Log.client_id, Log.id).where(Log.client_id.in_([row["client_id"] for row in rows]))
+            )
+            result.ids = dict(inserted_ids.all())
+
+        moved = []
+        if updates:
+            updated_logs = await db.execute(select(Log).where(Log.id.in_(list(updates))))
+            for log in updated_logs.scalars().all():
+                moved.append((log, log.relocatedBin, log.importReference))
+                _apply_log_update(log, updates[log.id])
+            result.updated = {log.id for log, _, _ in moved}
+
+        staged = None
+        if decisions:
+            staged = await ai_slotting.stage_decisions(
+                db, [decision for client_id, decision in decisions.items() if client_id in result.ids and decision]
+            )
+        await db.commit()
+    except Exception as e:
+        print(f"DB Error (save_log_batch_db_async): {e}")
+        await db.rollback()
+        return None
+
+    if staged:
+        ai_slotting.remember(staged)
+    for row in rows:
+        occupancy_service.log_added(row["relocatedBin"], row["itemCode"])
+    for log, previous_bin, _ in moved:
+        if log.archived_at is None:
+            occupancy_service.log_moved(log.itemCode, previous_bin, log.relocatedBin)
+    dirty = [row["importReference"] for row in rows]
+    dirty += [ir for log, _, previous_ir in moved if log.archived_at is None for ir in (previous_ir, log.importReference)]
+    if dirty:
+        reconciliation_engine.mark_dirty(*dirty)
+    return result
+
+
 async def load_log_data_db_async(db: AsyncSession) -> List[Dict[str, Any]]:
     """Carga todos los logs activos (no archivados) de la base de datos."""
     try:
-        # Cargamos registros donde archived_at es NULL o string vacío
-        from sqlalchemy import or_
-        stmt = select(Log).where(
-            or_(Log.archived_at.is_(None), Log.archived_at == '')
-        ).order_by(Log.id.desc())
-        result = await db.execute(stmt)
-        logs = result.scalars().all()
-        # Convertir a dict explícitamente porque los modelos ORM no son dicts
-        return [
-            {
-                "id": log.id,
-                "timestamp": log.timestamp,
-                "importReference": log.importReference,
-                "waybill": log.waybill,
-                "itemCode": log.itemCode,
-                "itemDescription": log.itemDescription,
-                "binLocation": log.binLocation,
-                "relocatedBin": log.relocatedBin,
-                "qtyReceived": log.qtyReceived,
-                "qtyGrn": log.qtyGrn,
-                "difference": log.difference,
-                "username": log.username,
-                "client_id": getattr(log, 'client_id', None),
-                "observaciones": ""  # Columna no existe en tabla MySQL
-            }
-            for log in logs
-        ]
+        frame = await load_log_frame_async(db, columns=ACTIVE_LOG_COLUMNS)
+        return frame.with_columns(pl.lit("").alias("observaciones")).to_dicts()  # Columna no existe en tabla MySQL
     except Exception as e:
         print(f"DB Error (load_log_data_db_async): {e}")
         return []
@@ -197,9 +330,17 @@ async def get_total_received_for_item_async(db: AsyncSession, item_code: str) ->
 async def delete_log_entry_db_async(db: AsyncSession, log_id: int) -> bool:
     """Elimina una entrada de log."""
     try:
+        # Datos previos para descontar la ocupación del bin (solo logs activos)
+        previous = (await db.execute(
+            select(Log.relocatedBin, Log.itemCode, Log.importReference, Log.archived_at).where(Log.id == log_id)
+        )).first()
+
         stmt = delete(Log).where(Log.id == log_id)
         result = await db.execute(stmt)
         await db.commit()
+        if result.rowcount > 0 and previous is not None and previous.archived_at is None:
+            occupancy_service.log_removed(previous.relocatedBin, previous.itemCode)
+            reconciliation_engine.mark_dirty(previous.importReference)
         return result.rowcount > 0
     except Exception as e:
         print(f"DB Error (delete_log_entry_db_async) para ID {log_id}: {e}")
@@ -211,13 +352,11 @@ async def get_latest_relocated_bin_async(db: AsyncSession, item_code: str) -> Op
     """Obtiene el último bin de reubicación real (no virtual) para un item."""
     try:
         # Excluimos bines virtuales para que no se conviertan en la ubicación por defecto
-        virtual_bins = ["XDOCK", "PUTAWAY", "STAGE", "TRANSITO", "RECIBO"]
-        
         stmt = select(Log.relocatedBin).where(
             Log.itemCode == item_code,
             Log.relocatedBin.is_not(None),
             Log.relocatedBin != '',
-            ~Log.relocatedBin.in_(virtual_bins),
+            ~Log.relocatedBin.in_(VIRTUAL_BINS),
             Log.archived_at.is_(None)
         ).order_by(Log.id.desc()).limit(1)
         
@@ -228,6 +367,25 @@ async def get_latest_relocated_bin_async(db: AsyncSession, item_code: str) -> Op
         print(f"DB Error (get_latest_relocated_bin_async): {e}")
         return None
 
+async def get_latest_relocated_bins_async(db: AsyncSession, item_codes: Iterable[str]) -> Dict[str, str]:
+    """Último bin de reubicación real por ítem para varios ítems en una consulta (ver get_latest_relocated_bin_async)."""
+    item_codes = list(set(item_codes))
+    if not item_codes:
+        return {}
+    try:
+        latest_ids = select(func.max(Log.id)).where(
+            Log.itemCode.in_(item_codes),
+            Log.relocatedBin.is_not(None),
+            Log.relocatedBin != '',
+            ~Log.relocatedBin.in_(VIRTUAL_BINS),
+            Log.archived_at.is_(None)
+        ).group_by(Log.itemCode)
+        result = await db.execute(select(Log.itemCode, Log.relocatedBin).where(Log.id.in_(latest_ids)))
+        return {item_code: bin_code for item_code, bin_code in result.all()}
+    except Exception as e:
+        print(f"DB Error (get_latest_relocated_bins_async): {e}")
+        return {}
+
 async def archive_current_logs_db_async(db: AsyncSession) -> bool:
     """Archiva todos los logs activos asignándoles la fecha actual."""
     try:
@@ -235,6 +393,8 @@ async def archive_current_logs_db_async(db: AsyncSession) -> bool:
         stmt = update(Log).where(Log.archived_at.is_(None)).values(archived_at=current_time_iso)
         result = await db.execute(stmt)
         await db.commit()
+        occupancy_service.logs_archived()
+        reconciliation_engine.mark_all_dirty()
         return True # Always return true, even if 0 rows updated
     except Exception as e:
         print(f"DB Error (archive_current_logs_db_async): {e}")
@@ -259,27 +419,8 @@ async def get_archived_versions_db_async(db: AsyncSession) -> List[str]:
 async def load_archived_log_data_db_async(db: AsyncSession, version_date: str) -> List[Dict[str, Any]]:
     """Carga los logs de una versión archivada específica."""
     try:
-        stmt = select(Log).where(Log.archived_at == version_date).order_by(Log.id.desc())
-        result = await db.execute(stmt)
-        logs = result.scalars().all()
-        return [
-            {
-                "id": log.id,
-                "timestamp": log.timestamp,
-                "importReference": log.importReference,
-                "waybill": log.waybill,
-                "itemCode": log.itemCode,
-                "itemDescription": log.itemDescription,
-                "binLocation": log.binLocation,
-                "relocatedBin": log.relocatedBin,
-                "qtyReceived": log.qtyReceived,
-                "qtyGrn": log.qtyGrn,
-                "difference": log.difference,
-                "username": log.username,
-                "observaciones": ""
-            }
-            for log in logs
-        ]
+        frame = await load_archived_log_frame_async(db, version_date, columns=ARCHIVED_LOG_COLUMNS)
+        return frame.with_columns(pl.lit("").alias("observaciones")).to_dicts()
     except Exception as e:
         print(f"DB Error (load_archived_log_data_db_async): {e}")
         return []
@@ -287,28 +428,48 @@ async def load_archived_log_data_db_async(db: AsyncSession, version_date: str) -
 async def load_all_logs_db_async(db: AsyncSession) -> List[Dict[str, Any]]:
     """Carga TODOS los logs de la base de datos (activos y archivados)."""
     try:
-        stmt = select(Log).order_by(Log.id.desc())
-        result = await db.execute(stmt)
-        logs = result.scalars().all()
-        return [
-            {
-                "id": log.id,
-                "timestamp": log.timestamp,
-                "importReference": log.importReference,
-                "waybill": log.waybill,
-                "itemCode": log.itemCode,
-                "itemDescription": log.itemDescription,
-                "binLocation": log.binLocation,
-                "relocatedBin": log.relocatedBin,
-                "qtyReceived": log.qtyReceived,
-                "qtyGrn": log.qtyGrn,
-                "difference": log.difference,
-                "archived_at": log.archived_at,
-                "username": log.username,
-                "observaciones": ""
-            }
-            for log in logs
-        ]
+        frame = await load_all_logs_frame_async(db, columns=ALL_LOG_COLUMNS)
+        return frame.with_columns(pl.lit("").alias("observaciones")).to_dicts()
     except Exception as e:
         print(f"DB Error (load_all_logs_db_async): {e}")
         return []
+
+
+# --- Lectura columnar (conciliación y exportaciones) ---
+
+async def stream_log_frame_async(db: AsyncSession, *conditions, columns: Optional[Sequence[str]] = None) -> pl.DataFrame:
+    """
+    Logs que cumplen `conditions` como DataFrame, ordenados por id descendente.
+    Consulta Core con tuplas de columnas (sin hidratar objetos ORM) leída por lotes:
+    cada lote se convierte directo a columnas Polars.
+    """
+    columns = list(columns or LOG_FRAME_SCHEMA)
+    schema = {c: LOG_FRAME_SCHEMA[c] for c in columns}
+    stmt = (
+        select(*[getattr(Log, c) for c in columns])
+        .where(*conditions)
+        .order_by(Log.id.desc())
+        .execution_options(yield_per=LOG_FETCH_BATCH_SIZE)
+    )
+    result = await db.stream(stmt)
+    frames = []
+    async for batch in result.partitions():
+        # Lote por columnas; strict=False: un valor heredado como texto en una columna entera
+        # se convierte (o queda nulo) en vez de abortar la carga
+        frames.append(pl.DataFrame(dict(zip(columns, zip(*batch))), schema=schema, strict=False))
+    return pl.concat(frames) if frames else pl.DataFrame(schema=schema)
+
+
+async def load_log_frame_async(db: AsyncSession, columns: Optional[Sequence[str]] = None) -> pl.DataFrame:
+    """Logs activos (archived_at NULL o vacío) como DataFrame."""
+    return await stream_log_frame_async(db, or_(Log.archived_at.is_(None), Log.archived_at == ''), columns=columns)
+
+
+async def load_archived_log_frame_async(db: AsyncSession, version_date: str, columns: Optional[Sequence[str]] = None) -> pl.DataFrame:
+    """Logs de una versión archivada como DataFrame."""
+    return await stream_log_frame_async(db, Log.archived_at == version_date, columns=columns)
+
+
+async def load_all_logs_frame_async(db: AsyncSession, columns: Optional[Sequence[str]] = None) -> pl.DataFrame:
+    """Todos los logs (activos y archivados) como DataFrame."""
+    return await stream_log_frame_async(db, columns=columns)
@@ -0,0 +1,285 @@
+"""
+Trabajos de exportación pesados (conciliación y respaldo completo de logs).
+El pedido se registra en job_registry y se construye en segundo plano: los datos se leen en el
+worker y el Excel se escribe en un pool de procesos para no ocupar el event loop. El archivo queda
+en instance/cache/exports con clave (tipo, parámetros, versión de datos): un pedido idéntico se
+resuelve al instante hasta que cambian los logs o la 280, y dos pedidos simultáneos comparten trabajo.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+import polars as pl
+from fastapi import BackgroundTasks
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import EXPORTS_FOLDER, GRN_IR_MAP_PATH, RECONCILIATION_DIRTY_JOURNAL_PATH
+from app.services import csv_handler, db_logs, excel_export, reconciliation_service
+from app.services.job_registry import job_registry, JOB_TTL_SECONDS
+
+EXPORT_PROCESS_WORKERS = 2
+EXPORT_HEARTBEAT_SECONDS = 15    # El trabajo en curso renueva el mtime de su marca con esta frecuencia
+EXPORT_STALE_SECONDS = 4 * EXPORT_HEARTBEAT_SECONDS   # Marca sin latido por más que esto: trabajo abandonado
+EXPORT_TYPES = ("reconciliation", "all_log")
+# Permiso que exige consultar o descargar cada tipo ("admin": sesión de administrador)
+EXPORT_PERMISSIONS = {"reconciliation": "inbound", "all_log": "admin"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: el worker tiene hilos y un event loop en marcha, fork no es seguro
+        _pool = ProcessPoolExecutor(max_workers=EXPORT_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# --- Versión de datos ---
+
+def _stat_key(path: str) -> str:
+    try:
+        st = os.stat(path)
+        return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+    except OSError:
+        return "0"
+
+
+def data_version() -> str:
+    """
+    Firma de los datos que alimentan las exportaciones, visible desde cualquier worker:
+    generación publicada de la 280, mapa GRN -> I.R. y el diario de cambios de logs
+    (cada alta/edición/borrado de logs, archivado o limpieza escribe en él).
+    """
+    return "|".join([
+        str(csv_handler.read_cache_generation()),
+        _stat_key(GRN_IR_MAP_PATH),
+        _stat_key(RECONCILIATION_DIRTY_JOURNAL_PATH),
+    ])
+
+
+# --- Constructores de cada tipo ---
+
+async def build_all_log_frame(db: AsyncSession) -> pl.DataFrame:
+    """Respaldo de todos los logs (activos y archivados) con las columnas del Excel de backup."""
+    df = await db_logs.load_all_logs_frame_async(db, columns=db_logs.ALL_LOG_COLUMNS)
+    if df.height == 0:
+        return df
+    df = df.with_columns(pl.lit("").alias("observaciones"))
+    col_rename = {'timestamp': 'Date', 'importReference': 'Ref', 'itemCode': 'Item'}
+    return df.rename({k: v for k, v in col_rename.items() if k in df.columns})
+
+
+def _normalize_params(export_type: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    if export_type == "reconciliation":
+        return {
+            "timezone_offset": int(params.get("timezone_offset") or 0),
+            "archive_date": params.get("archive_date") or None,
+            "snapshot_date": params.get("snapshot_date") or None,
+        }
+    return {}
+
+
+def _file_info(export_type: str, params: Dict[str, Any]) -> Tuple[Optional[str], str]:
+    if export_type == "reconciliation":
+        return reconciliation_service.export_file_info(params["timezone_offset"], params["snapshot_date"])
+    return None, "backup_logs.xlsx"
+
+
+async def _build_frame(db: AsyncSession, export_type: str, params: Dict[str, Any]) -> pl.DataFrame:
+    if export_type == "reconciliation":
+        return await reconciliation_service.build_export_frame(db, **params)
+    return await build_all_log_frame(db)
+
+
+# --- Caché de archivos ---
+
+def _cache_key(export_type: str, params: Dict[str, Any], version: str) -> str:
+    raw = orjson.dumps([export_type, params, version], option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def _artifact_path(key: str) -> str:
+    return os.path.join(EXPORTS_FOLDER, f"{key}.xlsx")
+
+
+def _marker_path(key: str) -> str:
+    return os.path.join(EXPORTS_FOLDER, f"{key}.job")
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune():
+    """Borra archivos generados (y marcas huérfanas) más viejos que JOB_TTL_SECONDS."""
+    limit = time.time() - JOB_TTL_SECONDS
+    try:
+        entries = os.scandir(EXPORTS_FOLDER)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True   # En Windows os.kill terminaría el proceso: solo cuenta el latido
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass   # Existe pero es de otro usuario
+    return True
+
+
+def _claim(key: str, job_id: str) -> Optional[str]:
+    """
+    Reserva la construcción de `key` para `job_id`. Si otro trabajo vigente ya la tiene,
+    retorna su id (el pedido se suma a ese trabajo); None si la reserva quedó tomada.
+    La marca guarda "<job_id> <pid>": si ese proceso ya no existe o la marca dejó de latir
+    (run_export_job renueva su mtime) el trabajo se da por abandonado y se marca como error.
+    """
+    marker = _marker_path(key)
+    tmp_path = f"{marker}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(f"{job_id} {os.getpid()}")
+    try:
+        for _ in range(2):
+            try:
+                # link es atómico y falla si la marca existe: nunca se ve una marca sin id
+                os.link(tmp_path, marker)
+                return None
+            except FileExistsError:
+                pass
+            try:
+                with open(marker, 'r') as f:
+                    owner, _, pid = f.read().strip().partition(" ")
+                age = time.time() - os.stat(marker).st_mtime
+            except OSError:
+                continue
+            job = job_registry.get(owner)
+            if job and job["status"] in ("pending", "running"):
+                if age < EXPORT_STALE_SECONDS and pid.isdigit() and _process_alive(int(pid)):
+                    return owner
+                # El worker que lo construía murió: quien consulte ese trabajo deja de esperarlo
+                job_registry.update(owner, status="error", message="Trabajo abandonado: el proceso que lo generaba se detuvo.")
+            _remove(marker)   # Trabajo terminado sin limpiar o abandonado
+        return None
+    finally:
+        _remove(tmp_path)
+
+
+async def _heartbeat(marker: str):
+    """Renueva el mtime de la marca mientras el trabajo sigue en curso."""
+    while True:
+        await asyncio.sleep(EXPORT_HEARTBEAT_SECONDS)
+        try:
+            os.utime(marker)
+        except OSError:
+            return
+
+
+async def run_export_job(job_id: str, export_type: str, params: Dict[str, Any], key: str, sheet_name: Optional[str]):
+    """Lee los datos con su propia sesión, escribe el Excel en el pool de procesos y publica el archivo."""
+    from app.core.db import AsyncSessionLocal
+    heartbeat = asyncio.create_task(_heartbeat(_marker_path(key)))
+    job_registry.update(job_id, status="running", message="Leyendo datos...")
+    start = time.time()
+    artifact = _artifact_path(key)
+    tmp_path = f"{artifact}.{os.getpid()}.tmp"
+    try:
+        async with AsyncSessionLocal() as session:
+            df = await _build_frame(session, export_type, params)
+        if df.height == 0:
+            job_registry.update(job_id, status="error", message="No hay datos para exportar")
+            return
+
+        job_registry.update(job_id, message=f"Generando Excel ({df.height} filas)...")
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(_get_pool(), excel_export.write_xlsx, df, tmp_path, sheet_name)
+        except BrokenProcessPool:
+            shutdown_pool()   # Un proceso murió: el próximo trabajo arranca un pool nuevo
+            raise
+        os.replace(tmp_path, artifact)
+
+        job_registry.update(
+            job_id, status="success", message="Archivo listo.",
+            result={"rows": df.height, "size": os.path.getsize(artifact), "cached": False}
+        )
+        print(f"✅ [EXPORT] {export_type}: {df.height} filas en {time.time() - start:.2f}s")
+    except Exception as e:
+        print(f"❌ Error en exportación {export_type}: {e}")
+        _remove(tmp_path)
+        job_registry.update(job_id, status="error", message=str(e))
+    finally:
+        heartbeat.cancel()
+        _remove(_marker_path(key))
+
+
+def submit(export_type: str, params: Dict[str, Any], username: str, background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    """
+    Registra una exportación y retorna su trabajo. Si el archivo para estos datos ya existe el trabajo
+    nace terminado; si otro pedido idéntico está en curso se retorna ese mismo trabajo.
+    """
+    if export_type not in EXPORT_TYPES:
+        raise ValueError(f"Tipo de exportación desconocido: {export_type}")
+    os.makedirs(EXPORTS_FOLDER, exist_ok=True)
+    prune()
+
+    params = _normalize_params(export_type, params)
+    key = _cache_key(export_type, params, data_version())
+    sheet_name, filename = _file_info(export_type, params)
+    artifact = _artifact_path(key)
+    # Quién lo pidió y qué permiso hace falta para consultarlo o descargarlo (el id solo no alcanza)
+    meta = {"export_type": export_type, "params": params, "filename": filename, "cache_key": key,
+            "username": username, "permission": EXPORT_PERMISSIONS[export_type]}
+
+    if os.path.exists(artifact):
+        os.utime(artifact)   # Renueva el TTL del archivo reutilizado
+        job = job_registry.create("export", message="Archivo listo.", **meta)
+        return job_registry.update(
+            job["id"], status="success", result={"size": os.path.getsize(artifact), "cached": True}
+        )
+
+    job = job_registry.create("export", message="En cola", **meta)
+    owner = _claim(key, job["id"])
+    if owner is not None:
+        job_registry.delete(job["id"])
+        return job_registry.get(owner)
+
+    background_tasks.add_task(run_export_job, job["id"], export_type, params, key, sheet_name)
+    return job
+
+
+def get_artifact(job: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """(ruta, nombre de archivo) de una exportación terminada; None si no existe o ya expiró."""
+    if job.get("kind") != "export" or job["status"] != "success":
+        return None
+    artifact = _artifact_path(job["cache_key"])
+    if not os.path.exists(artifact):
+        return None
+    return artifact, job["filename"]
@@ -0,0 +1,170 @@
+"""
+Mapa persistente GRN -> (I.R., Waybill).
+Se arma con las tres fuentes que conocen la I.R. de un GRN (grn_master_data.json, la tabla
+grn_master y po_lookup.json) y se guarda como Arrow IPC en el caché compartido. Solo se
+reconstruye cuando cambian esas fuentes (seed/CRUD de GRN y Purchase Order Extractor);
+la conciliación y el caché de la 280 hacen join directo contra él.
+"""
+import os
+from typing import Optional
+
+import orjson
+import polars as pl
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.sql_models import GRNMaster
+from app.core.config import CACHE_FOLDER, GRN_IR_MAP_PATH, GRN_JSON_DATA_PATH, PO_LOOKUP_JSON_PATH
+
+MAP_SCHEMA = {"grn_map": pl.Utf8, "ir_map": pl.Utf8, "wb_map": pl.Utf8}
+_SOURCE_SCHEMA = {"grn": pl.Utf8, "ir": pl.Utf8, "wb": pl.Utf8}
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _normalize(pairs: pl.DataFrame) -> pl.DataFrame:
+    """(grn, ir, wb) crudos -> una fila por GRN individual (los GRN pueden venir separados por coma)."""
+    return (
+        pairs
+        .select([
+            pl.col("grn").cast(pl.Utf8).str.to_uppercase().str.split(","),
+            pl.col("ir").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+            pl.col("wb").cast(pl.Utf8).fill_null(""),
+        ])
+        .explode("grn")
+        .with_columns(pl.col("grn").str.strip_chars())
+        .filter(
+            pl.col("grn").is_not_null() & (pl.col("grn") != "") &
+            pl.col("ir").is_not_null() & (pl.col("ir") != "")
+        )
+        .select([pl.col("grn").alias("grn_map"), pl.col("ir").alias("ir_map"), pl.col("wb").alias("wb_map")])
+    )
+
+
+# --- Fuentes ---
+
+def _pairs_from_grn_json() -> pl.DataFrame:
+    if not os.path.exists(GRN_JSON_DATA_PATH):
+        return pl.DataFrame(schema=_SOURCE_SCHEMA)
+    try:
+        with open(GRN_JSON_DATA_PATH, 'rb') as f:
+            rows = orjson.loads(f.read())
+        keys = ["Import_Reference", "import_reference", "GRN_Number", "grn_number", "Waybill"]
+        df = pl.from_dicts(rows, schema={k: pl.Utf8 for k in keys}, strict=False)
+        return df.select([
+            pl.coalesce("GRN_Number", "grn_number").alias("grn"),
+            pl.coalesce("Import_Reference", "import_reference").alias("ir"),
+            pl.col("Waybill").alias("wb"),
+        ])
+    except Exception as e:
+        print(f"⚠️ [GRN MAP] Error leyendo GRN JSON: {e}")
+        return pl.DataFrame(schema=_SOURCE_SCHEMA)
+
+
+async def _pairs_from_db(db: AsyncSession) -> pl.DataFrame:
+    try:
+        rows = (await db.execute(
+            select(GRNMaster.grn_number, GRNMaster.import_reference, GRNMaster.waybill).order_by(GRNMaster.id)
+        )).all()
+        return pl.DataFrame(
+            {"grn": [r[0] for r in rows], "ir": [r[1] for r in rows], "wb": [r[2] for r in rows]},
+            schema=_SOURCE_SCHEMA
+        )
+    except Exception as e:
+        print(f"⚠️ [GRN MAP] Error leyendo grn_master: {e}")
+        return pl.DataFrame(schema=_SOURCE_SCHEMA)
+
+
+def _pairs_from_po_lookup() -> pl.DataFrame:
+    """GRN que el robot ya encontró (wb_to_data -> items[].grn)."""
+    if not os.path.exists(PO_LOOKUP_JSON_PATH):
+        return pl.DataFrame(schema=_SOURCE_SCHEMA)
+    try:
+        with open(PO_LOOKUP_JSON_PATH, 'rb') as f:
+            po_cache = orjson.loads(f.read())
+        # Estructura anidada: se aplana una vez y el resto es vectorizado
+        triples = [
+            (str(item.get("grn", "")), str(data.get("import_ref", "")), str(wb))
+            for wb, data in po_cache.get("wb_to_data", {}).items()
+            for item in data.get("items", [])
+        ]
+        return pl.DataFrame(triples, schema=_SOURCE_SCHEMA, orient="row")
+    except Exception as e:
+        print(f"⚠️ [GRN MAP] Error leyendo po_lookup: {e}")
+        return pl.DataFrame(schema=_SOURCE_SCHEMA)
+
+
+def _combine(*sources: pl.DataFrame) -> pl.DataFrame:
+    # Si un GRN aparece en varias fuentes gana la primera (JSON, luego DB, luego robot)
+    return (
+        pl.concat([_normalize(s) for s in sources])
+        .unique(subset=["grn_map"], keep="first", maintain_order=True)
+    )
+
+
+def build_from_files() -> pl.DataFrame:
+    """Mapa solo con las fuentes en archivo (sin DB); respaldo para lectores síncronos."""
+    return _combine(_pairs_from_grn_json(), _pairs_from_po_lookup())
+
+
+class GRNIRMap:
+    def __init__(self, path: str = GRN_IR_MAP_PATH):
+        self.path = path
+        self._df: Optional[pl.DataFrame] = None
+        self.version: Optional[int] = None   # mtime_ns del archivo cargado
+
+    def _is_stale(self, map_mtime_ns: int) -> bool:
+        # Red de seguridad: un JSON modificado fuera de los flujos de la app es más nuevo que el mapa
+        return max(_mtime_ns(GRN_JSON_DATA_PATH), _mtime_ns(PO_LOOKUP_JSON_PATH)) > map_mtime_ns
+
+    def _read(self, mtime_ns: int) -> pl.DataFrame:
+        if mtime_ns != self.version:
+            self._df = pl.read_ipc(self.path)
+            self.version = mtime_ns
+        return self._df
+
+    async def rebuild(self, db: AsyncSession) -> pl.DataFrame:
+        """Reconstruye el mapa desde las tres fuentes y lo publica de forma atómica."""
+        df = _combine(_pairs_from_grn_json(), await _pairs_from_db(db), _pairs_from_po_lookup())
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            df.write_ipc(tmp_path)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._df, self.version = df, _mtime_ns(self.path)
+        print(f"🔄 [GRN MAP] Mapa GRN -> I.R. reconstruido: {df.height} GRN")
+        return df
+
+    async def get(self, db: AsyncSession) -> pl.DataFrame:
+        """Mapa vigente (grn_map, ir_map, wb_map); lo reconstruye si falta o quedó viejo."""
+        mtime_ns = _mtime_ns(self.path)
+        if not mtime_ns or self._is_stale(mtime_ns):
+            return await self.rebuild(db)
+        try:
+            return self._read(mtime_ns)
+        except Exception as e:
+            print(f"⚠️ [GRN MAP] Mapa persistido ilegible ({e}); se reconstruye")
+            return await self.rebuild(db)
+
+    def get_persisted(self) -> Optional[pl.DataFrame]:
+        """Mapa publicado si existe y está al día; None si hay que reconstruirlo (sin DB a mano)."""
+        mtime_ns = _mtime_ns(self.path)
+        if not mtime_ns or self._is_stale(mtime_ns):
+            return None
+        try:
+            return self._read(mtime_ns)
+        except Exception as e:
+            print(f"⚠️ [GRN MAP] Mapa persistido ilegible: {e}")
+            return None
+
+
+grn_ir_map = GRNIRMap()
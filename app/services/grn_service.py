@@ -7,6 +7,7 @@ from sqlalchemy import select
 from sqlalchemy.dialects.mysql import insert
 from app.models.sql_models import GRNMaster
 from app.core.config import GRN_EXCEL_PATH, GRN_JSON_DATA_PATH
+from app.services.grn_ir_map import grn_ir_map
 
 async def seed_grn_from_excel(db: AsyncSession):
     """
@@ -115,7 +116,8 @@ async def seed_grn_from_excel(db: AsyncSession):
 
 async def export_grn_to_json(db: AsyncSession):
     """
-    Exporta el maestro GRN de la base de datos a un archivo JSON optimizado con orjson.
+    Exporta el maestro GRN de la base de datos a un archivo JSON optimizado con orjson
+    y reconstruye el mapa GRN -> I.R. (seed y CRUD de GRN pasan todos por aquí).
     """
     try:
         stmt = select(GRNMaster)
@@ -137,6 +139,12 @@ async def export_grn_to_json(db: AsyncSession):
             
         with open(GRN_JSON_DATA_PATH, 'wb') as f:
             f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+
+        try:
+            await grn_ir_map.rebuild(db)
+        except Exception as e:
+            # El mapa queda más viejo que el JSON y se reconstruye en la próxima lectura
+            print(f"⚠️ [GRN MAP] No se pudo reconstruir el mapa GRN -> I.R.: {e}")
         return True
     except Exception as e:
         print(f"❌ [POLARS] Error exportando JSON: {e}")
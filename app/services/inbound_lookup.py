@@ -0,0 +1,335 @@
+"""
+Servicio de búsqueda consolidada para el escaneo de Inbound (/api/find_item).
+Reúne en un solo pipeline las lecturas que antes se hacían en awaits secuenciales:
+maestro + estadísticas de logs en una sola consulta, y una única foto de ocupación
+y layout reutilizada por el slotting tradicional, la IA y la validación de capacidad.
+"""
+import datetime
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlalchemy import select, func, and_, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.sql_models import MasterItem, Log
+from app.services import csv_handler
+from app.services.db_logs import VIRTUAL_BINS
+from app.services.slotting_service import slotting_service
+from app.services.ai_slotting import ai_slotting
+
+# Umbral de latencia objetivo por escaneo (ms); por encima se registra el desglose
+SLOW_LOOKUP_MS = 30.0
+
+# Caché de sugerencias en lote por I.R.: {I.R.: (clave de versión, expira, payload)}
+BATCH_CACHE_TTL = 60
+BATCH_CACHE_MAX = 128
+_batch_cache: Dict[str, Tuple[tuple, float, Dict[str, Any]]] = {}
+
+
+class StageTimer:
+    """Acumula la duración de cada etapa del pipeline (perf_counter, en ms)."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._mark = self._start
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.stages[stage] = (now - self._mark) * 1000
+        self._mark = now
+
+    @property
+    def total_ms(self) -> float:
+        return (self._mark - self._start) * 1000
+
+    def server_timing(self) -> str:
+        """Formato del header Server-Timing (visible en las DevTools del navegador)."""
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={self.total_ms:.1f}")
+        return ", ".join(parts)
+
+
+def _log_stats_columns(item_code: str):
+    """Subconsultas escalares con las estadísticas de logs del ítem (una sola ida y vuelta)."""
+    since_date = (datetime.datetime.now() - datetime.timedelta(days=90)).isoformat()
+
+    latest_relocated = (
+        select(Log.relocatedBin)
+        .where(
+            Log.itemCode == item_code,
+            Log.relocatedBin.is_not(None),
+            Log.relocatedBin != '',
+            ~Log.relocatedBin.in_(VIRTUAL_BINS),
+            Log.archived_at.is_(None)
+        )
+        .order_by(Log.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    total_received = (
+        select(func.coalesce(func.sum(Log.qtyReceived), 0))
+        .where(Log.itemCode == item_code, Log.archived_at.is_(None))
+        .scalar_subquery()
+    )
+    hits_90d = (
+        select(func.count(Log.id))
+        .where(and_(Log.itemCode == item_code, Log.timestamp >= since_date))
+        .scalar_subquery()
+    )
+    return [
+        latest_relocated.label("latest_relocated_bin"),
+        total_received.label("total_received"),
+        hits_90d.label("hits_90d"),
+    ]
+
+
+async def _fetch_item_and_stats(db: AsyncSession, item_code: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Obtiene el ítem del maestro SQL junto con sus estadísticas de logs en una sola consulta.
+    Si el ítem no está en SQL, usa el caché Arrow y consulta solo las estadísticas.
+    """
+    stats_cols = _log_stats_columns(item_code)
+    stats = {"latest_relocated_bin": None, "total_received": 0, "hits_90d": 0}
+
+    try:
+        row = (await db.execute(
+            select(MasterItem, *stats_cols).where(MasterItem.item_code == item_code)
+        )).first()
+        if row is not None:
+            stats.update(latest_relocated_bin=row[1], total_received=int(row[2] or 0), hits_90d=int(row[3] or 0))
+            return csv_handler.master_item_to_dict(row[0]), stats
+    except Exception as e:
+        print(f"⚠️ Error consultando MasterItem en DB: {e}")
+
+    # Fallback: caché en RAM (índice hash de la generación mapeada)
+    await csv_handler.reload_cache_if_needed()
+    item_details = csv_handler.get_master_row(item_code)
+    if item_details is None:
+        return None, stats
+
+    try:
+        row = (await db.execute(select(literal(1), *stats_cols))).first()
+        stats.update(latest_relocated_bin=row[1], total_received=int(row[2] or 0), hits_90d=int(row[3] or 0))
+    except Exception as e:
+        print(f"DB Error (inbound_lookup stats): {e}")
+    return item_details, stats
+
+
+async def lookup_item(db: AsyncSession, item_code: str, import_reference: str) -> Tuple[Optional[Dict[str, Any]], StageTimer]:
+    """
+    Ejecuta el pipeline completo de find_item.
+    Retorna (response_data | None si el ítem no existe, timer con los tiempos por etapa).
+    """
+    timer = StageTimer()
+    item_code = item_code.strip().upper()
+
+    # 1. Maestro + última reubicación + total recibido + hits (una consulta)
+    item_details, stats = await _fetch_item_and_stats(db, item_code)
+    timer.lap("item")
+    if item_details is None:
+        return None, timer
+
+    # 2. Datos en memoria por generación (dict hits)
+    expected_quantity = await csv_handler.get_total_expected_quantity_for_item(item_code)
+    xdock_data = await csv_handler.get_xdock_info(item_code)
+    timer.lap("cache")
+
+    # 3. Una sola foto de layout y ocupación para todo el request
+    layout_config = await slotting_service._get_layout_config(db)
+    timer.lap("layout")
+    occupancy = await slotting_service._get_bins_occupancy(db)
+    timer.lap("occupancy")
+
+    original_bin = item_details.get('Bin_1', 'N/A')
+    latest_relocated_bin = stats["latest_relocated_bin"]
+    # La ubicación base será la reubicada si existe, sino la del maestro
+    effective_bin_location = latest_relocated_bin if latest_relocated_bin else original_bin
+
+    # 4. Sugerencia de Slotting Dinámico (Algoritmo Tradicional)
+    traditional_suggested_bin = await slotting_service.get_suggested_bin(
+        db, item_details, occupancy=occupancy, hits=stats["hits_90d"], config=layout_config
+    )
+    timer.lap("slotting")
+
+    # 5. Sugerencia de IA (Aprendizaje Histórico)
+    ai_predicted_bin = await ai_slotting.predict_best_bin(
+        db=db,
+        item_code=item_code,
+        sic_code=item_details.get('SIC_Code_stockroom'),
+        fallback_bin=traditional_suggested_bin,
+        layout_config=layout_config
+    )
+    timer.lap("ai")
+
+    # 6. Validación de capacidad para la IA (misma foto de ocupación)
+    final_suggested_bin = ai_predicted_bin
+    is_ai_prediction = ai_predicted_bin != traditional_suggested_bin
+    if is_ai_prediction and occupancy.get(ai_predicted_bin.upper(), 0) >= 4:
+        final_suggested_bin = traditional_suggested_bin
+        is_ai_prediction = False
+
+    # 7. Información de Cross-Docking (Xdock)
+    total_reserved = xdock_data.get("total", 0)
+    xdock_pending = max(0, total_reserved - stats["total_received"])
+
+    # No sugerir si el ítem ya está en la ubicación sugerida
+    if final_suggested_bin == effective_bin_location:
+        final_suggested_bin = None
+        is_ai_prediction = False
+
+    response_data = {
+        "itemCode": item_details.get('Item_Code', item_code),
+        "description": item_details.get('Item_Description', 'N/A'),
+        "binLocation": effective_bin_location,
+        "suggestedBin": final_suggested_bin,
+        "is_ai_prediction": is_ai_prediction,
+        "xdockTotal": total_reserved,
+        "xdockPending": xdock_pending,
+        "xdockCustomers": xdock_data.get("customers", []),
+        "aditionalBins": item_details.get('Aditional_Bin_Location', 'N/A'),
+        "physicalQty": str(item_details.get('Physical_Qty', '0')).replace(',', ''),
+        "weight": item_details.get('Weight_per_Unit', 'N/A'),
+        "defaultQtyGrn": expected_quantity,
+        "itemType": item_details.get('ABC_Code_stockroom', 'N/A'),
+        "sicCode": item_details.get('SIC_Code_stockroom', 'N/A'),
+        "dateLastReceived": item_details.get('Date_Last_Received', 'N/A'),
+        "supersededBy": item_details.get('SupersededBy', 'N/A'),
+        "latestRelocatedBin": latest_relocated_bin
+    }
+    timer.lap("build")
+
+    if timer.total_ms > SLOW_LOOKUP_MS:
+        print(f"⏱️ [INBOUND] find_item {item_code} ({import_reference}) tomó {timer.total_ms:.1f} ms -> {timer.server_timing()}")
+
+    return response_data, timer
+
+
+# --- Sugerencias en lote por I.R. (prefetch de handhelds) ---
+
+def _chunks(values: List[str], size: int = 1000):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+async def _fetch_items_batch(db: AsyncSession, item_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Detalles del maestro para varios ítems (SQL con IN por bloques; fallback al caché Arrow)."""
+    details: Dict[str, Dict[str, Any]] = {}
+    try:
+        for chunk in _chunks(item_codes):
+            for db_item in (await db.execute(select(MasterItem).where(MasterItem.item_code.in_(chunk)))).scalars():
+                details[db_item.item_code] = csv_handler.master_item_to_dict(db_item)
+    except Exception as e:
+        print(f"⚠️ Error consultando MasterItem en DB: {e}")
+
+    for code in item_codes:
+        if code not in details:
+            row = csv_handler.get_master_row(code)
+            if row is not None:
+                details[code] = row
+    return details
+
+
+async def _fetch_log_stats_batch(db: AsyncSession, item_codes: List[str]) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """Última reubicación real y hits de 90 días para varios ítems con dos consultas agrupadas."""
+    since_date = (datetime.datetime.now() - datetime.timedelta(days=90)).isoformat()
+    latest: Dict[str, str] = {}
+    hits: Dict[str, int] = {}
+    try:
+        for chunk in _chunks(item_codes):
+            last_ids = (
+                select(func.max(Log.id))
+                .where(
+                    Log.itemCode.in_(chunk),
+                    Log.relocatedBin.is_not(None),
+                    Log.relocatedBin != '',
+                    ~Log.relocatedBin.in_(VIRTUAL_BINS),
+                    Log.archived_at.is_(None)
+                )
+                .group_by(Log.itemCode)
+            )
+            for code, bin_code in (await db.execute(select(Log.itemCode, Log.relocatedBin).where(Log.id.in_(last_ids)))).all():
+                latest[code] = bin_code
+
+            hits_stmt = (
+                select(Log.itemCode, func.count(Log.id))
+                .where(and_(Log.itemCode.in_(chunk), Log.timestamp >= since_date))
+                .group_by(Log.itemCode)
+            )
+            for code, count in (await db.execute(hits_stmt)).all():
+                hits[code] = int(count or 0)
+    except Exception as e:
+        print(f"DB Error (inbound_lookup batch stats): {e}")
+    return latest, hits
+
+
+async def import_reference_suggestions(db: AsyncSession, import_reference: str) -> Dict[str, Any]:
+    """
+    Sugerencias de slotting para todos los ítems de una I.R. en una sola pasada.
+    El resultado se cachea por I.R. mientras no cambien la generación de CSV ni el layout (TTL corto
+    porque la ocupación real avanza con cada recepción).
+    """
+    import_reference = import_reference.strip().upper()
+    item_codes = await csv_handler.get_import_reference_items(import_reference)
+    # Valida (o reconstruye) el layout antes de armar la clave de versión
+    layout_config = await slotting_service._get_layout_config(db)
+
+    version_key = (csv_handler.cache_generation, slotting_service.layout_version)
+    cached = _batch_cache.get(import_reference)
+    if cached and cached[0] == version_key and cached[1] > time.time():
+        return cached[2]
+
+    timer = StageTimer()
+    details = await _fetch_items_batch(db, item_codes)
+    latest, hits = await _fetch_log_stats_batch(db, list(details))
+    timer.lap("items")
+
+    occupancy = await slotting_service._get_bins_occupancy(db)
+    timer.lap("snapshot")
+
+    ordered = [details[code] for code in item_codes if code in details]
+    suggestions = await slotting_service.get_suggested_bins_batch(
+        db, ordered, hits_map=hits, config=layout_config, occupancy=occupancy
+    )
+    timer.lap("slotting")
+
+    items = []
+    for item_details in ordered:
+        code = str(item_details.get('Item_Code', '')).strip().upper()
+        effective_bin = latest.get(code) or item_details.get('Bin_1', 'N/A')
+        suggestion = suggestions.get(code, {})
+        suggested_bin = suggestion.get("suggestedBin")
+        is_ai = suggestion.get("is_ai_prediction", False)
+        if suggested_bin == effective_bin:
+            suggested_bin, is_ai = None, False
+
+        expected = csv_handler.grn_ir_expected_map.get((import_reference, code))
+        if expected is None:
+            expected = csv_handler.grn_expected_map.get(code, 0)
+
+        items.append({
+            "itemCode": item_details.get('Item_Code', code),
+            "description": item_details.get('Item_Description', 'N/A'),
+            "binLocation": effective_bin,
+            "suggestedBin": suggested_bin,
+            "is_ai_prediction": is_ai,
+            "defaultQtyGrn": expected,
+            "sicCode": item_details.get('SIC_Code_stockroom', 'N/A'),
+            "latestRelocatedBin": latest.get(code)
+        })
+
+    payload = {
+        "importReference": import_reference,
+        "generation": csv_handler.cache_generation,
+        "layoutVersion": slotting_service.layout_version,
+        "generatedAt": datetime.datetime.now().isoformat(timespec='seconds'),
+        "notFound": [code for code in item_codes if code not in details],
+        "items": items
+    }
+
+    if len(_batch_cache) >= BATCH_CACHE_MAX:
+        _batch_cache.pop(next(iter(_batch_cache)))
+    _batch_cache[import_reference] = (version_key, time.time() + BATCH_CACHE_TTL, payload)
+
+    print(f"✅ [INBOUND] Sugerencias en lote {import_reference}: {len(items)} ítems -> {timer.server_timing()}")
+    return payload
@@ -0,0 +1,100 @@
+"""
+Registro de trabajos en segundo plano compartido entre workers.
+Cada trabajo es un archivo JSON en instance/cache/jobs escrito de forma atómica: el worker
+que ejecuta el trabajo actualiza su estado y cualquier otro puede responder la consulta.
+"""
+import datetime
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import orjson
+
+from app.core.config import JOBS_FOLDER
+
+JOB_TTL_SECONDS = 24 * 3600   # Los trabajos terminados se olvidan al día siguiente
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobRegistry:
+    def __init__(self, folder: str = JOBS_FOLDER):
+        self.folder = folder
+
+    def _path(self, job_id: str) -> Optional[str]:
+        # Solo ids generados por el registro: evita rutas arbitrarias desde la URL
+        if not _JOB_ID_RE.match(job_id or ""):
+            return None
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def _write(self, job: Dict[str, Any]):
+        path = self._path(job["id"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(job))
+        os.replace(tmp_path, path)
+
+    def create(self, kind: str, message: str = "", **meta) -> Dict[str, Any]:
+        """Registra un trabajo en estado 'pending' y lo retorna."""
+        os.makedirs(self.folder, exist_ok=True)
+        self.prune()
+        now = datetime.datetime.now().isoformat()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "pending",
+            "message": message,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+            **meta,
+        }
+        self._write(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """Actualiza campos del trabajo (status, message, result...). Solo lo escribe el worker que lo ejecuta."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields, updated_at=datetime.datetime.now().isoformat())
+        self._write(job)
+        return job
+
+    def delete(self, job_id: str):
+        path = self._path(job_id)
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Elimina los archivos de trabajos más viejos que JOB_TTL_SECONDS."""
+        limit = time.time() - JOB_TTL_SECONDS
+        try:
+            entries = os.scandir(self.folder)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < limit:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+job_registry = JobRegistry()
@@ -0,0 +1,352 @@
+"""
+Datos maestros para operación offline (handhelds) con sincronización delta.
+La versión es la generación del caché compartido (cambia con el maestro, la 280, Xdock o po_lookup).
+Por cada generación se guarda un índice (dataset, clave, hash de la fila); con `since=<versión>`
+se cruzan los dos índices y solo viajan las filas agregadas o modificadas y las claves eliminadas.
+La carga completa se serializa y comprime una sola vez por generación (gzip y, si está instalado,
+brotli) y se comparte entre workers desde disco; se sirve tal cual con un ETag fuerte.
+Formatos de la carga completa: "json" (lista de objetos, el de siempre) y "columnar" (una lista por
+columna y las columnas repetitivas codificadas con diccionario; ver decodeColumnar en offlineDb.js).
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import orjson
+import polars as pl
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin brotli se publica solo gzip
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): sin bloqueo entre procesos
+    fcntl = None
+
+from app.core.config import MASTER_SYNC_FOLDER, PO_LOOKUP_JSON_PATH
+from app.services import csv_handler
+
+# Columnas del maestro que necesita Inbound offline
+SYNC_MASTER_COLUMNS = [
+    'Item_Code', 'Item_Description', 'Bin_1', 'Weight_per_Unit',
+    'ABC_Code_stockroom', 'SIC_Code_stockroom'
+]
+INDEX_KEEP_GENERATIONS = 20   # Un handheld más atrasado que esto recibe la carga completa
+MAP_DATASETS = ("grn_pending", "xdock_reservations", "po_wb", "po_ir")
+_INDEX_SCHEMA = {"dataset": pl.Utf8, "key": pl.Utf8, "hash": pl.UInt64}
+_INDEX_FILE_RE = re.compile(r"^index\.(\d+)\.arrow$")
+
+FULL_KEEP_GENERATIONS = 2   # Cargas completas precomprimidas que se conservan en disco
+FULL_GZIP_LEVEL = 9
+FULL_BROTLI_QUALITY = 9     # 11 tarda decenas de segundos con un maestro grande
+_FULL_FILE_RE = re.compile(r"^full\.(\d+)\.")
+FULL_FORMATS = ("json", "columnar")
+FULL_ENCODINGS = (("br", "br"), ("gzip", "gz"))   # Content-Encoding -> extensión del archivo
+DICTIONARY_MAX_RATIO = 0.5  # Columna de texto con menos valores distintos que esto (por fila) va con diccionario
+_FULL_LOCK_PATH = os.path.join(MASTER_SYNC_FOLDER, "full.lock")
+
+
+def _read_po_lookup() -> dict:
+    if not os.path.exists(PO_LOOKUP_JSON_PATH):
+        return {}
+    try:
+        with open(PO_LOOKUP_JSON_PATH, "rb") as f:
+            return orjson.loads(f.read())
+    except Exception:
+        return {}
+
+
+def _index_path(generation: int) -> str:
+    return os.path.join(MASTER_SYNC_FOLDER, f"index.{generation}.arrow")
+
+
+def _full_path(generation: int, fmt: str, ext: str) -> str:
+    return os.path.join(MASTER_SYNC_FOLDER, f"full.{generation}.{fmt}.{ext}")
+
+
+def encode_columnar(df: pl.DataFrame) -> Dict[str, Any]:
+    """
+    Tabla como columnas: {"length": n, "columns": {nombre: [valores] | {"dict": [...], "codes": [...]}}}.
+    Las columnas de texto con pocos valores distintos (ubicación, ABC, SIC) viajan como diccionario
+    ordenado más un código por fila; un nulo se mantiene como código nulo.
+    """
+    columns: Dict[str, Any] = {}
+    for name in df.columns:
+        series = df.get_column(name)
+        if series.dtype == pl.Utf8 and df.height and series.n_unique() <= df.height * DICTIONARY_MAX_RATIO:
+            columns[name] = {
+                "dict": series.drop_nulls().unique().sort().to_list(),
+                "codes": (series.rank("dense") - 1).cast(pl.UInt32).to_list(),
+            }
+        else:
+            columns[name] = series.to_list()
+    return {"length": df.height, "columns": columns}
+
+
+def _write_atomic(path: str, payload: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _full_lock():
+    """Bloqueo entre procesos (y entre hilos) para que una sola construcción comprima la carga completa."""
+    os.makedirs(MASTER_SYNC_FOLDER, exist_ok=True)
+    with open(_FULL_LOCK_PATH, "a+b") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@dataclass(frozen=True)
+class FullPayload:
+    """Carga completa de una generación, ya serializada y comprimida por Content-Encoding."""
+    version: int
+    format: str
+    etag: str
+    bodies: Dict[str, bytes]   # "br" / "gzip" -> cuerpo comprimido
+
+
+@dataclass(frozen=True)
+class SyncGeneration:
+    """Datos servidos e índice de una generación; se reemplaza entero para que los hilos no vean mezclas."""
+    generation: int
+    master: pl.DataFrame
+    maps: Dict[str, dict]
+    po_lookup: dict
+    index: pl.DataFrame
+
+
+def _map_index(dataset: str, mapping: dict) -> pl.DataFrame:
+    """Índice de un mapa clave -> valor: el hash se calcula sobre el valor serializado."""
+    df = pl.DataFrame(
+        {"key": [str(k) for k in mapping], "value": [orjson.dumps(v).decode() for v in mapping.values()]},
+        schema={"key": pl.Utf8, "value": pl.Utf8}
+    )
+    return df.select([pl.lit(dataset).alias("dataset"), "key", pl.col("value").hash().alias("hash")])
+
+
+class MasterSyncState:
+    """
+    Datos servidos e índice de la generación mapeada en este worker (se rehacen al cambiar de generación).
+    Armar el índice hashea todo el maestro: los métodos públicos salvo current_full son bloqueantes
+    y se llaman en el threadpool; un lock evita que dos hilos lo armen a la vez.
+    """
+
+    def __init__(self):
+        self._state: Optional[SyncGeneration] = None
+        self._lock = threading.Lock()
+        self._full: Dict[str, FullPayload] = {}
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self._state.generation if self._state is not None else None
+
+    def _ensure_current(self) -> SyncGeneration:
+        with self._lock:
+            while True:
+                generation = csv_handler.cache_generation
+                state = self._state
+                if state is not None and state.generation == generation:
+                    return state
+                state = self._build_state(generation)
+                # El worker pudo cambiar de generación mientras se armaba: se rehace con la nueva
+                if csv_handler.cache_generation == generation:
+                    break
+            self._persist(generation, state.index)
+            self._state = state
+            return state
+
+    def _build_state(self, generation: int) -> SyncGeneration:
+        df_master = csv_handler.df_master_cache
+        master = pl.DataFrame(schema={"Item_Code": pl.Utf8})
+        if df_master is not None:
+            available_cols = [c for c in SYNC_MASTER_COLUMNS if c in df_master.columns]
+            # Ante códigos repetidos el handheld se queda con la última fila (put sobre la misma clave)
+            master = (
+                df_master.select(available_cols)
+                .filter(pl.col("Item_Code").is_not_null())
+                .unique(subset="Item_Code", keep="last", maintain_order=True)
+            )
+
+        po_lookup = _read_po_lookup()
+        maps = {
+            "grn_pending": csv_handler.grn_expected_map,
+            "xdock_reservations": csv_handler.reservation_qty_map,
+            "po_wb": po_lookup.get("wb_to_data", {}),
+            "po_ir": po_lookup.get("ir_to_data", {}),
+        }
+
+        index = pl.concat([
+            pl.DataFrame({
+                "dataset": "master_items",
+                "key": master.get_column("Item_Code").cast(pl.Utf8),
+                "hash": master.hash_rows(),
+            }, schema=_INDEX_SCHEMA),
+            *[_map_index(dataset, maps[dataset]) for dataset in MAP_DATASETS],
+        ])
+        return SyncGeneration(generation, master, maps, po_lookup, index)
+
+    def _persist(self, generation: int, index: pl.DataFrame):
+        """Publica el índice de la generación (una sola vez) y borra los más viejos."""
+        path = _index_path(generation)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(MASTER_SYNC_FOLDER, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            index.write_ipc(tmp_path, compression='zstd')
+            os.replace(tmp_path, path)
+
+            generations = sorted(
+                int(m.group(1)) for m in map(_INDEX_FILE_RE.match, os.listdir(MASTER_SYNC_FOLDER)) if m
+            )
+            for old in generations[:-INDEX_KEEP_GENERATIONS]:
+                os.remove(_index_path(old))
+        except OSError as e:
+            print(f"⚠️ [SYNC] No se pudo guardar el índice de la generación {generation}: {e}")
+
+    def full_payload(self, fmt: str = "json") -> Dict[str, Any]:
+        """Carga completa más la versión para pedir deltas después; `fmt` define cómo viajan los ítems."""
+        state = self._ensure_current()
+        return {
+            "version": state.generation,
+            "full": True,
+            "format": fmt,
+            "master_items": encode_columnar(state.master) if fmt == "columnar" else state.master.to_dicts(),
+            "grn_pending": state.maps["grn_pending"],
+            "xdock_reservations": state.maps["xdock_reservations"],
+            "po_lookup": state.po_lookup,
+        }
+
+    def current_full(self, fmt: str = "json") -> Optional[FullPayload]:
+        """Carga completa ya cargada en este worker para la generación vigente (sin tocar disco ni CPU)."""
+        full = self._full.get(fmt)
+        if full is not None and full.version == csv_handler.cache_generation:
+            return full
+        return None
+
+    def build_full(self, fmt: str = "json") -> FullPayload:
+        """
+        Carga completa precomprimida de la generación vigente (bloqueante: llamar en el threadpool).
+        El primer worker que la pide la serializa y comprime; el resto la lee desde disco.
+        """
+        full = self.current_full(fmt)
+        if full is not None:
+            return full
+        with _full_lock():
+            generation = csv_handler.cache_generation
+            full = self._load_full(generation, fmt)
+            if full is None:
+                full = self._compress_full(fmt)
+                self._publish_full(full)
+        self._full[fmt] = full
+        return full
+
+    def _load_full(self, generation: int, fmt: str) -> Optional[FullPayload]:
+        """Lee la carga publicada por otro worker; el archivo .etag se escribe último y marca que está completa."""
+        try:
+            with open(_full_path(generation, fmt, "etag"), "r") as f:
+                etag = f.read().strip()
+            bodies = {}
+            for encoding, ext in FULL_ENCODINGS:
+                path = _full_path(generation, fmt, ext)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        bodies[encoding] = f.read()
+        except OSError:
+            return None
+        if "gzip" not in bodies:
+            return None
+        if "br" not in bodies and brotli is not None:
+            return None   # Publicada por un worker sin brotli: se rehace con ambas
+        return FullPayload(generation, fmt, etag, bodies)
+
+    def _compress_full(self, fmt: str) -> FullPayload:
+        start = time.time()
+        payload = self.full_payload(fmt)
+        raw = orjson.dumps({"timestamp": start, **payload})
+        digest = hashlib.sha256(raw).hexdigest()[:16]
+        bodies = {"gzip": gzip.compress(raw, compresslevel=FULL_GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(raw, quality=FULL_BROTLI_QUALITY)
+        sizes = ", ".join(f"{encoding} {len(body) / 1e6:.2f} MB" for encoding, body in bodies.items())
+        print(f"✅ [SYNC] Carga completa v{payload['version']} ({fmt}) comprimida en {time.time() - start:.2f}s ({len(raw) / 1e6:.2f} MB -> {sizes})")
+        return FullPayload(payload["version"], fmt, f'"{payload["version"]}-{digest}"', bodies)
+
+    def _publish_full(self, full: FullPayload):
+        """Guarda los cuerpos comprimidos (el .etag al final) y borra los de generaciones viejas."""
+        try:
+            for encoding, ext in FULL_ENCODINGS:
+                if encoding in full.bodies:
+                    _write_atomic(_full_path(full.version, full.format, ext), full.bodies[encoding])
+            _write_atomic(_full_path(full.version, full.format, "etag"), full.etag.encode())
+
+            files = [(int(m.group(1)), m.string) for m in map(_FULL_FILE_RE.match, os.listdir(MASTER_SYNC_FOLDER)) if m]
+            keep = sorted({generation for generation, _ in files})[-FULL_KEEP_GENERATIONS:]
+            for generation, name in files:
+                if generation not in keep:
+                    try:
+                        os.remove(os.path.join(MASTER_SYNC_FOLDER, name))
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            print(f"⚠️ [SYNC] No se pudo guardar la carga completa de la generación {full.version}: {e}")
+
+    def delta_payload(self, since: int) -> Optional[Dict[str, Any]]:
+        """
+        Cambios desde la versión `since`; None si ese índice ya no existe (el cliente debe bajar todo).
+        Bloqueante (cruce de índices): llamar en el threadpool.
+        """
+        state = self._ensure_current()
+        if since > state.generation:
+            return None
+        try:
+            previous = pl.read_ipc(_index_path(since))
+        except (FileNotFoundError, OSError):
+            return None
+
+        diff = state.index.join(previous, on=["dataset", "key"], how="full", suffix="_old", coalesce=True)
+        upserts = diff.filter(pl.col("hash").is_not_null() & (pl.col("hash_old").is_null() | (pl.col("hash") != pl.col("hash_old"))))
+        removed = diff.filter(pl.col("hash").is_null())
+
+        def keys(frame: pl.DataFrame, dataset: str) -> list:
+            return frame.filter(pl.col("dataset") == dataset).get_column("key").to_list()
+
+        def map_delta(dataset: str) -> Dict[str, Any]:
+            mapping = state.maps[dataset]
+            return {
+                "upsert": {k: mapping[k] for k in keys(upserts, dataset) if k in mapping},
+                "remove": keys(removed, dataset),
+            }
+
+        master_keys = keys(upserts, "master_items")
+        return {
+            "version": state.generation,
+            "since": since,
+            "full": False,
+            "master_items": {
+                "upsert": state.master.filter(pl.col("Item_Code").is_in(master_keys)).to_dicts() if master_keys else [],
+                "remove": keys(removed, "master_items"),
+            },
+            "grn_pending": map_delta("grn_pending"),
+            "xdock_reservations": map_delta("xdock_reservations"),
+            "po_lookup": {"wb_to_data": map_delta("po_wb"), "ir_to_data": map_delta("po_ir")},
+        }
+
+
+master_sync = MasterSyncState()
@@ -0,0 +1,257 @@
+"""
+Servicio de ocupación de ubicaciones (bin -> cantidad de SKUs).
+Mantiene el mapa en memoria: se construye una vez desde SQL (maestro + logs activos)
+y luego se actualiza con deltas cuando los logs cambian de relocatedBin.
+Los demás workers se enteran de los cambios por el mtime de archivos de señal.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import select, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import AsyncSessionLocal
+from app.models.sql_models import MasterItem, Log
+from app.core.config import CACHE_FOLDER, OCCUPANCY_LOGS_SIGNAL_PATH, OCCUPANCY_MASTER_SIGNAL_PATH
+
+
+def _norm(value: Optional[str]) -> str:
+    return str(value).strip().upper() if value else ""
+
+
+class OccupancyService:
+    def __init__(self, consistency_interval: int = 300):
+        self._master_counts: Dict[str, int] = {}          # bin -> SKUs con stock en el maestro
+        self._log_items: Dict[str, Dict[str, int]] = {}   # bin -> {item_code: logs activos}
+        self._occupancy: Dict[str, int] = {}              # bin -> total (maestro + ítems distintos en logs)
+        self._master_ready = False
+        self._logs_ready = False
+        self._building = False
+        self._changed_during_build = False
+        self._signals_seen = {OCCUPANCY_LOGS_SIGNAL_PATH: None, OCCUPANCY_MASTER_SIGNAL_PATH: None}
+        self._last_verified = 0.0
+        self._verify_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.consistency_interval = consistency_interval
+        # Cambia cuando algún bin baja de ocupación o el mapa se reemplaza; los heaps de
+        # candidatos del slotting solo toleran subidas perezosas, así que se rehacen al cambiar
+        self._epoch = 0
+
+    # --- Lectura ---
+
+    async def get_occupancy(self, db: AsyncSession) -> Dict[str, int]:
+        """
+        Retorna el mapa bin -> SKUs (solo lectura; no mutar el dict retornado).
+        Reconstruye solo la parte invalidada y cada `consistency_interval` segundos lo compara con SQL
+        en segundo plano (la lectura no espera las dos agregaciones).
+        """
+        self._check_signals()
+        if self._master_ready and self._logs_ready:
+            if time.time() - self._last_verified > self.consistency_interval:
+                # Se marca antes de lanzarla: las lecturas concurrentes no disparan otra verificación
+                self._last_verified = time.time()
+                self._verify_task = asyncio.create_task(self._verify_in_background())
+            return self._occupancy
+
+        async with self._lock:
+            if not (self._master_ready and self._logs_ready):
+                await self._rebuild(db)
+        return self._occupancy
+
+    def heap_token(self, occupancy: Dict[str, int]) -> Optional[int]:
+        """Token de validez para estructuras derivadas de este mapa (None si no es el mapa del servicio)."""
+        return self._epoch if occupancy is self._occupancy else None
+
+    # --- Consultas de verdad SQL ---
+
+    async def _query_master_counts(self, db: AsyncSession) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        stmt = select(MasterItem.bin_1, func.count(MasterItem.item_code)).where(MasterItem.physical_qty > 0).group_by(MasterItem.bin_1)
+        for bin_code, count in (await db.execute(stmt)).all():
+            code = _norm(bin_code)
+            if code:
+                counts[code] = counts.get(code, 0) + count
+        return counts
+
+    async def _query_log_items(self, db: AsyncSession) -> Dict[str, Dict[str, int]]:
+        items: Dict[str, Dict[str, int]] = {}
+        stmt = (
+            select(Log.relocatedBin, Log.itemCode, func.count(Log.id))
+            .where(and_(Log.archived_at == None, Log.relocatedBin != '', Log.relocatedBin != None))
+            .group_by(Log.relocatedBin, Log.itemCode)
+        )
+        for bin_code, item_code, count in (await db.execute(stmt)).all():
+            code = _norm(bin_code)
+            if code:
+                per_bin = items.setdefault(code, {})
+                item = _norm(item_code)
+                per_bin[item] = per_bin.get(item, 0) + count
+        return items
+
+    @staticmethod
+    def _combine(master_counts: Dict[str, int], log_items: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+        occupancy = dict(master_counts)
+        for code, items in log_items.items():
+            if items:
+                occupancy[code] = occupancy.get(code, 0) + len(items)
+        return occupancy
+
+    async def _rebuild(self, db: AsyncSession):
+        """Reconstruye desde SQL únicamente las partes invalidadas."""
+        self._building, self._changed_during_build = True, False
+        try:
+            master_counts = self._master_counts if self._master_ready else await self._query_master_counts(db)
+            log_items = self._log_items if self._logs_ready else await self._query_log_items(db)
+        except Exception as e:
+            print(f"Error calculando ocupación: {e}")
+            return
+        finally:
+            self._building = False
+
+        self._master_counts, self._log_items = master_counts, log_items
+        self._occupancy = self._combine(master_counts, log_items)
+        self._epoch += 1
+        self._master_ready = True
+        # Un delta llegado durante la consulta puede o no estar incluido: se reconstruye en la próxima lectura
+        self._logs_ready = not self._changed_during_build
+        self._last_verified = time.time()
+
+    async def _verify_in_background(self):
+        """Verificación periódica con sesión propia: la del request que la disparó se cierra al responder."""
+        try:
+            async with AsyncSessionLocal() as db:
+                await self.verify_consistency(db)
+        except Exception as e:
+            print(f"Error verificando ocupación: {e}")
+
+    async def verify_consistency(self, db: AsyncSession) -> int:
+        """Compara el mapa en memoria con SQL, corrige la deriva y retorna cuántos bins diferían."""
+        async with self._lock:
+            self._last_verified = time.time()
+            self._building, self._changed_during_build = True, False
+            try:
+                master_counts = await self._query_master_counts(db)
+                log_items = await self._query_log_items(db)
+            except Exception as e:
+                print(f"Error verificando ocupación: {e}")
+                return 0
+            finally:
+                self._building = False
+
+            truth = self._combine(master_counts, log_items)
+            current = self._occupancy
+            drift = sum(1 for code in truth.keys() | current.keys() if truth.get(code, 0) != current.get(code, 0))
+            if drift:
+                print(f"⚠️ [OCUPACIÓN] {drift} ubicaciones con deriva respecto a SQL; mapa corregido")
+
+            self._master_counts, self._log_items, self._occupancy = master_counts, log_items, truth
+            self._master_ready = True
+            # Un delta llegado durante las consultas puede o no estar incluido: se reconstruye en la próxima lectura
+            self._logs_ready = not self._changed_during_build
+            self._epoch += 1
+            return drift
+
+    # --- Señales entre workers ---
+
+    def _touch(self, path: str):
+        try:
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            with open(path, 'a'):
+                os.utime(path, None)
+            self._signals_seen[path] = os.stat(path).st_mtime_ns
+        except OSError as e:
+            print(f"⚠️ No se pudo publicar la señal de ocupación: {e}")
+
+    def _check_signals(self):
+        for path, seen in self._signals_seen.items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime != seen:
+                self._signals_seen[path] = mtime
+                if seen is not None:
+                    # Otro worker cambió la ocupación: recargar esa parte desde SQL
+                    if path == OCCUPANCY_MASTER_SIGNAL_PATH:
+                        self._master_ready = False
+                    else:
+                        self._logs_ready = False
+
+    # --- Deltas ---
+
+    def _refresh_bin(self, code: str):
+        total = self._master_counts.get(code, 0) + len(self._log_items.get(code, {}))
+        if total < self._occupancy.get(code, 0):
+            self._epoch += 1
+        if total:
+            self._occupancy[code] = total
+        else:
+            self._occupancy.pop(code, None)
+
+    def _apply(self, bin_code: Optional[str], item_code: Optional[str], delta: int):
+        code = _norm(bin_code)
+        if not code:
+            return
+        item = _norm(item_code)
+        per_bin = self._log_items.setdefault(code, {})
+        count = per_bin.get(item, 0) + delta
+        if count > 0:
+            per_bin[item] = count
+        else:
+            per_bin.pop(item, None)
+            if not per_bin:
+                self._log_items.pop(code, None)
+        self._refresh_bin(code)
+
+    def _after_delta(self):
+        if self._building:
+            self._changed_during_build = True
+        self._touch(OCCUPANCY_LOGS_SIGNAL_PATH)
+
+    def log_added(self, bin_code: Optional[str], item_code: Optional[str]):
+        """Un log activo nuevo con relocatedBin."""
+        if not _norm(bin_code):
+            return
+        if self._logs_ready:
+            self._apply(bin_code, item_code, 1)
+        self._after_delta()
+
+    def log_removed(self, bin_code: Optional[str], item_code: Optional[str]):
+        """Un log activo con relocatedBin fue eliminado."""
+        if not _norm(bin_code):
+            return
+        if self._logs_ready:
+            self._apply(bin_code, item_code, -1)
+        self._after_delta()
+
+    def log_moved(self, item_code: Optional[str], old_bin: Optional[str], new_bin: Optional[str]):
+        """Un log activo cambió de relocatedBin."""
+        if _norm(old_bin) == _norm(new_bin):
+            return
+        if self._logs_ready:
+            self._apply(old_bin, item_code, -1)
+            self._apply(new_bin, item_code, 1)
+        self._after_delta()
+
+    def logs_archived(self):
+        """Todos los logs activos pasaron a archivados: la parte de logs queda vacía."""
+        for code in list(self._log_items):
+            self._log_items.pop(code)
+            self._refresh_bin(code)
+        self._logs_ready = True
+        self._after_delta()
+
+    def invalidate_logs(self):
+        """Borrado masivo de logs: recalcular la parte de logs en la próxima lectura (todos los workers)."""
+        self._logs_ready = False
+        self._after_delta()
+
+    def invalidate_master(self):
+        """El maestro se sincronizó: recalcular la parte de stock en la próxima lectura (todos los workers)."""
+        self._master_ready = False
+        self._touch(OCCUPANCY_MASTER_SIGNAL_PATH)
+
+
+occupancy_service = OccupancyService()
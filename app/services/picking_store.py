@@ -0,0 +1,228 @@
+"""
+Almacén en memoria del reporte de picking (AURRSGLBD0240).
+El CSV se parsea una sola vez por versión del archivo (mtime); los pedidos quedan ordenados
+por (ORDER_, DESPATCH_) con un índice -> (offset, largo), y el resumen de seguimiento se
+precalcula para servirse sin volver a agrupar en cada request.
+"""
+import datetime
+import os
+from typing import Dict, List, Optional, Tuple
+
+import polars as pl
+
+from app.core.config import PICKING_CSV_PATH
+from app.services import csv_ingest
+
+ORDER_REQUIRED_COLUMNS = ["ORDER_", "DESPATCH_", "ITEM", "DESCRIPTION", "QTY", "CUSTOMER_NAME", "ORDER_LINE"]
+TRACKING_REQUIRED_COLUMNS = ["ORDER_", "DESPATCH_", "CUSTOMER_NAME", "PICK_LIST_PRINTED_TIME", "Time_Zone_Hours"]
+
+# Renombrado de columnas para consistencia interna (respuesta de /picking/order)
+ORDER_RENAME_MAP = {
+    "ORDER_": "Order Number",
+    "DESPATCH_": "Despatch Number",
+    "ITEM": "Item Code",
+    "DESCRIPTION": "Item Description",
+    "QTY": "Qty",
+    "CUSTOMER_NAME": "Customer Name",
+    "ORDER_LINE": "Order Line"
+}
+
+
+class PickingFileMissing(FileNotFoundError):
+    """El archivo de picking no existe."""
+
+
+class PickingFormatError(ValueError):
+    """El CSV de picking no tiene las columnas esperadas."""
+
+
+def format_local_print_time(raw_time: str, tz_value: str) -> str:
+    """Devuelve la hora local del CSV formateada; si no existe, devuelve vacío."""
+    if raw_time is None or str(raw_time).strip() == "" or str(raw_time).lower() == "none":
+        return "" # No mostrar fecha si no hay dato en el CSV
+
+    raw_time_str = str(raw_time).strip()
+
+    parsed_time = None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            parsed_time = datetime.datetime.strptime(raw_time_str, fmt)
+            break
+        except ValueError:
+            continue
+
+    if not parsed_time:
+        return raw_time_str # Devolver valor crudo para diagnóstico si falla parseo
+
+    tzinfo = None
+    tz_str = "" if tz_value is None else str(tz_value).strip()
+    if tz_str:
+        # Time_Zone_Hours viene en formato +/-HH:MM (ej: -6:00)
+        sign = -1 if tz_str.startswith("-") else 1
+        clean_tz = tz_str[1:] if tz_str.startswith(("-", "+")) else tz_str
+        parts = clean_tz.split(":", 1)
+        hours_str = parts[0]
+        minutes_str = parts[1] if len(parts) > 1 else "0"
+        try:
+            tz_delta = datetime.timedelta(hours=int(hours_str), minutes=int(minutes_str))
+            tzinfo = datetime.timezone(sign * tz_delta)
+        except ValueError:
+            tzinfo = None
+
+    if tzinfo:
+        parsed_time = parsed_time.replace(tzinfo=tzinfo)
+
+    return parsed_time.strftime("%Y-%m-%d %H:%M")
+
+
+class PickingStore:
+    def __init__(self, csv_path: str = PICKING_CSV_PATH):
+        self.csv_path = csv_path
+        self._file_key: Optional[Tuple[int, int]] = None   # (mtime_ns, tamaño) del CSV cargado
+        self._raw: Optional[pl.DataFrame] = None
+        # Vistas derivadas: se construyen al primer uso de cada versión del archivo
+        self._orders: Optional[pl.DataFrame] = None
+        self._order_index: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._tracking: Optional[List[dict]] = None
+
+    # --- Carga ---
+
+    def _ensure_loaded(self):
+        try:
+            st = os.stat(self.csv_path)
+        except OSError:
+            self._file_key, self._raw = None, None
+            raise PickingFileMissing("El archivo de picking no se encuentra.")
+
+        key = (st.st_mtime_ns, st.st_size)
+        if key == self._file_key:
+            return
+
+        raw = csv_ingest.read_report(self.csv_path)
+        # Limpiar BOM si existe en los nombres de las columnas
+        raw.columns = [c.lstrip('\ufeff') for c in raw.columns]
+        self._raw, self._file_key = raw, key
+        self._orders, self._order_index, self._tracking = None, {}, None
+        print(f"🔄 [PICKING] Reporte cargado: {raw.height} líneas")
+
+    def _customer_col(self) -> Optional[str]:
+        columns = self._raw.columns
+        return "CUSTOMER" if "CUSTOMER" in columns else ("CUSTOMER_CODE" if "CUSTOMER_CODE" in columns else None)
+
+    # --- Pedidos ---
+
+    def _build_orders(self):
+        df = self._raw
+        customer_col = self._customer_col()
+        if not all(col in df.columns for col in ORDER_REQUIRED_COLUMNS) or not customer_col:
+            raise PickingFormatError("El archivo CSV no tiene las columnas esperadas (Falta CUSTOMER o CUSTOMER_CODE).")
+
+        # Limpiar espacios en blanco en columnas clave y comas de miles en QTY
+        df = df.with_columns([
+            pl.col("ORDER_").cast(pl.Utf8).str.strip_chars(),
+            pl.col("DESPATCH_").cast(pl.Utf8).str.strip_chars(),
+            pl.col("QTY").cast(pl.Utf8).str.replace_all(',', '')
+        ]).filter(pl.col("ORDER_").is_not_null() & pl.col("DESPATCH_").is_not_null())
+
+        # Orden estable por clave: las líneas de un pedido quedan contiguas y en el orden del CSV
+        df = df.sort(["ORDER_", "DESPATCH_"], maintain_order=True)
+        bounds = (
+            df.select(["ORDER_", "DESPATCH_"]).with_row_index("offset")
+            .group_by(["ORDER_", "DESPATCH_"], maintain_order=True)
+            .agg(pl.col("offset").first(), pl.len().alias("length"))
+        )
+
+        rename_map = dict(ORDER_RENAME_MAP)
+        rename_map[customer_col] = "Customer Code"
+        self._orders = (
+            df.rename(rename_map)
+            .with_columns([
+                pl.col("Customer Code").cast(pl.Utf8).str.strip_chars(),
+                pl.col("Customer Name").cast(pl.Utf8).str.strip_chars()
+            ])
+            .fill_null("")
+        )
+        self._order_index = {
+            (row[0], row[1]): (row[2], row[3]) for row in bounds.iter_rows()
+        }
+
+    def get_order(self, order_number: str, despatch_number: str) -> Optional[pl.DataFrame]:
+        """Líneas del pedido (columnas renombradas) o None si no existe."""
+        self._ensure_loaded()
+        if self._orders is None:
+            self._build_orders()
+        span = self._order_index.get((str(order_number).strip(), str(despatch_number).strip()))
+        if span is None:
+            return None
+        return self._orders.slice(span[0], span[1])
+
+    def get_customer(self, order_number: str, despatch_number: str) -> Optional[Tuple[str, str]]:
+        """(código, nombre) del cliente de un pedido, o None si el pedido no está en el reporte."""
+        order_data = self.get_order(order_number, despatch_number)
+        if order_data is None or order_data.height == 0:
+            return None
+        return order_data[0, "Customer Code"], order_data[0, "Customer Name"]
+
+    # --- Seguimiento ---
+
+    def _build_tracking(self):
+        df = self._raw
+
+        # [CORRECCIÓN] Filtrar líneas vacías o nulas de ORDER_ antes de procesar
+        df = df.filter(
+            (pl.col("ORDER_").is_not_null()) &
+            (pl.col("ORDER_").cast(pl.Utf8).str.strip_chars() != "")
+        )
+
+        if not all(col in df.columns for col in TRACKING_REQUIRED_COLUMNS):
+            # Verificar si existe al menos CUSTOMER o CUSTOMER_CODE
+            if "CUSTOMER" not in df.columns and "CUSTOMER_CODE" not in df.columns:
+                raise PickingFormatError("El archivo CSV no tiene las columnas esperadas.")
+
+        # Identificar columna de cliente
+        customer_col = "CUSTOMER" if "CUSTOMER" in df.columns else "CUSTOMER_CODE"
+
+        # Limpiar datos clave antes de agrupar
+        df = df.with_columns([
+            pl.col("ORDER_").cast(pl.Utf8).str.strip_chars(),
+            pl.col("DESPATCH_").cast(pl.Utf8).str.strip_chars(),
+            pl.col(customer_col).cast(pl.Utf8).fill_null(""),
+            pl.col("CUSTOMER_NAME").cast(pl.Utf8).fill_null(""),
+            pl.col("PICK_LIST_PRINTED_TIME").cast(pl.Utf8).str.strip_chars().fill_null(""),
+            pl.col("Time_Zone_Hours").cast(pl.Utf8).str.strip_chars().fill_null("")
+        ])
+
+        # Agrupar por ORDER_ y DESPATCH_ para contar líneas y conservar hora local de impresión
+        grouped = df.group_by(["ORDER_", "DESPATCH_", customer_col, "CUSTOMER_NAME"]).agg([
+            pl.col("ORDER_").len().alias("total_lines"),
+            pl.col("PICK_LIST_PRINTED_TIME").filter(pl.col("PICK_LIST_PRINTED_TIME") != "").first().alias("print_time"),
+            pl.col("Time_Zone_Hours").filter(pl.col("Time_Zone_Hours") != "").first().alias("time_zone")
+        ])
+
+        tracking = []
+        for row in grouped.iter_rows(named=True):
+            order_num = str(row["ORDER_"] or "").strip()
+            despatch_num = str(row["DESPATCH_"] or "").strip()
+
+            if not order_num: # Doble validación preventiva
+                continue
+
+            tracking.append({
+                "order_number": order_num,
+                "despatch_number": despatch_num,
+                "customer_code": str(row[customer_col] or "").strip(),
+                "customer_name": str(row["CUSTOMER_NAME"] or "").strip(),
+                "total_lines": int(row["total_lines"]),
+                "print_date": format_local_print_time(row["print_time"], row["time_zone"]),
+            })
+        self._tracking = tracking
+
+    def get_tracking(self) -> List[dict]:
+        """Resumen por pedido (sin el estado de auditoría, que vive en la DB). No mutar los dicts."""
+        self._ensure_loaded()
+        if self._tracking is None:
+            self._build_tracking()
+        return self._tracking
+
+
+picking_store = PickingStore()
@@ -0,0 +1,373 @@
+"""
+Motor de conciliación incremental (Reporte 280 x Logs de Inbound).
+Mantiene el resultado materializado por Import Reference: cuando un log se agrega, edita
+o elimina solo se recalculan las I.R. afectadas. Un cambio en los GRN (280 o el mapa persistido
+GRN -> I.R.) invalida todo. Los demás workers se enteran de las I.R.
+modificadas por un diario compartido (una línea JSON por cambio).
+"""
+import asyncio
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import orjson
+import polars as pl
+from sqlalchemy import func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.sql_models import Log
+from app.services import csv_handler
+from app.services.grn_ir_map import grn_ir_map
+from app.core.config import CACHE_FOLDER, RECONCILIATION_DIRTY_JOURNAL_PATH
+
+JOURNAL_MAX_BYTES = 1024 * 1024  # Al superarlo se reinicia el diario (todos los workers recalculan completo)
+
+LOG_COLUMNS = ["importReference", "itemCode", "waybill", "qtyReceived", "binLocation", "relocatedBin", "timestamp"]
+_LOG_SCHEMA = {
+    "importReference": pl.Utf8, "itemCode": pl.Utf8, "waybill": pl.Utf8, "qtyReceived": pl.Int64,
+    "binLocation": pl.Utf8, "relocatedBin": pl.Utf8, "timestamp": pl.Utf8,
+}
+
+
+def ir_key(value: Optional[str]) -> Optional[str]:
+    """Normalización de la I.R. igual a la del cálculo (strip + mayúsculas)."""
+    return str(value).strip().upper() if value is not None else None
+
+
+# --- Cálculo (compartido por el modo completo y el incremental) ---
+
+def normalize_logs(logs: pl.DataFrame) -> pl.DataFrame:
+    """Normaliza los logs (ordenados por id descendente, como los entrega db_logs)."""
+    return logs.with_columns([
+        pl.col("importReference").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+        pl.col("itemCode").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+        pl.col("waybill").cast(pl.Utf8).fill_null(""),
+        pl.col("qtyReceived").cast(pl.Utf8).str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
+    ])
+
+
+async def load_grn_to_ir_map(db: AsyncSession) -> pl.DataFrame:
+    """
+    Mapa maestro GRN -> IR/Waybill (persistido; ver grn_ir_map).
+    Queremos saber a qué IR pertenece cada GRN para no duplicar filas.
+    """
+    return await grn_ir_map.get(db)
+
+
+def expected_lines(grn_pl: pl.DataFrame, df_grn_master: pl.DataFrame) -> pl.DataFrame:
+    """Líneas del Reporte 280 normalizadas y asociadas a su IR (basado en el GRN)."""
+    if "Order_Number" not in grn_pl.columns:
+        grn_pl = grn_pl.with_columns(pl.lit("").alias("Order_Number"))
+
+    # _line: posición en la 280, desempata líneas repetidas para que el orden sea determinista
+    df_280 = grn_pl.with_row_index("_line").select([
+        pl.col("_line"),
+        pl.col("GRN_Number").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+        pl.col("Item_Code").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
+        pl.col("Item_Description").cast(pl.Utf8).fill_null("No en sistema 280"),
+        pl.col("Quantity").cast(pl.Utf8).str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
+        pl.col("Order_Number").cast(pl.Utf8).str.strip_chars().str.to_uppercase().fill_null(""),
+    ])
+
+    # ASOCIACIÓN MEJORADA: 280 + IR (Basado en el GRN)
+    # Esto evita que una línea de la 280 se duplique si el item/orden aparece en varias IRs.
+    return df_280.join(
+        df_grn_master,
+        left_on="GRN_Number",
+        right_on="grn_map",
+        how="left"
+    ).with_columns([
+        pl.col("ir_map").fill_null("SIN I.R. MAESTRA"),
+        pl.col("wb_map").fill_null("SIN WAYBILL"),
+    ])
+
+
+def reconcile(logs_pl: pl.DataFrame, df_expected_with_ir: pl.DataFrame) -> pl.DataFrame:
+    """
+    Cruce 280 (ya asociado a IR) contra logs normalizados. Todas las agregaciones son por
+    (IR, Item), así que aplicarlo a un subconjunto de I.R. da las mismas filas que el cálculo completo.
+    """
+    # Agrupar logs por IR + Item (Ancla física)
+    logs_grouped = logs_pl.group_by(["importReference", "itemCode"]).agg([
+        pl.col("qtyReceived").sum().alias("qtyReceived"),
+        pl.col("waybill").first().alias("Waybill_Log")
+    ])
+
+    df_locations = logs_pl.group_by(["importReference", "itemCode"]).agg([
+        pl.col("binLocation").last().alias("binLocation"),
+        pl.col("relocatedBin").last().alias("relocatedBin"),
+    ])
+
+    # Cálculo de Totales Esperados por IR + Item
+    total_exp_ir_item = df_expected_with_ir.group_by(["ir_map", "Item_Code"]).agg(
+        pl.col("Quantity").sum().alias("Total_Esperado_IR")
+    )
+
+    # Join Final con Logs (Físico vs Sistema)
+    final = df_expected_with_ir.join(
+        total_exp_ir_item, on=["ir_map", "Item_Code"], how="left"
+    ).join(
+        logs_grouped,
+        left_on=["ir_map", "Item_Code"],
+        right_on=["importReference", "itemCode"],
+        how="left"
+    )
+
+    # Manejo de ítems "Invasores" (Recibidos en una IR pero no en el GRN de esa IR)
+    logs_sin_grn = logs_grouped.join(
+        df_expected_with_ir.select(["ir_map", "Item_Code"]).unique(),
+        left_on=["importReference", "itemCode"], right_on=["ir_map", "Item_Code"],
+        how="anti"
+    ).with_columns([
+        pl.col("importReference").alias("ir_map"),
+        pl.col("Waybill_Log").alias("wb_map"),
+        pl.lit("SIN GRN").alias("GRN_Number"),
+        pl.col("itemCode").alias("Item_Code"),
+        pl.lit("No en reporte 280").alias("Item_Description"),
+        pl.lit(0.0).alias("Quantity"),
+        pl.lit(0.0).alias("Total_Esperado_IR"),
+        pl.lit("").alias("Order_Number"),
+        pl.lit(None, dtype=pl.UInt32).alias("_line")
+    ])
+
+    # Unificar
+    common_cols = ["ir_map", "wb_map", "GRN_Number", "Item_Code", "Item_Description", "Quantity", "Order_Number", "Total_Esperado_IR", "qtyReceived", "_line"]
+    final = pl.concat([final.select(common_cols), logs_sin_grn.select(common_cols)], how="diagonal")
+
+    # Cálculos de Diferencia y Ubicaciones
+    final = final.with_columns([
+        pl.col("qtyReceived").fill_null(0.0),
+        (pl.col("qtyReceived") - pl.col("Total_Esperado_IR")).alias("Diferencia")
+    ]).with_columns([
+        pl.col("qtyReceived").cast(pl.Int64).alias("Cant_Recibida"),
+        pl.col("Quantity").cast(pl.Int64).alias("Cant_Linea"),
+    ])
+
+    final = final.join(df_locations, left_on=["ir_map", "Item_Code"], right_on=["importReference", "itemCode"], how="left").with_columns([
+        pl.col("binLocation").fill_null(""),
+        pl.col("relocatedBin").fill_null("")
+    ])
+
+    # Extraer el timestamp de los logs (el más reciente para el grupo)
+    df_timestamps = logs_pl.group_by(["importReference", "itemCode"]).agg([
+        pl.col("timestamp").last().alias("timestamp_log")
+    ])
+    final = final.join(df_timestamps, left_on=["ir_map", "Item_Code"], right_on=["importReference", "itemCode"], how="left")
+
+    # Ocultar diferencias duplicadas en la vista
+    final = final.sort(["ir_map", "Item_Code", "GRN_Number", "_line"], nulls_last=False)
+    final = final.with_columns([
+        pl.col("GRN_Number").cum_count().over(["ir_map", "Item_Code"]).alias("_row_num"),
+        pl.col("GRN_Number").count().over(["ir_map", "Item_Code"]).alias("_group_size"),
+    ]).with_columns(
+        Diferencia=pl.when(pl.col("_row_num") == pl.col("_group_size"))
+            .then(pl.col("Diferencia").cast(pl.Int64))
+            .otherwise(pl.lit(0, dtype=pl.Int64))
+    ).drop(["_row_num", "_group_size"])
+
+    # Resultado Final (orden determinista dentro de cada IR para que ambos modos coincidan)
+    final = final.sort(["ir_map", "GRN_Number", "Item_Code", "_line"], nulls_last=False)
+    return final.select([
+        pl.col("ir_map").alias("Import_Reference"),
+        pl.col("wb_map").alias("Waybill"),
+        pl.col("GRN_Number").alias("GRN"),
+        pl.col("Item_Code").alias("Codigo_Item"),
+        pl.col("Item_Description").alias("Descripcion"),
+        pl.col("binLocation").alias("Ubicacion"),
+        pl.col("relocatedBin").alias("Reubicado"),
+        pl.col("Cant_Linea").alias("Cant_Esperada"),
+        pl.col("Cant_Recibida"),
+        pl.col("Diferencia"),
+        pl.col("timestamp_log").alias("Timestamp")
+    ])
+
+
+# --- Resultado materializado por I.R. ---
+
+class ReconciliationEngine:
+    def __init__(self):
+        self._rows_by_ir: Dict[Optional[str], List[dict]] = {}
+        self._expected_by_ir: Dict[Optional[str], pl.DataFrame] = {}
+        self._expected_empty: Optional[pl.DataFrame] = None
+        self._irs_with_logs: Set[Optional[str]] = set()
+        self._grn_key = None
+        # Invalidación total: cada pedido sube _epoch; el estado vale si se construyó con el epoch vigente
+        self._epoch = 1
+        self._built_epoch = 0
+        self._dirty: Set[Optional[str]] = set()
+        self._payload: Optional[List[dict]] = None
+        self._journal_pos = None  # (inode, offset) leído del diario compartido
+        self._lock = asyncio.Lock()
+
+    # --- Hooks (llamados por db_logs y los borrados masivos) ---
+
+    def mark_dirty(self, *import_references: Optional[str]):
+        """Un log de estas I.R. cambió: recalcularlas en la próxima lectura (todos los workers)."""
+        keys = {ir_key(ir) for ir in import_references}
+        self._dirty |= keys
+        self._append_journal(sorted(keys, key=lambda k: (k is not None, k or "")))
+
+    def mark_all_dirty(self):
+        """Cambio masivo de logs (archivado, borrado): recálculo completo en todos los workers."""
+        self._epoch += 1
+        self._append_journal(None)
+
+    # --- Diario compartido ---
+
+    def _append_journal(self, keys: Optional[List[Optional[str]]]):
+        try:
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            with open(RECONCILIATION_DIRTY_JOURNAL_PATH, 'ab') as f:
+                f.write(orjson.dumps(keys) + b"\n")
+                size = f.tell()
+            if size > JOURNAL_MAX_BYTES:
+                tmp_path = f"{RECONCILIATION_DIRTY_JOURNAL_PATH}.{os.getpid()}.tmp"
+                open(tmp_path, 'wb').close()
+                os.replace(tmp_path, RECONCILIATION_DIRTY_JOURNAL_PATH)
+        except OSError as e:
+            print(f"⚠️ No se pudo publicar el cambio de conciliación: {e}")
+
+    def _consume_journal(self):
+        try:
+            with open(RECONCILIATION_DIRTY_JOURNAL_PATH, 'rb') as f:
+                st = os.fstat(f.fileno())
+                seen = self._journal_pos
+                if seen is None or seen[0] != st.st_ino or seen[1] > st.st_size:
+                    # Primera lectura o diario reiniciado: no se sabe qué cambió
+                    if seen is not None:
+                        self._epoch += 1
+                    self._journal_pos = (st.st_ino, st.st_size)
+                    return
+                f.seek(seen[1])
+                data = f.read()
+        except OSError:
+            return
+
+        # Solo líneas completas; una escritura en curso se lee la próxima vez
+        complete = data[:data.rfind(b"\n") + 1]
+        self._journal_pos = (self._journal_pos[0], self._journal_pos[1] + len(complete))
+        for line in complete.splitlines():
+            try:
+                keys = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            if keys is None:
+                self._epoch += 1
+            else:
+                self._dirty.update(keys)
+
+    # --- Carga de logs ---
+
+    async def _load_logs(self, db: AsyncSession, irs: Optional[Iterable[Optional[str]]] = None) -> pl.DataFrame:
+        """Logs activos (todos o de las I.R. indicadas), ordenados por id descendente como db_logs."""
+        from app.services import db_logs  # db_logs importa este módulo
+        conditions = [or_(Log.archived_at.is_(None), Log.archived_at == '')]
+        if irs is not None:
+            keys = [k for k in irs if k is not None]
+            by_ir = [func.upper(func.trim(Log.importReference)).in_(keys)] if keys else []
+            if None in irs:
+                by_ir.append(Log.importReference.is_(None))
+            if not by_ir:
+                return normalize_logs(pl.DataFrame(schema=_LOG_SCHEMA))
+            conditions.append(or_(*by_ir))
+        return normalize_logs(await db_logs.stream_log_frame_async(db, *conditions, columns=LOG_COLUMNS))
+
+    # --- Construcción ---
+
+    def _store(self, result: pl.DataFrame, logs_pl: pl.DataFrame, irs: Optional[Set[Optional[str]]] = None):
+        """Reemplaza las filas materializadas de `irs` (o de todas) con el resultado calculado."""
+        by_ir: Dict[Optional[str], List[dict]] = {}
+        for row in result.to_dicts():
+            by_ir.setdefault(row["Import_Reference"], []).append(row)
+        with_logs = set(logs_pl.get_column("importReference").unique().to_list())
+
+        if irs is None:
+            self._rows_by_ir, self._irs_with_logs = by_ir, with_logs
+        else:
+            for ir in irs:
+                rows = by_ir.get(ir)
+                if rows:
+                    self._rows_by_ir[ir] = rows
+                else:
+                    self._rows_by_ir.pop(ir, None)
+            self._irs_with_logs = (self._irs_with_logs - irs) | with_logs
+        self._payload = None
+
+    async def _full_build(self, db: AsyncSession, grn_pl: Optional[pl.DataFrame], grn_map: pl.DataFrame, grn_key):
+        epoch = self._epoch
+        self._dirty.clear()
+        if grn_pl is None:
+            self._expected_by_ir, self._expected_empty = {}, None
+            self._rows_by_ir, self._irs_with_logs, self._payload = {}, set(), None
+        else:
+            expected = expected_lines(grn_pl, grn_map)
+            self._expected_empty = expected.clear()
+            self._expected_by_ir = {
+                key[0]: part for key, part in expected.partition_by("ir_map", as_dict=True, maintain_order=True).items()
+            }
+            logs_pl = await self._load_logs(db)
+            self._store(reconcile(logs_pl, expected), logs_pl)
+        self._grn_key = grn_key
+        # Un mark_all_dirty llegado durante la construcción obliga a repetirla en la próxima lectura
+        self._built_epoch = epoch
+
+    async def _recompute(self, db: AsyncSession, irs: Set[Optional[str]]):
+        if self._expected_empty is None:
+            return
+        logs_pl = await self._load_logs(db, irs)
+        parts = [self._expected_by_ir[ir] for ir in irs if ir in self._expected_by_ir]
+        expected = pl.concat(parts) if parts else self._expected_empty
+        self._store(reconcile(logs_pl, expected), logs_pl, irs)
+
+    def _assemble(self) -> List[dict]:
+        if self._payload is None:
+            if not self._irs_with_logs:
+                # Igual que el cálculo completo: sin logs activos no hay conciliación
+                self._payload = []
+            else:
+                keys = sorted(self._rows_by_ir, key=lambda k: (k is not None, k or ""))
+                self._payload = [row for key in keys for row in self._rows_by_ir[key]]
+        return self._payload
+
+    async def get_rows(self, db: AsyncSession) -> List[Dict[str, Any]]:
+        """Conciliación de los logs activos (solo lectura; no mutar las filas retornadas)."""
+        await csv_handler.reload_cache_if_needed()
+        async with self._lock:
+            self._consume_journal()
+            # Huella de las fuentes GRN: generación de la 280 + versión del mapa GRN -> I.R.
+            grn_map = await grn_ir_map.get(db)
+            grn_key = (csv_handler.cache_generation, grn_ir_map.version)
+            if self._built_epoch != self._epoch or grn_key != self._grn_key:
+                await self._full_build(db, csv_handler.df_grn_cache, grn_map, grn_key)
+            elif self._dirty:
+                irs, self._dirty = self._dirty, set()
+                await self._recompute(db, irs)
+            return self._assemble()
+
+    async def verify_consistency(self, db: AsyncSession) -> int:
+        """
+        Modo verificación: recalcula todo desde cero, lo compara con el resultado materializado
+        y, si difieren, reemplaza el estado. Retorna cuántas filas diferían.
+        """
+        current = await self.get_rows(db)
+        async with self._lock:
+            grn_pl = csv_handler.df_grn_cache
+            if grn_pl is None:
+                truth = []
+            else:
+                logs_pl = await self._load_logs(db)
+                truth = reconcile(logs_pl, expected_lines(grn_pl, await load_grn_to_ir_map(db))).to_dicts() if logs_pl.height else []
+
+            def as_keys(rows):
+                return sorted(orjson.dumps(row, option=orjson.OPT_SORT_KEYS) for row in rows)
+            current_keys, truth_keys = as_keys(current), as_keys(truth)
+            drift = 0
+            if current_keys != truth_keys:
+                drift = len(set(current_keys) ^ set(truth_keys)) or abs(len(current_keys) - len(truth_keys))
+                print(f"⚠️ [RECONCILIATION] {drift} filas con deriva respecto al cálculo completo; estado reconstruido")
+                self._epoch += 1
+        if drift:
+            await self.get_rows(db)
+        return drift
+
+
+reconciliation_engine = ReconciliationEngine()
@@ -3,252 +3,317 @@ Servicio para la lógica de conciliación de Inbound y snapshots optimizado con
 Unifica la lógica de la vista web y la exportación de Excel, respetando las líneas individuales del Reporte 280.
 """
 import datetime
-import orjson
-import os
+import io
+import time
+from typing import List, Optional, Dict, Any, Tuple
 import polars as pl
-from typing import List, Optional, Dict, Any
-from sqlalchemy import select, func, text
+from fastapi import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.services import db_logs, csv_handler
-from app.models.sql_models import ReconciliationHistory, GRNMaster
-from app.core.config import PO_LOOKUP_JSON_PATH, GRN_JSON_DATA_PATH
+from app.services.reconciliation_engine import (
+    reconciliation_engine, normalize_logs, load_grn_to_ir_map, expected_lines, reconcile, LOG_COLUMNS
+)
+from app.services.job_registry import job_registry
+from app.models.sql_models import ReconciliationHistory, ReconciliationSnapshot
 
-async def get_reconciliation_calculations(db: AsyncSession, archive_date: Optional[str] = None) -> List[Dict[str, Any]]:
+# Columnas de un snapshot (mismos nombres que reconciliation_history) y nivel de compresión del blob
+SNAPSHOT_SCHEMA = {
+    "import_reference": pl.Utf8, "waybill": pl.Utf8, "grn": pl.Utf8, "item_code": pl.Utf8,
+    "description": pl.Utf8, "bin_location": pl.Utf8, "relocated_bin": pl.Utf8,
+    "qty_expected": pl.Int64, "qty_received": pl.Int64, "difference": pl.Int64,
+    "username": pl.Utf8, "timestamp": pl.Utf8,
+}
+SNAPSHOT_ZSTD_LEVEL = 9
+SNAPSHOT_PURGE_BATCH_SIZE = 20   # Blobs por lectura al purgar GRN (cada uno es un lote completo de filas)
+
+async def get_reconciliation_calculations(db: AsyncSession, archive_date: Optional[str] = None, full: bool = False) -> List[Dict[str, Any]]:
     """
     Ejecuta los cálculos de conciliación cruzando el Reporte 280 con los Logs de Inbound.
     Valida la integridad usando la tríada: IR + Item + Order Number (Customer Ref).
+    Los logs activos se sirven desde el resultado materializado por I.R. (solo lectura);
+    `full=True` recalcula todo desde cero (modo verificación) y los archivados siempre se calculan completos.
     """
     try:
+        if archive_date is None and not full:
+            return await reconciliation_engine.get_rows(db)
+
         await csv_handler.reload_cache_if_needed()
         
         # 1. Obtener Logs (Lo recibido físicamente)
-        logs_list = await (db_logs.load_archived_log_data_db_async(db, archive_date) if archive_date else db_logs.load_log_data_db_async(db))
-        if not logs_list:
+        logs_frame = await (
+            db_logs.load_archived_log_frame_async(db, archive_date, columns=LOG_COLUMNS) if archive_date
+            else db_logs.load_log_frame_async(db, columns=LOG_COLUMNS)
+        )
+        if logs_frame.height == 0:
             print("⚠️ [RECONCILIATION] No hay registros de log para procesar.")
             return []
 
-        logs_pl = pl.from_dicts(logs_list)
-
         # 2. Normalizar Logs
-        logs_pl = logs_pl.with_columns([
-            pl.col("importReference").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
-            pl.col("itemCode").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
-            pl.col("waybill").cast(pl.Utf8).fill_null(""),
-            pl.col("qtyReceived").cast(pl.Utf8).str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
-        ])
+        logs_pl = normalize_logs(logs_frame)
 
-        # Agrupar logs por IR + Item (Ancla física)
-        logs_grouped = logs_pl.group_by(["importReference", "itemCode"]).agg([
-            pl.col("qtyReceived").sum().alias("qtyReceived"),
-            pl.col("waybill").first().alias("Waybill_Log")
-        ])
-
-        df_locations = logs_pl.group_by(["importReference", "itemCode"]).agg([
-            pl.col("binLocation").last().alias("binLocation"),
-            pl.col("relocatedBin").last().alias("relocatedBin"),
-        ])
+        # 3. Mapa Maestro de GRN -> IR/Waybill
+        df_grn_master = await load_grn_to_ir_map(db)
 
-        # 3. Construir Mapa Maestro de GRN -> IR/Waybill
-        # Queremos saber a qué IR pertenece cada GRN para no duplicar filas.
-        grn_to_ir_list = []
-
-        # A. Desde grn_master_data.json
-        if os.path.exists(GRN_JSON_DATA_PATH):
-            try:
-                with open(GRN_JSON_DATA_PATH, 'rb') as f:
-                    for row in orjson.loads(f.read()):
-                        ir  = str(row.get("Import_Reference", row.get("import_reference", ""))).strip().upper()
-                        grn = str(row.get("GRN_Number",       row.get("grn_number",       ""))).strip().upper()
-                        if ir and grn:
-                            grn_to_ir_list.append({"grn_map": grn, "ir_map": ir, "wb_map": str(row.get("Waybill", ""))})
-            except: pass
-
-        # B. Desde DB GRN Master
-        try:
-            db_grns = await db.execute(select(GRNMaster))
-            for g_master in db_grns.scalars().all():
-                ir = str(g_master.import_reference).strip().upper()
-                if ir and g_master.grn_number:
-                    for g in str(g_master.grn_number).split(','):
-                        if g.strip():
-                            grn_to_ir_list.append({"grn_map": g.strip().upper(), "ir_map": ir, "wb_map": str(g_master.waybill or "")})
-        except: pass
-
-        # C. Desde po_lookup.json (Si el robot ya encontró el GRN)
-        if os.path.exists(PO_LOOKUP_JSON_PATH):
-            try:
-                with open(PO_LOOKUP_JSON_PATH, 'rb') as f:
-                    po_cache = orjson.loads(f.read())
-                    for wb, data in po_cache.get("wb_to_data", {}).items():
-                        ir = str(data.get("import_ref", "")).strip().upper()
-                        for item in data.get("items", []):
-                            grn_val = str(item.get("grn", "")).strip().upper()
-                            if grn_val and ir:
-                                for g in grn_val.split(','):
-                                    if g.strip():
-                                        grn_to_ir_list.append({"grn_map": g.strip().upper(), "ir_map": ir, "wb_map": str(wb)})
-            except: pass
-
-        df_grn_master = pl.DataFrame(grn_to_ir_list).unique(subset=["grn_map"]) if grn_to_ir_list else pl.DataFrame(schema={"grn_map": pl.Utf8, "ir_map": pl.Utf8, "wb_map": pl.Utf8})
-
-        # 4. Normalizar Reporte 280
+        # 4-5. Reporte 280 normalizado y asociado a su IR
         grn_pl = csv_handler.df_grn_cache
         if grn_pl is None: return []
-        if "Order_Number" not in grn_pl.columns:
-            grn_pl = grn_pl.with_columns(pl.lit("").alias("Order_Number"))
-
-        df_280 = grn_pl.select([
-            pl.col("GRN_Number").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
-            pl.col("Item_Code").cast(pl.Utf8).str.strip_chars().str.to_uppercase(),
-            pl.col("Item_Description").cast(pl.Utf8).fill_null("No en sistema 280"),
-            pl.col("Quantity").cast(pl.Utf8).str.replace_all(",", "").cast(pl.Float64, strict=False).fill_null(0.0),
-            pl.col("Order_Number").cast(pl.Utf8).str.strip_chars().str.to_uppercase().fill_null(""),
-        ])
+        df_expected_with_ir = expected_lines(grn_pl, df_grn_master)
 
-        # 5. ASOCIACIÓN MEJORADA: 280 + IR (Basado en el GRN)
-        # Esto evita que una línea de la 280 se duplique si el item/orden aparece en varias IRs.
-        df_expected_with_ir = df_280.join(
-            df_grn_master,
-            left_on="GRN_Number",
-            right_on="grn_map",
-            how="left"
-        ).with_columns([
-            pl.col("ir_map").fill_null("SIN I.R. MAESTRA"),
-            pl.col("wb_map").fill_null("SIN WAYBILL"),
-        ])
+        # 6-10. Cruce físico vs sistema
+        return reconcile(logs_pl, df_expected_with_ir).to_dicts()
 
-        # 6. Cálculo de Totales Esperados por IR + Item
-        total_exp_ir_item = df_expected_with_ir.group_by(["ir_map", "Item_Code"]).agg(
-            pl.col("Quantity").sum().alias("Total_Esperado_IR")
-        )
+    except Exception as e:
+        import traceback
+        print(f"❌ [RECONCILIATION ERROR]: {e}")
+        print(traceback.format_exc())
+        return []
 
-        # 7. Join Final con Logs (Físico vs Sistema)
-        final = df_expected_with_ir.join(
-            total_exp_ir_item, on=["ir_map", "Item_Code"], how="left"
-        ).join(
-            logs_grouped,
-            left_on=["ir_map", "Item_Code"],
-            right_on=["importReference", "itemCode"],
-            how="left"
-        )
+# --- Exportación a Excel (endpoint directo y trabajos de exportación) ---
 
-        # 8. Manejo de ítems "Invasores" (Recibidos en una IR pero no en el GRN de esa IR)
-        logs_sin_grn = logs_grouped.join(
-            df_expected_with_ir.select(["ir_map", "Item_Code"]).unique(),
-            left_on=["importReference", "itemCode"], right_on=["ir_map", "Item_Code"],
-            how="anti"
-        ).with_columns([
-            pl.col("importReference").alias("ir_map"),
-            pl.col("Waybill_Log").alias("wb_map"),
-            pl.lit("SIN GRN").alias("GRN_Number"),
-            pl.col("itemCode").alias("Item_Code"),
-            pl.lit("No en reporte 280").alias("Item_Description"),
-            pl.lit(0.0).alias("Quantity"),
-            pl.lit(0.0).alias("Total_Esperado_IR"),
-            pl.lit("").alias("Order_Number")
-        ])
+async def build_export_frame(db: AsyncSession, timezone_offset: int = 0, archive_date: Optional[str] = None, snapshot_date: Optional[str] = None) -> pl.DataFrame:
+    """Reporte de conciliación con las columnas del Excel (snapshot, archivado o vigente). Vacío si no hay datos."""
+    if snapshot_date:
+        snapshot_df = await load_snapshot(db, snapshot_date)
+        if snapshot_df.height == 0:
+            return pl.DataFrame()
 
-        # Unificar
-        common_cols = ["ir_map", "wb_map", "GRN_Number", "Item_Code", "Item_Description", "Quantity", "Order_Number", "Total_Esperado_IR", "qtyReceived"]
-        final = pl.concat([final.select(common_cols), logs_sin_grn.select(common_cols)], how="diagonal")
-
-        # 9. Cálculos de Diferencia y Ubicaciones
-        final = final.with_columns([
-            pl.col("qtyReceived").fill_null(0.0),
-            (pl.col("qtyReceived") - pl.col("Total_Esperado_IR")).alias("Diferencia")
-        ]).with_columns([
-            pl.col("qtyReceived").cast(pl.Int64).alias("Cant_Recibida"),
-            pl.col("Quantity").cast(pl.Int64).alias("Cant_Linea"),
-        ])
+        def _snapshot_date(ts):
+            if not ts: return ''
+            return (datetime.datetime.fromisoformat(str(ts).replace('Z', '')) - datetime.timedelta(minutes=timezone_offset)).strftime('%d/%m/%Y %H:%M')
 
-        final = final.join(df_locations, left_on=["ir_map", "Item_Code"], right_on=["importReference", "itemCode"], how="left").with_columns([
-            pl.col("binLocation").fill_null(""),
-            pl.col("relocatedBin").fill_null("")
+        return snapshot_df.select([
+            pl.col("import_reference").alias("I.R."),
+            pl.col("waybill").alias("Waybill"),
+            pl.col("grn").alias("GRN"),
+            pl.col("item_code").alias("Código Item"),
+            pl.col("description").alias("Descripción"),
+            pl.col("bin_location").fill_null('').alias("Ubicación"),
+            pl.col("relocated_bin").fill_null('').alias("Reubicado"),
+            pl.col("qty_expected").fill_null(0).alias("Cant. Esperada"),
+            pl.col("qty_received").fill_null(0).alias("Cant. Recibida"),
+            pl.col("difference").fill_null(0).alias("Diferencia"),
+            pl.col("timestamp").map_elements(_snapshot_date, return_dtype=pl.Utf8).fill_null('').alias("Fecha")
         ])
 
-        # Extraer el timestamp de los logs (el más reciente para el grupo)
-        df_timestamps = logs_pl.group_by(["importReference", "itemCode"]).agg([
-            pl.col("timestamp").last().alias("timestamp_log")
-        ])
-        final = final.join(df_timestamps, left_on=["ir_map", "Item_Code"], right_on=["importReference", "itemCode"], how="left")
-
-        # Ocultar diferencias duplicadas en la vista
-        final = final.sort(["ir_map", "Item_Code", "GRN_Number"])
-        final = final.with_columns([
-            pl.col("GRN_Number").cum_count().over(["ir_map", "Item_Code"]).alias("_row_num"),
-            pl.col("GRN_Number").count().over(["ir_map", "Item_Code"]).alias("_group_size"),
-        ]).with_columns(
-            Diferencia=pl.when(pl.col("_row_num") == pl.col("_group_size"))
-                .then(pl.col("Diferencia").cast(pl.Int64))
-                .otherwise(pl.lit(0, dtype=pl.Int64))
-        ).drop(["_row_num", "_group_size"])
-
-        # 10. Resultado Final
-        return final.select([
-            pl.col("ir_map").alias("Import_Reference"),
-            pl.col("wb_map").alias("Waybill"),
-            pl.col("GRN_Number").alias("GRN"),
-            pl.col("Item_Code").alias("Codigo_Item"),
-            pl.col("Item_Description").alias("Descripcion"),
-            pl.col("binLocation").alias("Ubicacion"),
-            pl.col("relocatedBin").alias("Reubicado"),
-            pl.col("Cant_Linea").alias("Cant_Esperada"),
-            pl.col("Cant_Recibida"),
-            pl.col("Diferencia"),
-            pl.col("timestamp_log").alias("Timestamp")
-        ]).sort(["Import_Reference", "GRN"]).to_dicts()
+    result_data = await get_reconciliation_calculations(db, archive_date)
+    if not result_data:
+        return pl.DataFrame()
 
-    except Exception as e:
-        import traceback
-        print(f"❌ [RECONCILIATION ERROR]: {e}")
-        print(traceback.format_exc())
-        return []
+    # Ajustar la zona horaria en la columna Fecha
+    def _adjust_tz(val):
+        if not val: return ""
+        try:
+            clean_ts = str(val).replace(' ', 'T').replace('Z', '')
+            dt = datetime.datetime.fromisoformat(clean_ts)
+            local_dt = dt - datetime.timedelta(minutes=timezone_offset)
+            return local_dt.strftime('%d/%m/%Y %H:%M')
+        except:
+            return str(val)
 
-async def create_snapshot(db: AsyncSession, data: List[dict], username: str, is_auto: bool = False, client_timestamp: Optional[str] = None):
-    """Guarda un snapshot de conciliación en la DB."""
+    return pl.DataFrame(result_data, infer_schema_length=None).select([
+        pl.col("Import_Reference").alias("I.R."),
+        pl.col("Waybill").alias("Waybill"),
+        pl.col("GRN").alias("GRN"),
+        pl.col("Codigo_Item").alias("Código Item"),
+        pl.col("Descripcion").alias("Descripción"),
+        pl.col("Ubicacion").alias("Ubicación"),
+        pl.col("Reubicado").alias("Reubicado"),
+        pl.col("Cant_Esperada").alias("Cant. Esperada"),
+        pl.col("Cant_Recibida").alias("Cant. Recibida"),
+        pl.col("Diferencia").alias("Diferencia"),
+        pl.col("Timestamp").map_elements(_adjust_tz, return_dtype=pl.Utf8).alias("Fecha"),
+    ])
+
+def export_file_info(timezone_offset: int = 0, snapshot_date: Optional[str] = None) -> Tuple[str, str]:
+    """(hoja, nombre de archivo) del Excel de conciliación; el vigente lleva la hora local del cliente."""
+    if snapshot_date:
+        return 'SnapshotConciliacion', f"snapshot_reconciliacion_{snapshot_date.replace(':', '-')}.xlsx"
+    client_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=timezone_offset)
+    return 'ReporteDeConciliacion', f"reporte_conciliacion_{client_time.strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+def _snapshot_archive_date(is_auto: bool, base_time_str: str) -> str:
+    """ID del lote legible (AUTO- para los automáticos) a partir del timestamp base."""
     prefix = "AUTO-" if is_auto else ""
-    
-    # Priorizar el timestamp del cliente si viene (ej: para respetar la hora de la bodega)
-    base_time_str = client_timestamp if client_timestamp else datetime.datetime.now().isoformat()
-    
     try:
         # Formatear el archive_date (ID del lote) para que sea legible
         dt_obj = datetime.datetime.fromisoformat(base_time_str.replace('Z', ''))
-        archive_date = f"{prefix}{dt_obj.strftime('%Y-%m-%d %H:%M:%S')}"
+        return f"{prefix}{dt_obj.strftime('%Y-%m-%d %H:%M:%S')}"
     except:
-        archive_date = f"{prefix}{base_time_str}"
+        return f"{prefix}{base_time_str}"
+
+def encode_snapshot(frame: pl.DataFrame) -> bytes:
+    """Filas del snapshot -> blob Parquet zstd (el diccionario por columna deduplica descripciones, bines y waybills)."""
+    buffer = io.BytesIO()
+    frame.write_parquet(buffer, compression="zstd", compression_level=SNAPSHOT_ZSTD_LEVEL, statistics=False)
+    return buffer.getvalue()
+
+def decode_snapshot(payload: bytes) -> pl.DataFrame:
+    return pl.read_parquet(io.BytesIO(payload))
 
-    records = [
-        ReconciliationHistory(
+def _snapshot_frame(data: List[dict], username: str, base_time_str: str) -> pl.DataFrame:
+    columns = {
+        "import_reference": [row.get('Import_Reference', '') for row in data],
+        "waybill": [row.get('Waybill', '') for row in data],
+        "grn": [row.get('GRN', '') for row in data],
+        "item_code": [row.get('Codigo_Item', '') for row in data],
+        "description": [row.get('Descripcion', '') for row in data],
+        "bin_location": [row.get('Ubicacion', '') or '' for row in data],
+        "relocated_bin": [row.get('Reubicado', '') or '' for row in data],
+        "qty_expected": [int(row.get('Cant_Esperada') or 0) for row in data],
+        "qty_received": [int(row.get('Cant_Recibida') or 0) for row in data],
+        "difference": [int(row.get('Diferencia') or 0) for row in data],
+        "username": [username] * len(data),
+        "timestamp": [row.get('Timestamp') or base_time_str for row in data],
+    }
+    # strict=False: un GRN numérico (el modelo acepta Any) se guarda como texto
+    return pl.DataFrame(columns, schema=SNAPSHOT_SCHEMA, strict=False)
+
+async def create_snapshot(db: AsyncSession, data: List[dict], username: str, is_auto: bool = False, client_timestamp: Optional[str] = None):
+    """
+    Guarda un snapshot de conciliación en la DB.
+    Todas las filas del lote se guardan como un único blob Parquet comprimido en reconciliation_snapshots.
+    """
+    # Priorizar el timestamp del cliente si viene (ej: para respetar la hora de la bodega)
+    base_time_str = client_timestamp if client_timestamp else datetime.datetime.now().isoformat()
+    archive_date = _snapshot_archive_date(is_auto, base_time_str)
+
+    frame = _snapshot_frame(data, username, base_time_str)
+    payload = await run_in_threadpool(encode_snapshot, frame)
+    try:
+        db.add(ReconciliationSnapshot(
             archive_date=archive_date,
-            import_reference=row.get('Import_Reference', ''),
-            waybill=row.get('Waybill', ''),
-            grn=row.get('GRN', ''),
-            item_code=row.get('Codigo_Item', ''),
-            description=row.get('Descripcion', ''),
-            bin_location=row.get('Ubicacion', '') or '',
-            relocated_bin=row.get('Reubicado', '') or '',
-            qty_expected=int(row.get('Cant_Esperada', 0)),
-            qty_received=int(row.get('Cant_Recibida', 0)),
-            difference=int(row.get('Diferencia', 0)),
             username=username,
-            timestamp=row.get('Timestamp') or base_time_str
-        ) for row in data
-    ]
-    
-    db.add_all(records)
-    await db.commit()
+            row_count=frame.height,
+            payload=payload
+        ))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
     return archive_date
 
+async def get_snapshot_versions(db: AsyncSession) -> List[str]:
+    """archive_date de todos los snapshots (comprimidos y los antiguos por filas), del más reciente al más antiguo."""
+    blobs = await db.execute(select(ReconciliationSnapshot.archive_date).distinct())
+    legacy = await db.execute(select(ReconciliationHistory.archive_date).distinct())
+    return sorted(set(blobs.scalars().all()) | set(legacy.scalars().all()), reverse=True)
+
+async def load_snapshot(db: AsyncSession, archive_date: str) -> pl.DataFrame:
+    """
+    Filas de un snapshot con las columnas de reconciliation_history (SNAPSHOT_SCHEMA).
+    Lee los blobs del lote; los snapshots anteriores al formato comprimido se leen de la tabla por filas.
+    """
+    res = await db.execute(
+        select(ReconciliationSnapshot.payload)
+        .where(ReconciliationSnapshot.archive_date == archive_date)
+        .order_by(ReconciliationSnapshot.id)
+    )
+    frames = [decode_snapshot(payload) for payload in res.scalars().all()]
+    if frames:
+        return pl.concat(frames)
+
+    columns = list(SNAPSHOT_SCHEMA)
+    res = await db.execute(
+        select(*[getattr(ReconciliationHistory, c) for c in columns])
+        .where(ReconciliationHistory.archive_date == archive_date)
+        .order_by(ReconciliationHistory.id)
+    )
+    rows = res.all()
+    return pl.DataFrame(dict(zip(columns, zip(*rows))) if rows else None, schema=SNAPSHOT_SCHEMA, strict=False)
+
+def _purge_blobs(rows: List[Tuple[int, bytes]], targets: List[str]) -> List[Tuple[int, int, Optional[bytes], int]]:
+    """
+    Quita de cada blob las filas de los GRN indicados (bloqueante: decodifica y recomprime zstd).
+    Retorna solo los blobs afectados: (id, filas quitadas, nuevo blob o None si quedó vacío, filas restantes).
+    """
+    changed = []
+    for snapshot_id, payload in rows:
+        frame = decode_snapshot(payload)
+        # Las filas sin GRN se conservan: is_in sobre un nulo da nulo y el filtro lo descartaría
+        kept = frame.filter(~pl.col("grn").str.strip_chars().str.to_uppercase().is_in(targets).fill_null(False))
+        if kept.height == frame.height:
+            continue
+        changed.append((snapshot_id, frame.height - kept.height, encode_snapshot(kept) if kept.height else None, kept.height))
+    return changed
+
+async def purge_snapshot_grns(db: AsyncSession, grns: List[str]) -> int:
+    """
+    Quita de los snapshots las filas de los GRN indicados (eliminación masiva de GRN).
+    Reescribe solo los blobs afectados; no hace commit. Retorna cuántas filas se quitaron.
+    Los blobs se leen por lotes de SNAPSHOT_PURGE_BATCH_SIZE y se procesan en el threadpool.
+    """
+    await db.execute(delete(ReconciliationHistory).where(ReconciliationHistory.grn.in_(grns)))
+    targets = [str(g).strip().upper() for g in grns]
+    removed = 0
+    ids = (await db.execute(select(ReconciliationSnapshot.id).order_by(ReconciliationSnapshot.id))).scalars().all()
+    for start in range(0, len(ids), SNAPSHOT_PURGE_BATCH_SIZE):
+        res = await db.execute(
+            select(ReconciliationSnapshot.id, ReconciliationSnapshot.payload)
+            .where(ReconciliationSnapshot.id.in_(ids[start:start + SNAPSHOT_PURGE_BATCH_SIZE]))
+        )
+        for snapshot_id, removed_rows, payload, row_count in await run_in_threadpool(_purge_blobs, res.all(), targets):
+            removed += removed_rows
+            if payload is not None:
+                await db.execute(
+                    update(ReconciliationSnapshot).where(ReconciliationSnapshot.id == snapshot_id)
+                    .values(payload=payload, row_count=row_count)
+                )
+            else:
+                await db.execute(delete(ReconciliationSnapshot).where(ReconciliationSnapshot.id == snapshot_id))
+    return removed
+
+def _auto_snapshot_user(username) -> str:
+    user_str = username if isinstance(username, str) else getattr(username, 'username', str(username))
+    return f"AUTO({user_str})"
+
 async def auto_snapshot_before_update(db: AsyncSession, username: str):
     """Realiza un snapshot automático si hay datos pendientes de conciliación."""
     try:
         current_data = await get_reconciliation_calculations(db)
         if current_data and len(current_data) > 0:
-            user_str = username if isinstance(username, str) else getattr(username, 'username', str(username))
-            return await create_snapshot(db, current_data, f"AUTO({user_str})", is_auto=True)
+            return await create_snapshot(db, current_data, _auto_snapshot_user(username), is_auto=True)
         return None
     except Exception as e:
         print(f"❌ Error en snapshot automático: {e}")
         return None
+
+async def run_snapshot_job(job_id: str, data: List[dict], username: str, is_auto: bool, client_timestamp: str):
+    """Escribe un snapshot con su propia sesión y deja el resultado en el registro de trabajos."""
+    from app.core.db import AsyncSessionLocal
+    job_registry.update(job_id, status="running", message=f"Guardando {len(data)} filas...")
+    start = time.time()
+    try:
+        async with AsyncSessionLocal() as session:
+            archive_date = await create_snapshot(session, data, username, is_auto=is_auto, client_timestamp=client_timestamp)
+        job_registry.update(
+            job_id, status="success", message=f"Snapshot {archive_date} guardado.",
+            result={"archive_date": archive_date, "rows": len(data)}
+        )
+        print(f"✅ [SNAPSHOT] {archive_date}: {len(data)} filas en {time.time() - start:.2f}s")
+    except Exception as e:
+        print(f"❌ Error en snapshot en segundo plano: {e}")
+        job_registry.update(job_id, status="error", message=str(e))
+
+async def schedule_auto_snapshot(db: AsyncSession, username: str, background_tasks: BackgroundTasks) -> Optional[Dict[str, str]]:
+    """
+    Variante no bloqueante de auto_snapshot_before_update: la conciliación se toma ahora
+    (antes de reemplazar la 280) y solo la escritura queda como trabajo en segundo plano.
+    Retorna {"archive_date", "job_id"} o None si no hay nada que guardar.
+    """
+    try:
+        current_data = await get_reconciliation_calculations(db)
+        if not current_data:
+            return None
+        base_time_str = datetime.datetime.now().isoformat()
+        archive_date = _snapshot_archive_date(True, base_time_str)
+        job = job_registry.create("reconciliation_snapshot", message="En cola", archive_date=archive_date)
+        background_tasks.add_task(
+            run_snapshot_job, job["id"], current_data, _auto_snapshot_user(username), True, base_time_str
+        )
+        return {"archive_date": archive_date, "job_id": job["id"]}
+    except Exception as e:
+        print(f"❌ Error programando snapshot automático: {e}")
+        return None
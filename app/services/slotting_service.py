@@ -1,15 +1,104 @@
+import heapq
 import orjson
 import os
+from bisect import bisect_left, bisect_right
 
 from typing import Optional, Dict, Any, List
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, and_
-from app.models.sql_models import MasterItem, Log, BinLocation, SlottingRule
+from app.models.sql_models import Log, BinLocation, SlottingRule
 from app.core.config import SLOTTING_PARAMS_PATH
+from app.services.occupancy_service import occupancy_service
+
+def _parse_int_list(value: Any, default: str) -> List[int]:
+    return [int(lvl.strip()) for lvl in str(value if value is not None else default).split(",") if lvl.strip().isdigit()]
+
+def _parse_level(value: Any) -> Any:
+    """Normaliza el nivel a int (SQL lo guarda como String y el JSON como número)."""
+    try:
+        return int(float(str(value)))
+    except (TypeError, ValueError):
+        return value
+
+class _ScoreGroup:
+    """Ubicaciones con el mismo (zona, nivel, spot, score) y su heap de (ocupación, orden original)."""
+    __slots__ = ("entries", "heap", "token")
+
+    def __init__(self):
+        self.entries: List[tuple] = [] # (pos, bin_code en mayúsculas, bin_code)
+        self.heap: Optional[List[tuple]] = None
+        self.token = None
+
+    def best(self, occupancy: Dict[str, int], token: Optional[int], limit: int, private_heaps: Optional[dict] = None) -> Optional[tuple]:
+        """
+        Retorna (ocupación, pos, bin_code) del mejor bin con ocupación < limit, o None.
+        El heap se corrige de forma perezosa cuando un bin subió de ocupación; si alguno bajó
+        (token distinto) se reconstruye, porque esa entrada podría estar enterrada en el heap.
+        private_heaps: heaps propios de un lote (con reservas) que no deben contaminar los compartidos.
+        """
+        if private_heaps is not None:
+            heap = private_heaps.get(self)
+            if heap is None:
+                heap = private_heaps[self] = self._build_heap(occupancy)
+        else:
+            heap = self.heap
+            if heap is None or token is None or token != self.token:
+                heap = self._build_heap(occupancy)
+                if token is not None:
+                    self.heap, self.token = heap, token
+
+        while heap:
+            recorded, pos, code, bin_code = heap[0]
+            current = occupancy.get(code, 0)
+            if current != recorded:
+                heapq.heapreplace(heap, (current, pos, code, bin_code))
+                continue
+            return (current, pos, bin_code) if current < limit else None
+        return None
+
+    def _build_heap(self, occupancy) -> List[tuple]:
+        heap = [(occupancy.get(code, 0), pos, code, bin_code) for pos, code, bin_code in self.entries]
+        heapq.heapify(heap)
+        return heap
+
+class ReservedOccupancy:
+    """Vista de ocupación con reservas de un lote encima de la foto compartida (sin copiarla)."""
+
+    def __init__(self, base: Dict[str, int]):
+        self.base = base
+        self.reserved: Dict[str, int] = {}
+
+    def get(self, code: str, default: int = 0) -> int:
+        return self.base.get(code, default) + self.reserved.get(code, 0)
+
+    def reserve(self, bin_code: Optional[str]):
+        if bin_code:
+            code = bin_code.upper()
+            self.reserved[code] = self.reserved.get(code, 0) + 1
 
 class SlottingService:
     def __init__(self):
         self.params_path = SLOTTING_PARAMS_PATH
+        # Caché del layout en proceso: se invalida explícitamente desde los endpoints de admin
+        # y, para el resto de workers, cuando cambia el mtime de slotting_parameters.json
+        self._layout_cache: Optional[Dict[str, Any]] = None
+        self._layout_mtime = None
+        self._layout_version = 0
+
+    def invalidate_layout_cache(self):
+        """Descarta el layout en caché; la próxima sugerencia lo reconstruye desde SQL/JSON."""
+        self._layout_cache = None
+
+    @property
+    def layout_version(self) -> int:
+        """Contador que cambia cada vez que este worker reconstruye el layout."""
+        return self._layout_version
+
+    def _params_mtime(self):
+        try:
+            return os.path.getmtime(self.params_path)
+        except OSError:
+            return None
 
     def get_sic_code_by_hits(self, hits: int) -> str:
         """Categoriza un ítem basándose en su frecuencia de movimiento (Hits)."""
@@ -33,6 +122,123 @@ class SlottingService:
         except: return 0
 
     async def _get_layout_config(self, db: AsyncSession) -> Dict[str, Any]:
+        """
+        Retorna la configuración del layout desde la caché en proceso.
+        Solo consulta SQL/JSON si fue invalidada o si slotting_parameters.json cambió (otro worker guardó).
+        """
+        mtime = self._params_mtime()
+        if self._layout_cache is not None and mtime == self._layout_mtime:
+            return self._layout_cache
+
+        config = await self._load_layout_config(db)
+        config.update(self._build_layout_index(config))
+        self._layout_cache, self._layout_mtime = config, mtime
+        self._layout_version += 1
+        print(f"🗺️ [SLOTTING] Layout en caché v{self._layout_version} ({len(config['storage'])} ubicaciones)")
+        return config
+
+    def _build_layout_index(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Pre-calcula reglas parseadas y listas de candidatos por (zona, nivel) ordenadas por score."""
+        zone_rules = config.get('zone_rules', {})
+        mix_limits = config.get('mix_limits', {})
+
+        rules = {
+            "cantilever_kw": [k.strip().upper() for k in zone_rules.get("cantilever_keywords", "ROD, INTEGRAL STEEL").split(",") if k.strip()],
+            "minuteria_weight_max": float(zone_rules.get("minuteria_weight_max", 0.1)),
+            "heavy_weight_min": float(zone_rules.get("heavy_weight_min", 10)),
+            "heavy_levels": _parse_int_list(zone_rules.get("heavy_levels"), "3, 4, 5"),
+            "high_rotation_levels": _parse_int_list(zone_rules.get("high_rotation_levels"), "0, 1"),
+            "high_rotation_min_score": int(zone_rules.get("high_rotation_min_score", 1)),
+            "high_rotation_max_score": int(zone_rules.get("high_rotation_max_score", 10)),
+            "medium_rotation_levels": _parse_int_list(zone_rules.get("medium_rotation_levels"), "1, 2"),
+            "medium_rotation_min_score": int(zone_rules.get("medium_rotation_min_score", 4)),
+            "medium_rotation_max_score": int(zone_rules.get("medium_rotation_max_score", 6)),
+            "default_levels": _parse_int_list(zone_rules.get("default_levels"), "2"),
+            "exile_levels": _parse_int_list(zone_rules.get("exile_rack_levels"), "2, 3"),
+            "exile_sics": [s.strip().upper() for s in str(zone_rules.get("exile_sic_codes", "0, Z, L")).split(",") if s.strip()],
+            "exile_max_score": int(zone_rules.get("exile_max_score", 3)),
+            "minuteria_zone": zone_rules.get("minuteria_zone", "Minuteria"),
+            "limit_minuteria": int(mix_limits.get("minuteria_max_skus", 3)),
+            "limit_n2": int(mix_limits.get("nivel2_max_skus", 6)),
+            "limit_others": int(mix_limits.get("otros_niveles_max_skus", 4)),
+        }
+
+        # Índice espacial: zona -> nivel -> spot -> (scores ascendentes, {score: _ScoreGroup})
+        # 'pos' conserva el orden original del layout para desempatar igual que el recorrido lineal
+        index: Dict[Any, Dict[Any, Dict[str, Any]]] = {}
+        for pos, (bin_code, info) in enumerate(config.get('storage', {}).items()):
+            zone = info.get('zone')
+            level = _parse_level(info.get('level'))
+            spot = str(info.get('spot', 'Cold')).lower()
+            score = info.get('score', 0) or 0
+            groups = index.setdefault(zone, {}).setdefault(level, {}).setdefault(spot, {})
+            groups.setdefault(score, _ScoreGroup()).entries.append((pos, bin_code.upper(), bin_code))
+
+        for levels in index.values():
+            for level, spots in levels.items():
+                for spot, groups in spots.items():
+                    spots[spot] = (sorted(groups), groups)
+
+        return {"rules": rules, "spatial": index}
+
+    def _find_best_bin(
+        self,
+        config: Dict[str, Any],
+        zones: List[Any],
+        target_levels: Optional[List[int]],
+        score_min: Optional[int],
+        score_max: Optional[int],
+        ideal_spot: str,
+        occupancy: Dict[str, int],
+        token: Optional[int],
+        private_heaps: Optional[dict] = None
+    ) -> Optional[str]:
+        """
+        Busca el mejor bin sin recorrer ni ordenar todo el layout. Orden equivalente a
+        (spot != ideal, score preferido, ocupación, orden original): recorre los scores en el
+        orden preferido y se detiene en el primero que tenga algún bin con capacidad.
+        """
+        rules = config['rules']
+        index = config['spatial']
+        # HOT/WARM prefieren mayor score físico; cualquier otro spot se trata como COLD (menor score)
+        prefer_high = ideal_spot in ('hot', 'warm')
+        preferred_spot = ideal_spot if prefer_high else 'cold'
+        matching, others = [], []
+
+        for zone in zones:
+            levels = index.get(zone, {})
+            level_keys = [lvl for lvl in dict.fromkeys(target_levels) if lvl in levels] if target_levels else list(levels)
+            for level in level_keys:
+                # Dinámica de límites configurables
+                if zone == "Minuteria" or zone == rules["minuteria_zone"]:
+                    limit = rules["limit_minuteria"]
+                elif level == 2:
+                    limit = rules["limit_n2"]
+                else:
+                    limit = rules["limit_others"]
+
+                for spot, (scores, groups) in levels[level].items():
+                    # Rango de score por búsqueda binaria sobre los scores ordenados
+                    lo = bisect_left(scores, score_min) if score_min is not None else 0
+                    hi = bisect_right(scores, score_max) if score_max is not None else len(scores)
+                    if lo < hi:
+                        (matching if spot == preferred_spot else others).append((scores[lo:hi], groups, limit))
+
+        for tier in (matching, others):
+            for score in sorted({s for window, _, _ in tier for s in window}, reverse=prefer_high):
+                best = None
+                for _, groups, limit in tier:
+                    group = groups.get(score)
+                    if group is None:
+                        continue
+                    found = group.best(occupancy, token, limit, private_heaps)
+                    if found and (best is None or found[:2] < best[:2]):
+                        best = found
+                if best:
+                    return best[2]
+        return None
+
+    async def _load_layout_config(self, db: AsyncSession) -> Dict[str, Any]:
         """Obtiene la configuración del layout con prioridad en SQL y fallback en JSON."""
         # 1. Intentar obtener de SQL (Ubicaciones)
         res_bins = await db.execute(select(BinLocation))
@@ -73,13 +279,24 @@ class SlottingService:
             "mix_limits": mix_limits
         }
 
-    async def get_suggested_bin(self, db: AsyncSession, item_details: Dict[str, Any]) -> Optional[str]:
-        """Calcula la mejor ubicación disponible basada en el mapa de slotting, scores y reglas de negocio."""
-        config = await self._get_layout_config(db)
+    async def get_suggested_bin(
+        self,
+        db: AsyncSession,
+        item_details: Dict[str, Any],
+        occupancy: Optional[Dict[str, int]] = None,
+        hits: Optional[int] = None,
+        config: Optional[Dict[str, Any]] = None,
+        private_heaps: Optional[dict] = None
+    ) -> Optional[str]:
+        """
+        Calcula la mejor ubicación disponible basada en el mapa de slotting, scores y reglas de negocio.
+        occupancy, hits y config permiten reutilizar datos ya consultados en el mismo request.
+        """
+        if config is None:
+            config = await self._get_layout_config(db)
         storage = config.get('storage', {})
         turnover_map = config.get('turnover', {})
-        zone_rules = config.get('zone_rules', {})
-        mix_limits = config.get('mix_limits', {})
+        rules = config['rules']
         
         current_bin = str(item_details.get('Bin_1', '')).strip().upper()
         item_code = str(item_details.get('Item_Code', '')).strip()
@@ -89,7 +306,8 @@ class SlottingService:
 
         # Prioridad 2 (Fallback): Si el ERP no mandó SIC Code (vacío o '0'), intentar deducirlo por actividad local
         if not sic_code or sic_code == '0' or sic_code == 'N/A':
-            hits = await self._get_item_hits(db, item_code)
+            if hits is None:
+                hits = await self._get_item_hits(db, item_code)
             sic_code = self.get_sic_code_by_hits(hits)
             
         # Si aún así no hay nada, por defecto es '0' (Cold)
@@ -117,14 +335,14 @@ class SlottingService:
                 if ideal_spot == 'hot' and current_score >= 8:
                     return None
                 # Si es un ítem COLD y ya está en una zona de exilio o baja prioridad (score <= exile_max_score), se queda.
-                exile_max_score = int(zone_rules.get("exile_max_score", 3))
-                if ideal_spot == 'cold' and current_score <= exile_max_score:
+                if ideal_spot == 'cold' and current_score <= rules["exile_max_score"]:
                     return None
                 # En otros casos (ej. ítem warm en score medio), se queda si no hay una mejor opción obvia.
                 if ideal_spot == 'warm':
                     return None
 
-        occupancy = await self._get_bins_occupancy(db)
+        if occupancy is None:
+            occupancy = await self._get_bins_occupancy(db)
         
         target_zone = None
         target_levels = None
@@ -137,132 +355,106 @@ class SlottingService:
             weight = float(str(weight_val).replace(',', '')) if weight_val else 0.0
         except: pass
 
-        # --- PARÁMETROS DINÁMICOS ---
-        cantilever_kw = [k.strip().upper() for k in zone_rules.get("cantilever_keywords", "ROD, INTEGRAL STEEL").split(",") if k.strip()]
-        minuteria_weight_max = float(zone_rules.get("minuteria_weight_max", 0.1))
-        heavy_weight_min = float(zone_rules.get("heavy_weight_min", 10))
-        heavy_levels = [int(lvl.strip()) for lvl in str(zone_rules.get("heavy_levels", "3, 4, 5")).split(",") if lvl.strip().isdigit()]
-        high_rotation_levels = [int(lvl.strip()) for lvl in str(zone_rules.get("high_rotation_levels", "0, 1")).split(",") if lvl.strip().isdigit()]
-        high_rotation_min_score = int(zone_rules.get("high_rotation_min_score", 1))
-        high_rotation_max_score = int(zone_rules.get("high_rotation_max_score", 10))
-        
-        medium_rotation_levels = [int(lvl.strip()) for lvl in str(zone_rules.get("medium_rotation_levels", "1, 2")).split(",") if lvl.strip().isdigit()]
-        medium_rotation_min_score = int(zone_rules.get("medium_rotation_min_score", 4))
-        medium_rotation_max_score = int(zone_rules.get("medium_rotation_max_score", 6))
-        
-        default_levels = [int(lvl.strip()) for lvl in str(zone_rules.get("default_levels", "2")).split(",") if lvl.strip().isdigit()]
-        exile_levels = [int(lvl.strip()) for lvl in str(zone_rules.get("exile_rack_levels", "2, 3")).split(",") if lvl.strip().isdigit()]
-        exile_sics = [s.strip().upper() for s in str(zone_rules.get("exile_sic_codes", "0, Z, L")).split(",") if s.strip()]
-        minuteria_zone = zone_rules.get("minuteria_zone", "Minuteria")
-
-        limit_minuteria = int(mix_limits.get("minuteria_max_skus", 3))
-        limit_n2 = int(mix_limits.get("nivel2_max_skus", 6))
-        limit_others = int(mix_limits.get("otros_niveles_max_skus", 4))
+        # --- PARÁMETROS DINÁMICOS (pre-parseados en la caché del layout) ---
+        minuteria_zone = rules["minuteria_zone"]
+        exile_sics = rules["exile_sics"]
 
         # --- REGLAS DE NEGOCIO POR ATRIBUTOS ---
-        is_cantilever = any(kw in description for kw in cantilever_kw)
+        is_cantilever = any(kw in description for kw in rules["cantilever_kw"])
         
         target_score_min = None
         target_score_max = None
 
         if is_cantilever:
             target_zone = "Cantilever"
-        elif 0 < weight < minuteria_weight_max:
+        elif 0 < weight < rules["minuteria_weight_max"]:
             target_zone = minuteria_zone
-        elif weight > heavy_weight_min:
+        elif weight > rules["heavy_weight_min"]:
             target_zone = "Rack"
-            target_levels = heavy_levels
+            target_levels = rules["heavy_levels"]
         elif sic_code in ['W', 'X']:
             target_zone = "Rack"
-            target_levels = high_rotation_levels
-            target_score_min = high_rotation_min_score
-            target_score_max = high_rotation_max_score
+            target_levels = rules["high_rotation_levels"]
+            target_score_min = rules["high_rotation_min_score"]
+            target_score_max = rules["high_rotation_max_score"]
         elif sic_code in ['Y', 'K']:
             target_zone = "Rack"
-            target_levels = medium_rotation_levels
-            target_score_min = medium_rotation_min_score
-            target_score_max = medium_rotation_max_score
+            target_levels = rules["medium_rotation_levels"]
+            target_score_min = rules["medium_rotation_min_score"]
+            target_score_max = rules["medium_rotation_max_score"]
         elif sic_code in exile_sics:
             target_zone = "Rack"
-            target_levels = exile_levels
+            target_levels = rules["exile_levels"]
         else:
             # Todo lo demás
             target_zone = "Rack"
-            target_levels = default_levels
+            target_levels = rules["default_levels"]
         
         if target_zone is None:
             forbidden_zones = ["Cantilever", "Minuteria"]
 
-        # --- BÚSQUEDA DE CANDIDATOS EN EL MAPA ---
-        candidates = []
-        for bin_code, info in storage.items():
-            zone = info.get('zone')
-            level = info.get('level')
-            score = info.get('score', 0)
-            if zone in forbidden_zones: continue
-            if target_zone and zone != target_zone: continue
-            if target_levels and level not in target_levels: continue
-            if target_score_min is not None and score < target_score_min: continue
-            if target_score_max is not None and score > target_score_max: continue
-
-            current_items = occupancy.get(bin_code.upper(), 0)
-            
-            # Dinámica de límites configurables
-            if zone == "Minuteria" or zone == minuteria_zone:
-                limit = limit_minuteria
-            elif level == 2:
-                limit = limit_n2
-            else:
-                limit = limit_others
-            
-            if current_items < limit:
-                candidates.append({
-                    'bin': bin_code,
-                    'occupancy': current_items,
-                    'spot': str(info.get('spot', 'Cold')).lower(),
-                    'score': score
-                })
-
-        if not candidates:
-            return None
-
-        # --- ORDENAMIENTO POR SCORE Y ROTACIÓN ---
+        # --- BÚSQUEDA EN EL ÍNDICE (zona, nivel, spot) -> score -> heap de ocupación ---
         # Prioridad: 
         # 1. Que coincida el SPOT (Hot/Cold)
         # 2. Si es HOT, mayor SCORE físico. Si es COLD, menor SCORE físico.
         # 3. Menor OCUPACIÓN.
+        zones = [target_zone] if target_zone else [z for z in config['spatial'] if z not in forbidden_zones]
+        return self._find_best_bin(
+            config, zones, target_levels, target_score_min, target_score_max, ideal_spot,
+            occupancy, occupancy_service.heap_token(occupancy), private_heaps
+        )
 
-        if ideal_spot == 'hot':
-            candidates.sort(key=lambda x: (x['spot'] != 'hot', -x['score'], x['occupancy']))
-        elif ideal_spot == 'warm':
-            candidates.sort(key=lambda x: (x['spot'] != 'warm', -x['score'], x['occupancy']))
-        else:
-            candidates.sort(key=lambda x: (x['spot'] != 'cold', x['score'], x['occupancy']))
+    async def get_suggested_bins_batch(
+        self,
+        db: AsyncSession,
+        items: List[Dict[str, Any]],
+        hits_map: Optional[Dict[str, int]] = None,
+        config: Optional[Dict[str, Any]] = None,
+        occupancy: Optional[Dict[str, int]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Sugiere ubicación (slotting + IA) para varios ítems en una sola pasada contra una única
+        foto de ocupación. Cada bin asignado se reserva en una vista propia del lote, así dos
+        ítems del mismo lote no se sugieren al mismo bin por encima de su límite.
+        Retorna Item_Code -> {"suggestedBin", "is_ai_prediction"}.
+        """
+        from app.services.ai_slotting import ai_slotting
+
+        if config is None:
+            config = await self._get_layout_config(db)
+        if occupancy is None:
+            occupancy = await self._get_bins_occupancy(db)
+        hits_map = hits_map or {}
 
-        return candidates[0]['bin']
+        reserved = ReservedOccupancy(occupancy)
+        private_heaps: dict = {}
+        suggestions = {}
+        for item_details in items:
+            item_code = str(item_details.get('Item_Code', '')).strip().upper()
+            traditional = await self.get_suggested_bin(
+                db, item_details, occupancy=reserved, hits=hits_map.get(item_code, 0),
+                config=config, private_heaps=private_heaps
+            )
+            predicted = await ai_slotting.predict_best_bin(
+                db=db,
+                item_code=item_code,
+                sic_code=item_details.get('SIC_Code_stockroom'),
+                fallback_bin=traditional,
+                layout_config=config
+            )
+
+            # Validación de capacidad para la IA contra la vista con reservas
+            final_bin, is_ai = predicted, predicted != traditional
+            if is_ai and reserved.get(predicted.upper(), 0) >= 4:
+                final_bin, is_ai = traditional, False
+
+            reserved.reserve(final_bin)
+            suggestions[item_code] = {"suggestedBin": final_bin, "is_ai_prediction": is_ai}
+        return suggestions
 
     async def _get_bins_occupancy(self, db: AsyncSession) -> Dict[str, int]:
-        """Calcula cuántos SKUs hay en cada bin (Cruza maestro + reubicaciones activas)."""
-        occupancy = {}
-        try:
-            # 1. Master Items (Stock físico actual)
-            master_stmt = select(MasterItem.bin_1, func.count(MasterItem.item_code)).where(MasterItem.physical_qty > 0).group_by(MasterItem.bin_1)
-            master_res = await db.execute(master_stmt)
-            for bin_code, count in master_res.all():
-                if bin_code:
-                    code = str(bin_code).strip().upper()
-                    occupancy[code] = occupancy.get(code, 0) + count
-
-            # 2. Logs Activos (Mercancía en camino a un bin)
-            logs_stmt = select(Log.relocatedBin, func.count(func.distinct(Log.itemCode))).where(and_(Log.archived_at == None, Log.relocatedBin != '', Log.relocatedBin != None)).group_by(Log.relocatedBin)
-            logs_res = await db.execute(logs_stmt)
-            for bin_code, count in logs_res.all():
-                if bin_code:
-                    code = str(bin_code).strip().upper()
-                    occupancy[code] = occupancy.get(code, 0) + count
-        except Exception as e:
-            print(f"Error calculando ocupación: {e}")
-        return occupancy
+        """Cuántos SKUs hay en cada bin (maestro + reubicaciones activas), mantenido en memoria por occupancy_service."""
+        return await occupancy_service.get_occupancy(db)
 
     async def get_occupancy_report(self, db: AsyncSession) -> Dict[str, Any]:
         """Genera el reporte de métricas del mapa de slotting."""
@@ -0,0 +1,198 @@
+"""
+Subida en lote de los registros pendientes de los handhelds (/api/sync/push).
+Antes cada registro de la cola offline era un request propio (auth, sesión, SELECT por client_id
+y commit). Acá los logs de Inbound van al escritor en lote de db_logs (deduplicación con una
+consulta IN, INSERT multi-VALUES y aprendizaje de la IA en la misma transacción) y las ejecuciones
+del planificador a otra transacción; el resultado es por registro. Si la transacción del lote falla
+se reintenta registro por registro, para que uno inválido no bloquee al resto de la cola.
+"""
+import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.schemas import CountExecutionRequest, LogEntry, SyncPushRecord
+from app.models.sql_models import MasterItem
+from app.services import csv_handler, db_counts, db_logs
+
+# Módulo que exige cada colección de la cola offline
+COLLECTION_PERMISSIONS = {"inbound": "inbound", "planner": "planner"}
+
+
+def _result(record: SyncPushRecord, status: str, **extra) -> Dict[str, Any]:
+    return {"client_id": record.client_id, "status": status, **extra}
+
+
+async def _master_details(db: AsyncSession, item_codes: List[str]) -> Dict[str, dict]:
+    """Detalles del maestro para varios ítems: SQL en una consulta y caché en RAM como respaldo."""
+    details = {}
+    if item_codes:
+        result = await db.execute(select(MasterItem).where(MasterItem.item_code.in_(item_codes)))
+        details = {m.item_code: csv_handler.master_item_to_dict(m) for m in result.scalars().all()}
+    missing = [code for code in item_codes if code not in details]
+    if missing:
+        await csv_handler.reload_cache_if_needed()
+        for code in missing:
+            row = csv_handler.get_master_row(code)
+            if row:
+                details[code] = row
+    return details
+
+
+def _inbound_results(saved_records: List[SyncPushRecord], update_records: List[SyncPushRecord],
+                     saved: Optional[db_logs.LogBatchResult]) -> Dict[str, Dict[str, Any]]:
+    """Resultado por registro de una escritura en lote de logs (saved None: la transacción falló)."""
+    results: Dict[str, Dict[str, Any]] = {}
+    for record in saved_records:
+        if saved is None:
+            results[record.client_id] = _result(record, "error", detail="Error al guardar el registro en la base de datos.")
+        elif record.client_id in saved.duplicates:
+            results[record.client_id] = _result(record, "duplicate")
+        else:
+            results[record.client_id] = _result(record, "saved", id=saved.ids.get(record.client_id))
+    for record in update_records:
+        if saved is None:
+            results[record.client_id] = _result(record, "error", detail="Error al actualizar el registro.")
+        elif record.edit_id in saved.updated:
+            results[record.client_id] = _result(record, "updated", id=record.edit_id)
+        else:
+            results[record.client_id] = _result(record, "error", detail="Registro no encontrado.")
+    return results
+
+
+async def _push_inbound(db: AsyncSession, records: List[SyncPushRecord], username: str) -> Dict[str, Dict[str, Any]]:
+    """Altas y ediciones de logs en una transacción (mismas reglas que /api/add_log y /api/update_log)."""
+    results: Dict[str, Dict[str, Any]] = {}
+    new_records, updates, update_records = [], {}, []
+    for record in records:
+        if record.edit_id is not None:
+            updates[record.edit_id] = record.payload
+            update_records.append(record)
+            continue
+        try:
+            new_records.append((record, LogEntry(**{**record.payload, "client_id": record.client_id})))
+        except ValidationError:
+            results[record.client_id] = _result(record, "error", detail="Datos del registro inválidos.")
+
+    item_codes = list({data.itemCode.strip().upper() for _, data in new_records})
+    details = await _master_details(db, item_codes)
+    latest_bins = await db_logs.get_latest_relocated_bins_async(db, item_codes)
+
+    entries, saved_records, decisions = [], [], {}
+    for record, data in new_records:
+        item_code = data.itemCode.strip().upper()
+        item_details = details.get(item_code)
+        if not item_details:
+            results[record.client_id] = _result(record, "error", detail="El código de ítem no existe en el maestro.")
+            continue
+
+        expected_qty = await csv_handler.get_total_expected_quantity_for_item(item_code)
+        entry_data = data.dict()
+        entry_data['username'] = username
+        # El registro offline conserva la hora en que se capturó
+        entry_data['timestamp'] = record.payload.get('timestamp') or datetime.datetime.now().isoformat()
+        entry_data['qtyGrn'] = expected_qty
+        entry_data['qtyReceived'] = data.quantity
+        entry_data['difference'] = data.quantity - expected_qty
+        entry_data['itemDescription'] = item_details.get('Item_Description', '')
+        entry_data['binLocation'] = latest_bins.get(item_code) or item_details.get('Bin_1', '')
+        entries.append(entry_data)
+        saved_records.append(record)
+        if data.relocatedBin:
+            decisions[record.client_id] = (item_code, data.relocatedBin, item_details.get('SIC_Code_stockroom'))
+
+        # Los registros siguientes del lote ven esta reubicación, como si se hubieran subido uno a uno
+        relocated = (data.relocatedBin or '').strip()
+        if relocated and relocated.upper() not in db_logs.VIRTUAL_BINS:
+            latest_bins[item_code] = relocated
+
+    if not entries and not updates:
+        return results
+
+    saved = await db_logs.save_log_batch_db_async(db, entries, updates, decisions)
+    if saved is not None:
+        results.update(_inbound_results(saved_records, update_records, saved))
+        return results
+
+    # Un registro que la base rechaza no debe frenar al resto (la cola offline reenvía el mismo lote):
+    # se reintenta uno por uno y solo falla el que de verdad no se puede guardar
+    for record, entry in zip(saved_records, entries):
+        decision = decisions.get(record.client_id)
+        one = await db_logs.save_log_batch_db_async(db, [entry], decisions={record.client_id: decision} if decision else None)
+        results.update(_inbound_results([record], [], one))
+    for record in update_records:
+        one = await db_logs.save_log_batch_db_async(db, [], {record.edit_id: record.payload})
+        results.update(_inbound_results([], [record], one))
+    return results
+
+
+async def _push_planner(db: AsyncSession, records: List[SyncPushRecord], username: str) -> Dict[str, Dict[str, Any]]:
+    """Ejecuciones del planificador en una transacción (mismas reglas que /api/planner/execution/save)."""
+    results: Dict[str, Dict[str, Any]] = {}
+    executions = []
+    for record in records:
+        try:
+            executions.append((record, CountExecutionRequest(**record.payload)))
+        except ValidationError:
+            results[record.client_id] = _result(record, "error", detail="Datos del registro inválidos.")
+
+    applied = []
+    try:
+        for record, execution in executions:
+            applied.append((record, await db_counts.apply_count_execution_async(db, execution, username)))
+        await db.commit()
+    except Exception as e:
+        print(f"DB Error (sync push planner): {e}")
+        await db.rollback()
+        # Nada del lote quedó guardado: se reintenta una transacción por ejecución
+        applied = []
+        for record, execution in executions:
+            try:
+                counts = await db_counts.apply_count_execution_async(db, execution, username)
+                await db.commit()
+                applied.append((record, counts))
+            except Exception as e:
+                print(f"DB Error (sync push planner, {record.client_id}): {e}")
+                await db.rollback()
+                results[record.client_id] = _result(record, "error", detail="Error al guardar el conteo.")
+
+    for record, (new_count, updated_count) in applied:
+        results[record.client_id] = _result(record, "saved", saved=new_count, updated=updated_count)
+    return results
+
+
+async def push_records(db: AsyncSession, records: List[SyncPushRecord], username: str, permissions: List[str]) -> List[Dict[str, Any]]:
+    """
+    Procesa un lote de registros offline y retorna un resultado por registro, en el mismo orden.
+    status: saved, updated, duplicate (ya estaba en el servidor), forbidden o error (con detail).
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    by_collection: Dict[str, List[SyncPushRecord]] = {name: [] for name in COLLECTION_PERMISSIONS}
+    seen = set()
+    for record in records:
+        module = COLLECTION_PERMISSIONS.get(record.collection)
+        if record.client_id in seen:
+            continue   # Repetido dentro del mismo lote: se informa como duplicate al final
+        seen.add(record.client_id)
+        if module is None:
+            results[record.client_id] = _result(record, "error", detail=f"Colección desconocida: {record.collection}")
+        elif username != 'admin' and module not in permissions:
+            results[record.client_id] = _result(record, "forbidden", detail=f"Se requiere permiso '{module}'")
+        else:
+            by_collection[record.collection].append(record)
+
+    if by_collection["inbound"]:
+        results.update(await _push_inbound(db, by_collection["inbound"], username))
+    if by_collection["planner"]:
+        results.update(await _push_planner(db, by_collection["planner"], username))
+
+    ordered, reported = [], set()
+    for record in records:
+        if record.client_id in reported:
+            ordered.append(_result(record, "duplicate"))
+        else:
+            reported.add(record.client_id)
+            ordered.append(results.get(record.client_id) or _result(record, "error", detail="Registro no procesado."))
+    return ordered
@@ -4,11 +4,15 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from typing import List, Dict, Any, Optional, Callable
 import secrets
 import datetime
+import os
 import re
+import time
+from collections import OrderedDict
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
 from app.models.sql_models import User, PasswordResetToken
 from app.core.db import get_db
+from app.core.config import CACHE_FOLDER, USERS_SIGNAL_PATH
 
 # --- Funciones de Lógica de Usuario ---
 
@@ -80,6 +84,7 @@ async def approve_user_by_id(db: AsyncSession, user_id: int) -> bool:
     stmt = update(User).where(User.id == user_id).values(is_approved=1)
     result = await db.execute(stmt)
     await db.commit()
+    invalidate_user_permissions()
     return result.rowcount > 0
 
 async def delete_user_by_id(db: AsyncSession, user_id: int) -> bool:
@@ -87,6 +92,7 @@ async def delete_user_by_id(db: AsyncSession, user_id: int) -> bool:
     stmt = delete(User).where(User.id == user_id)
     result = await db.execute(stmt)
     await db.commit()
+    invalidate_user_permissions()
     return result.rowcount > 0
 
 async def reset_user_password(db: AsyncSession, user_id: int, new_password: str) -> bool:
@@ -98,6 +104,7 @@ async def reset_user_password(db: AsyncSession, user_id: int, new_password: str)
     stmt = update(User).where(User.id == user_id).values(password_hash=new_hashed_password)
     result = await db.execute(stmt)
     await db.commit()
+    invalidate_user_permissions()
     return result.rowcount > 0
 
 async def generate_password_reset_token(db: AsyncSession, user_id: int) -> str:
@@ -127,6 +134,63 @@ async def mark_token_as_used(db: AsyncSession, token: str):
     await db.execute(stmt)
     await db.commit()
 
+# --- Caché de permisos ---
+# permission_required se evalúa en cada request protegido (incluido cada escaneo); los permisos
+# se guardan por usuario con TTL y se invalidan al aprobar, borrar, cambiar permisos o contraseña.
+# Los demás workers se enteran por el mtime de USERS_SIGNAL_PATH.
+
+PERMISSION_CACHE_TTL = 60       # segundos
+PERMISSION_CACHE_MAX_USERS = 1024
+
+_permission_cache: "OrderedDict[str, tuple[float, List[str]]]" = OrderedDict()
+_users_signal_seen: Optional[int] = None
+
+def _users_signal_mtime() -> Optional[int]:
+    try:
+        return os.stat(USERS_SIGNAL_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def invalidate_user_permissions():
+    """Descarta los permisos cacheados en este worker y avisa al resto."""
+    global _users_signal_seen
+    _permission_cache.clear()
+    try:
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        with open(USERS_SIGNAL_PATH, 'a'):
+            os.utime(USERS_SIGNAL_PATH, None)
+        _users_signal_seen = _users_signal_mtime()
+    except OSError as e:
+        print(f"⚠️ No se pudo publicar la señal de usuarios: {e}")
+
+async def get_user_permissions(db: AsyncSession, username: str) -> Optional[List[str]]:
+    """Permisos del usuario (caché con TTL); None si el usuario no existe."""
+    global _users_signal_seen
+    signal = _users_signal_mtime()
+    if signal != _users_signal_seen:
+        # Otro worker modificó usuarios
+        _permission_cache.clear()
+        _users_signal_seen = signal
+
+    now = time.monotonic()
+    cached = _permission_cache.get(username)
+    if cached is not None and cached[0] > now:
+        _permission_cache.move_to_end(username)
+        return cached[1]
+
+    result = await db.execute(select(User.permissions).where(User.username == username))
+    row = result.first()
+    if row is None:
+        _permission_cache.pop(username, None)
+        return None
+
+    perms = row[0].split(',') if row[0] else []
+    _permission_cache[username] = (now + PERMISSION_CACHE_TTL, perms)
+    _permission_cache.move_to_end(username)
+    if len(_permission_cache) > PERMISSION_CACHE_MAX_USERS:
+        _permission_cache.popitem(last=False)
+    return perms
+
 # --- Dependencias de Autenticación (Sin cambios en firmas, solo lógica interna si aplica) ---
 
 def get_current_user(request: Request) -> str | None:
@@ -186,18 +250,15 @@ def permission_required(module: str | List[str]) -> Callable:
     async def _check_permission(request: Request, db: AsyncSession = Depends(get_db)):
         username = api_login_required(request) # Verifica login y obtiene username
         
-        # Obtener usuario y permisos
-        result = await db.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
+        # Obtener permisos del usuario (caché por worker)
+        perms = await get_user_permissions(db, username)
         
-        if not user:
+        if perms is None:
             raise HTTPException(status_code=401, detail="Usuario no encontrado")
             
         # Si es admin, permitir todo
         if username == 'admin':
             return username
-
-        perms = user.permissions.split(',') if user.permissions else []
         
         required_modules = [module] if isinstance(module, str) else module
         
@@ -73,6 +73,35 @@ export const savePendingSync = async (collection, payload, editId = null) => {
     return id;
 };
 
+/**
+ * Decodifica una tabla en formato columnar del servidor (`/api/sync/master_data?format=columnar`):
+ * { length, columns: { nombre: [valores] | { dict: [...], codes: [...] } } }.
+ * Recorre las filas como objetos sin armar un arreglo intermedio con todas.
+ * @param {{length: number, columns: object}} table Tabla columnar
+ */
+export function* decodeColumnar(table) {
+    const names = Object.keys(table.columns);
+    const values = names.map((name) => {
+        const column = table.columns[name];
+        return Array.isArray(column) ? column : null;
+    });
+    const dicts = names.map((name, j) => (values[j] ? null : table.columns[name].dict));
+    const codes = names.map((name, j) => (values[j] ? null : table.columns[name].codes));
+
+    for (let i = 0; i < table.length; i++) {
+        const row = {};
+        for (let j = 0; j < names.length; j++) {
+            if (values[j]) {
+                row[names[j]] = values[j][i];
+            } else {
+                const code = codes[j][i];
+                row[names[j]] = code === null ? null : dicts[j][code];
+            }
+        }
+        yield row;
+    }
+}
+
 /**
  * Guarda datos en caché genérica.
  * @param {string} key Identificador de la caché
@@ -1,86 +1,142 @@
-import { getDB } from './offlineDb';
+import { getDB, decodeColumnar } from './offlineDb';
+
+const isValidCode = (code) => code && code !== 'null' && code !== 'undefined';
+
+const putXdock = (store, code, info) => {
+    if (typeof info === 'object') {
+        store.put({ Item_Code: code, total: info.total, customers: info.customers });
+    } else {
+        store.put({ Item_Code: code, total: info, customers: [] });
+    }
+};
+
+const poRecord = (type, key, info) => {
+    const value = key.trim().toUpperCase();
+    return type === 'wb'
+        ? { id: `wb_${value}`, type: 'wb', value, import_ref: info.import_ref }
+        : { id: `ir_${value}`, type: 'ir', value, waybill: info.waybill };
+};
+
+/**
+ * Carga completa: reemplaza el contenido de los stores.
+ */
+const applyFullMasterData = async (tx, data) => {
+    // Limpiar y cargar Master Items
+    const itemStore = tx.objectStore('master_items');
+    await itemStore.clear();
+    const items = data.format === 'columnar' ? decodeColumnar(data.master_items) : data.master_items;
+    for (const item of items) {
+        if (item && item.Item_Code) {
+            itemStore.put(item);
+        }
+    }
+
+    // Cargar GRN Pending
+    const grnStore = tx.objectStore('grn_pending');
+    await grnStore.clear();
+    for (const [code, qty] of Object.entries(data.grn_pending)) {
+        if (isValidCode(code)) {
+            grnStore.put({ Item_Code: code, total_expected: qty });
+        }
+    }
+
+    // Cargar Xdock
+    const xdockStore = tx.objectStore('xdock_reservations');
+    await xdockStore.clear();
+    for (const [code, info] of Object.entries(data.xdock_reservations)) {
+        if (isValidCode(code)) {
+            putXdock(xdockStore, code, info);
+        }
+    }
+
+    // Cargar PO Lookup
+    const poStore = tx.objectStore('po_lookup');
+    await poStore.clear();
+
+    const poPromises = [];
+    for (const [wb, info] of Object.entries(data.po_lookup.wb_to_data || {})) {
+        if (wb) poPromises.push(poStore.put(poRecord('wb', wb, info)));
+    }
+    for (const [ir, info] of Object.entries(data.po_lookup.ir_to_data || {})) {
+        if (ir) poPromises.push(poStore.put(poRecord('ir', ir, info)));
+    }
+    await Promise.all(poPromises);
+};
+
+/**
+ * Delta (`since`): solo agrega/actualiza y elimina lo que cambió desde la versión local.
+ */
+const applyMasterDelta = async (tx, data) => {
+    const ops = [];
+
+    const itemStore = tx.objectStore('master_items');
+    for (const item of data.master_items.upsert) {
+        if (item && item.Item_Code) ops.push(itemStore.put(item));
+    }
+    for (const code of data.master_items.remove) ops.push(itemStore.delete(code));
+
+    const grnStore = tx.objectStore('grn_pending');
+    for (const [code, qty] of Object.entries(data.grn_pending.upsert)) {
+        if (isValidCode(code)) ops.push(grnStore.put({ Item_Code: code, total_expected: qty }));
+    }
+    for (const code of data.grn_pending.remove) ops.push(grnStore.delete(code));
+
+    const xdockStore = tx.objectStore('xdock_reservations');
+    for (const [code, info] of Object.entries(data.xdock_reservations.upsert)) {
+        if (isValidCode(code)) putXdock(xdockStore, code, info);
+    }
+    for (const code of data.xdock_reservations.remove) ops.push(xdockStore.delete(code));
+
+    const poStore = tx.objectStore('po_lookup');
+    for (const [type, section] of [['wb', data.po_lookup.wb_to_data], ['ir', data.po_lookup.ir_to_data]]) {
+        for (const [key, info] of Object.entries(section.upsert)) {
+            if (key) ops.push(poStore.put(poRecord(type, key, info)));
+        }
+        for (const key of section.remove) {
+            if (key) ops.push(poStore.delete(`${type}_${key.trim().toUpperCase()}`));
+        }
+    }
+    await Promise.all(ops);
+};
 
 /**
  * Sincroniza los datos maestros (Items, GRN, XDock, PO Lookup) desde el servidor a IndexedDB.
+ * Con una versión local pide solo los cambios (`since`); el servidor responde con la carga
+ * completa si esa versión ya no está disponible.
  */
 export const downloadMasterData = async () => {
     try {
-        const res = await fetch('/api/sync/master_data');
+        const db = await getDB();
+        const versionMeta = await db.get('sync_metadata', 'master_data_version');
+        // La carga completa llega por columnas; los deltas siguen como objetos (son pocos ítems)
+        const url = versionMeta
+            ? `/api/sync/master_data?format=columnar&since=${encodeURIComponent(versionMeta.value)}`
+            : '/api/sync/master_data?format=columnar';
+
+        const res = await fetch(url);
         if (!res.ok) throw new Error('Error al descargar datos maestros');
         
         const data = await res.json();
-        const db = await getDB();
         
         const tx = db.transaction(['master_items', 'grn_pending', 'xdock_reservations', 'po_lookup', 'sync_metadata'], 'readwrite');
         
-        // Limpiar y cargar Master Items
-        const itemStore = tx.objectStore('master_items');
-        await itemStore.clear();
-        for (const item of data.master_items) {
-            if (item && item.Item_Code) {
-                itemStore.put(item);
-            }
-        }
-        
-        // Cargar GRN Pending
-        const grnStore = tx.objectStore('grn_pending');
-        await grnStore.clear();
-        for (const [code, qty] of Object.entries(data.grn_pending)) {
-            if (code && code !== 'null' && code !== 'undefined') {
-                grnStore.put({ Item_Code: code, total_expected: qty });
-            }
-        }
-        
-        // Cargar Xdock
-        const xdockStore = tx.objectStore('xdock_reservations');
-        await xdockStore.clear();
-        for (const [code, info] of Object.entries(data.xdock_reservations)) {
-            if (code && code !== 'null' && code !== 'undefined') {
-                if (typeof info === 'object') {
-                    xdockStore.put({ Item_Code: code, total: info.total, customers: info.customers });
-                } else {
-                    xdockStore.put({ Item_Code: code, total: info, customers: [] });
-                }
-            }
-        }
-        
-        // Cargar PO Lookup
-        const poStore = tx.objectStore('po_lookup');
-        await poStore.clear();
-        
-        const poPromises = [];
-        if (data.po_lookup.wb_to_data) {
-            for (const [wb, info] of Object.entries(data.po_lookup.wb_to_data)) {
-                if (!wb) continue;
-                const normalizedWb = wb.trim().toUpperCase();
-                poPromises.push(poStore.put({ 
-                    id: `wb_${normalizedWb}`, 
-                    type: 'wb', 
-                    value: normalizedWb, 
-                    import_ref: info.import_ref 
-                }));
-            }
-        }
-        if (data.po_lookup.ir_to_data) {
-            for (const [ir, info] of Object.entries(data.po_lookup.ir_to_data)) {
-                if (!ir) continue;
-                const normalizedIr = ir.trim().toUpperCase();
-                poPromises.push(poStore.put({ 
-                    id: `ir_${normalizedIr}`, 
-                    type: 'ir', 
-                    value: normalizedIr, 
-                    waybill: info.waybill 
-                }));
-            }
+        if (data.full === false) {
+            await applyMasterDelta(tx, data);
+        } else {
+            await applyFullMasterData(tx, data);
         }
-        await Promise.all(poPromises);
         
-        // Guardar timestamp de sincronización
+        // Guardar timestamp y versión de sincronización
         const metaStore = tx.objectStore('sync_metadata');
         await metaStore.put({ key: 'last_master_sync', value: Date.now() });
+        if (data.version !== undefined) {
+            await metaStore.put({ key: 'master_data_version', value: data.version });
+        }
         
         await tx.done;
-        console.log('✅ Sincronización de maestros completada.');
+        console.log(data.full === false
+            ? `✅ Sincronización delta de maestros completada (v${data.since} → v${data.version}).`
+            : '✅ Sincronización de maestros completada.');
         return true;
     } catch (error) {
         console.error('❌ Error en downloadMasterData:', error);
@@ -88,8 +144,11 @@ export const downloadMasterData = async () => {
     }
 };
 
+const PUSH_BATCH_SIZE = 200; // El servidor acepta hasta 500 registros por lote
+
 /**
  * Sincroniza los registros pendientes hacia el servidor (Inbound, Planner, etc).
+ * Se suben en lotes a /api/sync/push; el servidor responde un resultado por registro.
  */
 export const syncPendingData = async () => {
     if (!navigator.onLine) return;
@@ -101,44 +160,43 @@ export const syncPendingData = async () => {
     
     console.log(`Logix: Intentando sincronizar ${allPending.length} registros pendientes...`);
     
-    for (const record of allPending) {
-        try {
-            // Determinar endpoint según la colección
-            let url = '';
-            let method = '';
-            
-            if (record.collection === 'inbound') {
-                url = record.editId ? `/api/update_log/${record.editId}` : '/api/add_log';
-                method = record.editId ? 'PUT' : 'POST';
-            } else if (record.collection === 'planner') {
-                url = '/api/planner/execution/save';
-                method = 'POST';
-            } else {
-                continue; // Desconocido
-            }
-
-            const payload = {
-                ...record.payload,
-                client_id: record.id
-            };
+    for (let i = 0; i < allPending.length; i += PUSH_BATCH_SIZE) {
+        const batch = allPending.slice(i, i + PUSH_BATCH_SIZE);
+        const records = batch.map((record) => ({
+            client_id: record.id,
+            collection: record.collection,
+            edit_id: record.editId,
+            payload: { ...record.payload, client_id: record.id }
+        }));
 
-            const res = await fetch(url, {
-                method,
+        let results;
+        try {
+            const res = await fetch('/api/sync/push', {
+                method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
+                body: JSON.stringify({ records })
             });
-            
-            if (res.ok) {
-                await db.delete('pending_sync', record.id);
-                console.log(`Registro ${record.id} (${record.collection}) sincronizado.`);
-            } else if (res.status === 409) {
-                // Conflicto: borrar localmente y dejar que el servidor gane
-                await db.delete('pending_sync', record.id);
+            if (!res.ok) {
+                console.error(`Error del servidor al sincronizar lote (${res.status}).`);
+                break;
             }
+            ({ results } = await res.json());
         } catch (error) {
-            console.error(`Error de red al sincronizar ${record.id}:`, error);
+            console.error('Error de red al sincronizar registros pendientes:', error);
             break; // Detener si hay fallo de red real
         }
+
+        const tx = db.transaction('pending_sync', 'readwrite');
+        for (const result of results) {
+            // duplicate: el servidor ya lo tenía (gana el servidor), se borra igual que un guardado
+            if (['saved', 'updated', 'duplicate'].includes(result.status)) {
+                tx.store.delete(result.client_id);
+            } else {
+                console.warn(`Registro ${result.client_id} no sincronizado (${result.status}): ${result.detail || ''}`);
+            }
+        }
+        await tx.done;
+        console.log(`Logix: Lote de ${batch.length} registros procesado.`);
     }
 };
 
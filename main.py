@@ -20,12 +20,12 @@ from app.core.limiter import limiter
 
 # Importar configuración
 from app.core.config import PROJECT_ROOT, SECRET_KEY, ENVIRONMENT
-from app.middleware.security import SchemeMiddleware, HSTSMiddleware
-from app.middleware.csv_cache_reload import CSVCacheReloadMiddleware
+from app.middleware.request_pipeline import RequestPipelineMiddleware
 
 # Importar servicios
 from app.services.database import run_migrations
 from app.services.csv_handler import load_csv_data
+from app.services import export_jobs
 
 # Importar routers existentes
 from app.routers import sessions
@@ -47,6 +47,7 @@ from app.routers import spot_check
 # [NUEVO] Importar router refactorizado para vistas convertidas a API
 from app.routers import api_views
 from app.routers import integrations, sync
+from app.routers import exports
 
 # --- Eventos de ciclo de vida (Lifespan) ---
 @asynccontextmanager
@@ -60,6 +61,7 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print("Cerrando aplicación Logix...")
+    export_jobs.shutdown_pool()
 
 # --- Inicialización de FastAPI ---
 app = FastAPI(
@@ -101,15 +103,14 @@ app.add_middleware(
 
 # --- Middlewares de seguridad ---
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["logixapp.dev", "www.logixapp.dev", "localhost", "127.0.0.1"])
-app.add_middleware(SchemeMiddleware)
-app.add_middleware(HSTSMiddleware)
 app.add_middleware(
     SessionMiddleware, 
     secret_key=SECRET_KEY, 
     max_age=None,
     https_only=True if ENVIRONMENT == 'production' else False # En producción forzar cookies seguras
 )
-app.add_middleware(CSVCacheReloadMiddleware)
+# Scheme (X-Forwarded-Proto) + HSTS + recarga del caché CSV en un solo middleware ASGI (el más externo)
+app.add_middleware(RequestPipelineMiddleware)
 
 # --- Montar estáticos (Legacy Support) ---
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -134,6 +135,7 @@ app.include_router(integrations.router)
 app.include_router(sync.router)
 app.include_router(express_audit.router)
 app.include_router(spot_check.router)
+app.include_router(exports.router)
 
 # --- Endpoint de salud ---
 @app.get("/health")